@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Loopback echo benchmark for :mod:`pysmile.framing`
+
+Starts an echo server on 127.0.0.1 that reads frames and writes them straight back, then
+sends *count* small SMILE documents through it twice: once flushing after every frame
+(one ``sendall`` per message) and once with batched writes.  Reports messages per second
+and the number of ``sendall`` calls made by the client.
+
+Usage::
+
+    python benchmarks/framing_echo.py [count] [batch_size]
+"""
+import os
+import sys
+import time
+import socket
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pysmile import encode
+from pysmile.framing import FrameReader, FrameWriter
+
+__author__ = 'Jonathan Hosmer'
+
+
+def _echo_server(listener):
+    conn, _ = listener.accept()
+    reader = FrameReader()
+    writer = FrameWriter(conn)
+    try:
+        while reader.recv_from(conn):
+            for payload in reader.frames():
+                writer.write(payload)
+            writer.flush()
+    finally:
+        conn.close()
+
+
+def run(count, batch_size):
+    """
+    Echo *count* frames through a loopback server
+
+    :param int count: Number of messages
+    :param int batch_size: Writer batch size (0 flushes after every message)
+    :returns: ``(elapsed seconds, client sendall calls)``
+    :rtype: tuple
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    server = threading.Thread(target=_echo_server, args=(listener,))
+    server.daemon = True
+    server.start()
+
+    client = socket.create_connection(listener.getsockname())
+    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    payload = encode({'id': 12345, 'status': 'OK', 'region': 'us-east-1', 'values': [1, 2, 3]})
+
+    received = [0]
+
+    def _drain():
+        reader = FrameReader()
+        while received[0] < count and reader.recv_from(client):
+            for _ in reader.frames():
+                received[0] += 1
+
+    drain = threading.Thread(target=_drain)
+    drain.daemon = True
+
+    writer = FrameWriter(client, batch_size=batch_size or 1)
+    start = time.time()
+    drain.start()
+    for _ in range(count):
+        writer.write(payload)
+    writer.flush()
+    drain.join()
+    elapsed = time.time() - start
+
+    client.close()
+    listener.close()
+    return elapsed, writer.flush_count
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 100000
+    batch_size = int(argv[2]) if len(argv) > 2 else 64 * 1024
+    for label, size in (('unbatched', 0), ('batched', batch_size)):
+        elapsed, calls = run(count, size)
+        print('{:>10}: {:>9,d} msgs in {:.3f}s  {:>12,.0f} msgs/s  {:>9,d} sendall calls'.format(
+            label, count, elapsed, count / elapsed, calls))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark
+
+Every scenario runs *runs* times in a fresh interpreter.  Reported per scenario:
+
+* the median cumulative import time of ``pysmile`` (``python -X importtime``)
+* the median wall time of the whole process, less that of a bare ``python -c pass``
+* modules from :data:`HEAVY_MODULES` that ended up imported
+
+The run fails (exit status 1) when the median import time of any scenario is over
+``--budget-ms`` or a heavy module is imported by a scenario that does not need it, so it can
+guard cold starts in CI::
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 50 --budget-ms 10
+
+Note that ``PYTHONDONTWRITEBYTECODE`` makes every run compile the package from source;
+run ``python -m compileall pysmile`` first when it is set.
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+__author__ = 'Jonathan Hosmer'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('decimal', 'logging', 'json', 're', 'multiprocessing', 'argparse')
+"""Modules that a plain encode/decode has no use for"""
+
+SCENARIOS = (
+    ('import', 'import pysmile', ()),
+    ('round trip', "import pysmile; pysmile.decode(pysmile.encode({'a': [1, 2.5, 'x', b'y']}))",
+     ()),
+    ('session', 'import pysmile; pysmile.SessionDecoder().decode(pysmile.SessionEncoder()'
+                ".encode({'a': 1}))", ()),
+    ('big decimal', "import pysmile; pysmile.decode(b':)\\n\\x03\\xf8*\\x82\\x81\\x07\\x01\\xf9')",
+     ('decimal',)),
+    ('cli', 'import pysmile.__main__', ('argparse', 'json', 're')),
+)
+"""``(name, code, heavy modules the scenario legitimately needs)``"""
+
+_REPORT = ("; import sys; print(' '.join(m for m in {!r} if m in sys.modules), "
+           "file=sys.stderr)").format(HEAVY_MODULES)
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def _run(code, importtime=False):
+    """
+    :returns: Wall seconds, cumulative ``pysmile`` import microseconds (or ``None``) and the
+              last line of stderr
+    :rtype: tuple
+    """
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, stderr=subprocess.PIPE, universal_newlines=True,
+                          check=True)
+    elapsed = time.perf_counter() - start
+    import_us = None
+    lines = proc.stderr.splitlines()
+    for line in lines:
+        if line.startswith('import time:') and line.split('|')[-1].strip() == 'pysmile':
+            import_us = int(line.split('|')[1])
+    return elapsed, import_us, lines[-1] if lines else ''
+
+
+def measure(code, runs):
+    """
+    :param str code: Scenario
+    :param int runs: Fresh interpreters to start
+    :returns: ``import_ms``, ``wall_ms`` and ``heavy`` (list of module names)
+    :rtype: dict
+    """
+    baseline = _median([_run('pass')[0] for _ in range(runs)])
+    walls, imports = [], []
+    for _ in range(runs):
+        walls.append(_run(code + _REPORT)[0])
+        _, import_us, _ = _run(code, importtime=True)
+        imports.append(import_us or 0)
+    heavy = _run(code + _REPORT)[2].split()
+    return {
+        'import_ms': _median(imports) / 1e3,
+        'wall_ms': max(_median(walls) - baseline, 0) * 1e3,
+        'heavy': heavy,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20,
+                        help='Fresh interpreters per scenario (default: 20)')
+    parser.add_argument('--budget-ms', type=float, default=15.0,
+                        help='Largest accepted median import time of pysmile (default: 15)')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for name, code, needs in SCENARIOS:
+        result = measure(code, args.runs)
+        unexpected = [m for m in result['heavy'] if m not in needs]
+        problems = []
+        if result['import_ms'] > args.budget_ms:
+            problems.append('over budget')
+        if unexpected:
+            problems.append('imports ' + ', '.join(unexpected))
+        failed = failed or bool(problems)
+        print('{:<12} import={:6.2f}ms  process=+{:6.2f}ms  heavy=[{}]  {}'.format(
+            name, result['import_ms'], result['wall_ms'], ', '.join(result['heavy']),
+            'FAIL: ' + '; '.join(problems) if problems else 'ok'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+pysmile encode/decode benchmark suite
+
+Measures, for every fixture corpus and a set of synthetic scaling documents:
+
+* encode and decode throughput (MB/s of JSON text and documents/s)
+* per-document latency percentiles (p50, p90, p99, max)
+* peak memory of a single encode/decode
+* the same figures for ``json.dumps`` / ``json.loads`` as a baseline
+
+Corpora: ``tests/data/json`` (paired with ``tests/data/smile``) and the XML-derived and
+floating point sets under ``tests/data/not_working``.  Documents pysmile can not handle yet
+are reported with an ``error`` entry instead of aborting the run.
+
+Results are printed as a table and written as JSON (``--output``) so runs can be diffed
+across releases::
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --filter numbers --min-time 2
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import resource
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pysmile
+
+__author__ = 'Jonathan Hosmer'
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests')
+
+CORPORA = (
+    ('fixtures', os.path.join(TESTS_DIR, 'data', 'json'), os.path.join(TESTS_DIR, 'data', 'smile')),
+    ('not_working', os.path.join(TESTS_DIR, 'data', 'not_working', 'json'),
+     os.path.join(TESTS_DIR, 'data', 'not_working', 'smile')),
+)
+
+
+def synthetic_documents():
+    """
+    Synthetic scaling sets
+
+    :returns: Generator of ``(name, document)``
+    :rtype: generator
+    """
+    for depth in (10, 100, 400):
+        doc = ['leaf']
+        for i in range(depth):
+            doc = {'level': i, 'child': doc} if i % 2 else [i, doc]
+        yield 'deep-nesting-{}'.format(depth), doc
+    for width in (100, 1000, 10000):
+        yield 'wide-object-{}'.format(width), dict(
+            ('field_{:05d}'.format(i), i) for i in range(width))
+    for length in (1024, 64 * 1024, 1024 * 1024):
+        yield 'long-string-{}'.format(length), {'text': ('lorem ipsum ' * (length // 12 + 1))[:length]}
+    for count in (1000, 10000):
+        yield 'float-array-{}'.format(count), [(i * 1.000001) / 7.0 for i in range(count)]
+
+
+def load_corpora():
+    """
+    Load fixture corpora
+
+    :returns: Generator of ``(corpus, name, document, smile bytes or None)``
+    :rtype: generator
+    """
+    for corpus, json_dir, smile_dir in CORPORA:
+        if not os.path.isdir(json_dir):
+            continue
+        for fname in sorted(os.listdir(json_dir)):
+            if not fname.endswith('.jsn'):
+                continue
+            name = fname[:-len('.jsn')]
+            with open(os.path.join(json_dir, fname), 'rb') as f:
+                doc = json.load(f)
+            smile_path = os.path.join(smile_dir, name + '.smile')
+            smile = None
+            if os.path.exists(smile_path):
+                with open(smile_path, 'rb') as f:
+                    smile = f.read()
+            yield corpus, name, doc, smile
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile
+
+    :param list sorted_values: Sorted samples
+    :param float pct: Percentile (0 - 100)
+    :returns: Sample value
+    :rtype: float
+    """
+    if not sorted_values:
+        return 0.0
+    k = int(round((pct / 100.0) * (len(sorted_values) - 1)))
+    return sorted_values[k]
+
+
+def time_function(func, arg, min_time, min_iterations):
+    """
+    Call ``func(arg)`` repeatedly and record per-call latency
+
+    :param func: Function under test
+    :param arg: Argument
+    :param float min_time: Keep going until this many seconds have been spent
+    :param int min_iterations: ... and at least this many calls have been made
+    :returns: Latency summary (seconds)
+    :rtype: dict
+    """
+    timer = getattr(time, 'perf_counter', time.time)
+    samples = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        deadline = timer() + min_time
+        while len(samples) < min_iterations or timer() < deadline:
+            t0 = timer()
+            func(arg)
+            samples.append(timer() - t0)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    samples.sort()
+    total = sum(samples)
+    return {
+        'iterations': len(samples),
+        'total': total,
+        'mean': total / len(samples),
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'max': samples[-1],
+    }
+
+
+def peak_memory(func, arg):
+    """
+    Peak memory allocated by a single ``func(arg)`` call
+
+    Uses :mod:`tracemalloc` where available; otherwise the call is made in a forked child and
+    the growth of its maximum resident set size over an idle child is reported.
+
+    :param func: Function under test
+    :param arg: Argument
+    :returns: Peak bytes (``None`` if it can not be measured on this platform)
+    :rtype: int | None
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            func(arg)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    if not hasattr(os, 'fork'):
+        return None
+
+    def _child_maxrss(target):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                target()
+            finally:
+                os._exit(0)
+        _, _, usage = os.wait4(pid, 0)
+        return usage.ru_maxrss
+
+    idle = _child_maxrss(lambda: None)
+    busy = _child_maxrss(lambda: func(arg))
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if platform.system() == 'Darwin' else 1024
+    return max(busy - idle, 0) * scale
+
+
+def bench_codec(label, func, arg, doc_bytes, args):
+    """
+    Benchmark one direction of one codec
+
+    :returns: Result entry
+    :rtype: dict
+    """
+    try:
+        func(arg)
+    except Exception as e:
+        # Decode errors carry the whole partial output; keep the report readable
+        message = str(e.args[0] if e.args else e)
+        return {'codec': label, 'error': '{}: {}'.format(type(e).__name__, message[:200])}
+    latency = time_function(func, arg, args.min_time, args.min_iterations)
+    result = {
+        'codec': label,
+        'latency': latency,
+        'docs_per_sec': latency['iterations'] / latency['total'] if latency['total'] else None,
+        'mb_per_sec': (doc_bytes * latency['iterations'] / latency['total'] / 1e6
+                       if latency['total'] else None),
+    }
+    if args.memory:
+        result['peak_memory'] = peak_memory(func, arg)
+    return result
+
+
+def bench_document(corpus, name, doc, smile, args):
+    """
+    Run every codec against a single document
+
+    :returns: Document entry
+    :rtype: dict
+    """
+    json_text = json.dumps(doc)
+    entry = {
+        'corpus': corpus,
+        'name': name,
+        'json_bytes': len(json_text),
+        'results': [],
+    }
+    try:
+        encoded = pysmile.encode(doc)
+    except Exception:
+        encoded = None
+    else:
+        entry['smile_bytes'] = len(encoded)
+    if smile is None:
+        smile = encoded
+
+    size = len(json_text)
+    entry['results'].append(bench_codec('pysmile.encode', pysmile.encode, doc, size, args))
+    if smile is not None:
+        entry['results'].append(bench_codec('pysmile.decode', pysmile.decode, smile, size, args))
+    entry['results'].append(bench_codec('json.dumps', json.dumps, doc, size, args))
+    entry['results'].append(bench_codec('json.loads', json.loads, json_text, size, args))
+    return entry
+
+
+def print_entry(entry):
+    print('{corpus}/{name}  json={json_bytes:,d}B  smile={smile}'.format(
+        smile='{:,d}B'.format(entry['smile_bytes']) if 'smile_bytes' in entry else '-', **entry))
+    for r in entry['results']:
+        if 'error' in r:
+            print('    {:<16} ERROR {}'.format(r['codec'], r['error']))
+            continue
+        lat = r['latency']
+        mem = r.get('peak_memory')
+        print(('    {:<16} {:>9.2f} MB/s {:>11,.0f} docs/s  p50={:.1f}us p90={:.1f}us '
+               'p99={:.1f}us  peak={}').format(
+            r['codec'], r['mb_per_sec'], r['docs_per_sec'], lat['p50'] * 1e6, lat['p90'] * 1e6,
+            lat['p99'] * 1e6, '{:,d}B'.format(mem) if mem is not None else '-'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', '-o', help='Write JSON results to this path')
+    parser.add_argument('--filter', '-k', default='', help='Only run documents containing this')
+    parser.add_argument('--min-time', type=float, default=0.5,
+                        help='Seconds to spend per codec and document (default: 0.5)')
+    parser.add_argument('--min-iterations', type=int, default=5,
+                        help='Minimum calls per codec and document (default: 5)')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='Skip peak memory measurement')
+    parser.add_argument('--no-synthetic', dest='synthetic', action='store_false',
+                        help='Skip synthetic scaling documents')
+    args = parser.parse_args(argv)
+
+    documents = list(load_corpora())
+    if args.synthetic:
+        documents.extend(('synthetic', n, d, None) for n, d in synthetic_documents())
+
+    entries = []
+    for corpus, name, doc, smile in documents:
+        if args.filter not in '{}/{}'.format(corpus, name):
+            continue
+        entry = bench_document(corpus, name, doc, smile, args)
+        print_entry(entry)
+        entries.append(entry)
+
+    if args.output:
+        report = {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'pysmile_file': pysmile.__file__,
+            'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'documents': entries,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
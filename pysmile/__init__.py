@@ -2,14 +2,59 @@
 PySMILE - JSON Binary SMILE format Encoding/Decoding
 """
 
-from .encode import encode, SMILEEncodeError
-from .decode import decode, SMILEDecodeError
+from .encode import encode, dump, fingerprint, SMILEEncodeError
+from .decode import decode, load, DecodeLimits, SMILEDecodeError, SMILELimitError
+from .compress import SMILECompressionError
+from .fragment import RawSmile, FragmentCache
+from .stats import SmileStats
 
 __author__ = 'Jonathan Hosmer'
 
+_LAZY = {
+    'SessionEncoder': 'session',
+    'SessionDecoder': 'session',
+    'compile_encoder': 'schema',
+    'RecordDecoder': 'schema',
+    'transcode_to_json': 'transcode',
+    'transcode_from_json': 'transcode',
+    'SMILETranscodeError': 'transcode',
+    'equal': 'compare',
+    'diff': 'compare',
+}
+"""Exports imported on first access, to keep ``import pysmile`` cheap"""
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    from importlib import import_module
+    value = getattr(import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+
 __all__ = [
     'encode',
     'decode',
+    'dump',
+    'load',
+    'fingerprint',
+    'compile_encoder',
+    'RecordDecoder',
+    'transcode_to_json',
+    'transcode_from_json',
+    'equal',
+    'diff',
+    'SessionEncoder',
+    'SessionDecoder',
+    'SmileStats',
+    'RawSmile',
+    'FragmentCache',
+    'DecodeLimits',
     'SMILEEncodeError',
     'SMILEDecodeError',
+    'SMILELimitError',
+    'SMILECompressionError',
+    'SMILETranscodeError',
 ]
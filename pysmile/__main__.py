@@ -0,0 +1,149 @@
+"""
+pysmile command line
+
+Usage::
+
+    python -m pysmile convert [options] INPUT OUTPUT
+    python -m pysmile analyze [options] PATH [PATH ...]
+
+``-`` reads stdin / writes stdout.  Formats are taken from ``--from``/``--to``, the file
+extension (``.json``, ``.ndjson``/``.jsonl``, ``.smile``) or, for input, the SMILE header.
+
+Examples::
+
+    python -m pysmile convert events.ndjson events.smile --workers 4
+    python -m pysmile convert events.smile - --to ndjson | head
+"""
+import sys
+import errno
+import argparse
+
+from pysmile.constants import *
+from pysmile.convert import FORMATS, convert, guess_format, format_throughput
+
+__author__ = 'Jonathan Hosmer'
+
+
+class _Peeked(object):
+    """``read``/``readline``/iteration that returns *head* before continuing with *fp*"""
+
+    def __init__(self, head, fp):
+        self.head = head
+        self.fp = fp
+
+    def read(self, n=-1):
+        head, self.head = self.head, b''
+        if n < 0:
+            return head + self.fp.read()
+        if len(head) > n:
+            head, self.head = head[:n], head[n:]
+            return head
+        return head + self.fp.read(n - len(head))
+
+    def readline(self, n=-1):
+        head, self.head = self.head, b''
+        if b'\n' in head:
+            line, self.head = head.split(b'\n', 1)
+            return line + b'\n'
+        return head + self.fp.readline()
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def _open_input(path):
+    if path == '-':
+        return sys.stdin.buffer
+    return open(path, 'rb')
+
+
+def _open_output(path):
+    if path == '-':
+        return sys.stdout.buffer
+    return open(path, 'wb')
+
+
+def convert_main(argv):
+    parser = argparse.ArgumentParser(prog='python -m pysmile convert',
+                                     description='Convert between JSON, NDJSON and SMILE')
+    parser.add_argument('input', help='Input file, - for stdin')
+    parser.add_argument('output', help='Output file, - for stdout')
+    parser.add_argument('--from', dest='src_format', choices=FORMATS,
+                        help='Input format (default: from the header or extension)')
+    parser.add_argument('--to', dest='dst_format', choices=FORMATS,
+                        help='Output format (default: from the extension)')
+    parser.add_argument('--workers', '-j', type=int, default=1,
+                        help='Worker processes for NDJSON input (default: 1)')
+    parser.add_argument('--compress', action='store_true',
+                        help='Write SMILE output in a compressed container')
+    parser.add_argument('--no-shared-keys', dest='shared_keys', action='store_false',
+                        help='Do not back reference repeated keys in SMILE output')
+    parser.add_argument('--no-shared-vals', dest='shared_vals', action='store_false',
+                        help='Do not back reference repeated short strings in SMILE output')
+    parser.add_argument('--raw-binary', dest='bin_7bit', action='store_false',
+                        help='Write binary values unencoded in SMILE output')
+    parser.add_argument('--float32', dest='float_mode', action='store_const',
+                        const=FLOAT_MODE_LOSSLESS, default=FLOAT_MODE_DOUBLE,
+                        help='Use 32-bit floats in SMILE output wherever that is exact')
+    parser.add_argument('--quiet', '-q', action='store_true', help='Do not print throughput')
+    args = parser.parse_args(argv)
+
+    try:
+        src = _open_input(args.input)
+    except IOError as e:
+        parser.error(str(e))
+    head = src.read(4)
+    src = _Peeked(head, src)
+    src_format = args.src_format or guess_format(args.input, head)
+    dst_format = args.dst_format or guess_format(args.output)
+    if src_format is None:
+        parser.error('Can not tell the input format of {}, use --from'.format(args.input))
+    if dst_format is None:
+        parser.error('Can not tell the output format of {}, use --to'.format(args.output))
+
+    try:
+        dst = _open_output(args.output)
+    except IOError as e:
+        parser.error(str(e))
+    try:
+        result = convert(src, dst, src_format, dst_format, workers=args.workers,
+                         compress=args.compress, shared_keys=args.shared_keys,
+                         shared_vals=args.shared_vals, bin_7bit=args.bin_7bit,
+                         float_mode=args.float_mode)
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+        # Reader went away (``| head``)
+        return 0
+    finally:
+        if args.output != '-':
+            dst.close()
+        if args.input != '-':
+            src.fp.close()
+    if not args.quiet:
+        print(format_throughput(result), file=sys.stderr)
+    return 0
+
+
+def analyze_main(argv):
+    # Imported here: analyze needs json and timeit, convert does not
+    from pysmile import analyze
+    return analyze.main(argv)
+
+
+COMMANDS = {
+    'convert': convert_main,
+    'analyze': analyze_main,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in COMMANDS:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    return COMMANDS[argv[0]](argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+SMILE encoding efficiency analyzer
+
+For every JSON or SMILE file given (directories are searched recursively) reports:
+
+* the SMILE size against the compact JSON size under every combination of the
+  :func:`pysmile.encode` flags ``shared_keys``, ``shared_vals`` and ``bin_7bit``
+* shared key / shared value hit rates with both tables enabled
+* the keys and string values that are written in full more than once even with both tables
+  enabled -- either because they are too long to be shared (values over 64 bytes) or because
+  the 1024 entry table was reset before they came around again
+* estimated encode and decode time per document
+
+Usage::
+
+    python -m pysmile.analyze tests/data/json
+    python -m pysmile.analyze --top 5 --json report.json archive/*.smile
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+import itertools
+import collections
+
+import pysmile
+from pysmile.constants import *
+from pysmile.encode import SmileGenerator, _encode
+from pysmile.compress import is_compressed
+from pysmile.convert import json_text
+from pysmile.stats import SmileStats
+
+__author__ = 'Jonathan Hosmer'
+
+FLAGS = ('shared_keys', 'shared_vals', 'bin_7bit')
+
+
+def flag_combinations():
+    """
+    :returns: Every combination of :data:`FLAGS`, defaults (all `True`) first
+    :rtype: list
+    """
+    return [dict(zip(FLAGS, values))
+            for values in itertools.product((True, False), repeat=len(FLAGS))]
+
+
+def find_files(paths):
+    """
+    :param list paths: Files and directories
+    :returns: Generator of file paths; directories are walked in sorted order
+    :rtype: generator
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                yield os.path.join(root, fname)
+
+
+def is_smile(data):
+    """
+    :param bytes data: File contents (at least the first 3 bytes)
+    :returns: *data* is a SMILE document or a compressed container
+    :rtype: bool
+    """
+    return data[:3] == HEADER_BYTE_1 + HEADER_BYTE_2 + HEADER_BYTE_3 or is_compressed(data)
+
+
+def load_document(path):
+    """
+    :param str path: JSON or SMILE file
+    :returns: Document and the format it was read from (``'json'`` or ``'smile'``)
+    :rtype: tuple
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if is_smile(data):
+        return pysmile.decode(data), 'smile'
+    return json.loads(data), 'json'
+
+
+class _LiteralCounter(SmileGenerator):
+    """:class:`SmileGenerator` that counts every key and string value it writes in full"""
+
+    def __init__(self):
+        super(_LiteralCounter, self).__init__()
+        self.keys = collections.Counter()
+        self.values = collections.Counter()
+        self.long_values = collections.Counter()
+
+    def write_string(self, text):
+        if text and len(text.encode('utf-8')) > MAX_SHORT_VALUE_STRING_BYTES:
+            self.long_values[text] += 1
+        super(_LiteralCounter, self).write_string(text)
+
+    def _add_seen_name(self, name):
+        self.keys[name] += 1
+        super(_LiteralCounter, self)._add_seen_name(name)
+
+    def _add_seen_string_value(self, text):
+        self.values[text] += 1
+        super(_LiteralCounter, self)._add_seen_string_value(text)
+
+
+def _repeats(counter, reason):
+    """
+    :param collections.Counter counter: Literal writes by string
+    :param str reason: Why the repeats were not back references
+    :returns: Strings written more than once, with the bytes spent on the repeats
+    :rtype: list
+    """
+    return [{'string': s, 'count': n, 'repeat_bytes': (n - 1) * len(s.encode('utf-8')),
+             'reason': reason}
+            for s, n in counter.items() if n > 1]
+
+
+def _top(entries, top):
+    return sorted(entries, key=lambda e: (-e['repeat_bytes'], -e['count'], e['string']))[:top]
+
+
+def missed_back_references(doc, top=10):
+    """
+    Keys and string values written in full more than once with both shared tables enabled
+
+    :param doc: Document
+    :param int top: (optional - Default: 10) Entries to return per kind
+    :returns: ``{'keys': [...], 'values': [...]}``, largest waste first; every entry has
+              ``string``, ``count``, ``repeat_bytes`` and ``reason`` (``'evicted'`` or
+              ``'too long'``)
+    :rtype: dict
+    """
+    sg = _LiteralCounter()
+    _encode(doc, sg, check_circular=False)
+    return {
+        'keys': _top(_repeats(sg.keys, 'evicted'), top),
+        'values': _top(_repeats(sg.values, 'evicted') + _repeats(sg.long_values, 'too long'),
+                       top),
+    }
+
+
+def time_per_call(func, arg, min_time=0.1):
+    """
+    Mean wall time of ``func(arg)``
+
+    :param func: Function
+    :param arg: Argument
+    :param float min_time: (optional - Default: 0.1) Seconds to keep calling for
+    :returns: Seconds per call
+    :rtype: float
+    """
+    timer = timeit.default_timer
+    calls = 0
+    start = timer()
+    deadline = start + min_time
+    while True:
+        func(arg)
+        calls += 1
+        now = timer()
+        if now >= deadline:
+            return (now - start) / calls
+
+
+def analyze_document(doc, top=10, min_time=0.1):
+    """
+    :param doc: Document
+    :param int top: (optional - Default: 10) Missed back references to report per kind
+    :param float min_time: (optional - Default: 0.1) Seconds spent timing each of encode and
+                           decode; 0 skips the timing
+    :returns: Report
+    :rtype: dict
+    """
+    # Binary values count as base64 strings, as python -m pysmile convert writes them
+    json_bytes = len(json_text(doc, ensure_ascii=True))
+    sizes = []
+    for flags in flag_combinations():
+        size = len(pysmile.encode(doc, **flags))
+        sizes.append(dict(flags, smile_bytes=size, ratio=float(size) / json_bytes))
+
+    stats = SmileStats()
+    smile = pysmile.encode(doc, stats=stats)
+    report = {
+        'json_bytes': json_bytes,
+        'sizes': sizes,
+        'shared_keys': stats.as_dict()['shared_keys'],
+        'shared_values': stats.as_dict()['shared_values'],
+        'missed': missed_back_references(doc, top),
+    }
+    if min_time > 0:
+        report['encode_seconds'] = time_per_call(pysmile.encode, doc, min_time)
+        report['decode_seconds'] = time_per_call(pysmile.decode, smile, min_time)
+    return report
+
+
+def _flag_label(entry):
+    return ' '.join('{}={}'.format(flag, 'Y' if entry[flag] else 'N') for flag in FLAGS)
+
+
+def format_report(path, source, report):
+    """
+    :param str path: File
+    :param str source: Format the file was read in
+    :param dict report: :func:`analyze_document` report
+    :returns: Human readable report
+    :rtype: str
+    """
+    lines = ['{} ({})  json={:,d}B'.format(path, source, report['json_bytes'])]
+    for entry in report['sizes']:
+        lines.append('    {}  smile={:>10,d}B  {:6.1%} of JSON'.format(
+            _flag_label(entry), entry['smile_bytes'], entry['ratio']))
+    lines.append('    shared key hit rate {:.1%}, shared value hit rate {:.1%}'.format(
+        report['shared_keys']['hit_rate'], report['shared_values']['hit_rate']))
+    if 'encode_seconds' in report:
+        lines.append('    encode {:.1f}us  decode {:.1f}us'.format(
+            report['encode_seconds'] * 1e6, report['decode_seconds'] * 1e6))
+    for kind in ('keys', 'values'):
+        for entry in report['missed'][kind]:
+            lines.append('    missed {:<6} x{:<5d} {:>8,d}B  {:<9} {!r}'.format(
+                kind[:-1], entry['count'], entry['repeat_bytes'], entry['reason'],
+                entry['string'][:60]))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pysmile.analyze',
+                                     description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='JSON or SMILE files or directories')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Missed back references to list per file (default: 10)')
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help='Seconds spent timing encode and decode per file, 0 to skip '
+                             '(default: 0.1)')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Also write the reports as JSON to PATH ("-" for stdout only)')
+    args = parser.parse_args(argv)
+
+    reports = {}
+    failed = 0
+    for path in find_files(args.paths):
+        try:
+            doc, source = load_document(path)
+        except (OSError, ValueError, pysmile.SMILEDecodeError,
+                pysmile.SMILECompressionError) as e:
+            print('{}: skipped ({})'.format(path, e), file=sys.stderr)
+            failed += 1
+            continue
+        report = analyze_document(doc, args.top, args.min_time)
+        report['source'] = source
+        reports[path] = report
+        if args.json != '-':
+            print(format_report(path, source, report))
+
+    if args.json:
+        text = json.dumps(reports, indent=2, sort_keys=True)
+        if args.json == '-':
+            print(text)
+        else:
+            with open(args.json, 'w') as f:
+                f.write(text)
+    return 1 if failed and not reports else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
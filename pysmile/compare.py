@@ -0,0 +1,417 @@
+"""
+SMILE Document Comparison
+
+:func:`equal` and :func:`diff` compare two encoded documents without decoding them::
+
+    if not pysmile.equal(previous, snapshot):
+        for path, old, new in pysmile.diff(previous, snapshot):
+            ...
+
+Both documents are walked token by token, in lockstep; back references are resolved on each
+side, so documents written with different header flags or back reference tables still
+compare by what they hold.  Only scalars, and values where the two documents part ways (a
+member that is only in one of them, an array that became an object, ...), are decoded.
+
+Wherever the two documents have the same header and their decoders have the same back
+reference tables, the bytes that follow mean the same thing on both sides: the longest
+identical run of bytes is found with byte comparisons, and only one side of it is walked,
+to keep track of the structure and the tables.  An unchanged document is a single byte
+comparison.
+
+Values compare like decoded values do (``1 == 1.0``), except that NaN is equal to NaN.
+Objects whose members come in a different order are equal; the members of an object are
+walked in lockstep until the first one whose name differs, and the rest of both objects is
+then decoded and compared as ``dict``.
+"""
+from pysmile.constants import *
+from pysmile.compress import is_compressed, decompress
+from pysmile.decode import DecodeState, _SharedStrings, _VALUE_DECODERS, _decode_tokens
+from pysmile.lazy import _SKIPPERS
+
+__author__ = 'Jonathan Hosmer'
+
+
+class _Missing(object):
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()
+"""Old or new value in a change of :func:`diff` where a member or element was added or
+removed"""
+
+_RUN_CHUNK = 16
+"""Bytes compared at first when looking for the end of an identical run (then twice as
+many at a time)"""
+
+
+class _Table(_SharedStrings):
+    """Back reference table that counts the strings added to it, across restarts"""
+
+    def __init__(self, capacity):
+        super(_Table, self).__init__(capacity)
+        self.added = 0
+
+    def append(self, value):
+        # No limit on the number of strings: the table only starts over
+        if len(self) >= self.full:
+            del self[:]
+        list.append(self, value)
+        self.added += 1
+
+
+def equal(a, b):
+    """
+    Whether two encoded documents hold equal values
+
+    Stops at the first difference.
+
+    :param a: Encoded document (``bytes``, ``bytearray`` or ``memoryview``; compressed
+              containers are inflated)
+    :param b: Encoded document
+    :rtype: bool
+    :raises SMILEDecodeError: If a document is invalid, up to where they differ
+    """
+    if a == b:
+        return True
+    return not _compare(a, b, True)
+
+
+def diff(a, b):
+    """
+    Changes from one encoded document to another
+
+    Every change is a ``(path, old, new)`` tuple, in document order.  *path* is a tuple of
+    member names and array indexes from the root value to the changed value (``()`` when the
+    root value itself changed); *old* and *new* are the decoded values, or :data:`MISSING`
+    for a member or element that was added or removed.  Elements are compared by index: an
+    element inserted into an array changes every element after it.
+
+    :param a: Encoded document (``bytes``, ``bytearray`` or ``memoryview``; compressed
+              containers are inflated)
+    :param b: Encoded document
+    :returns: Changes; empty if the documents are equal
+    :rtype: list
+    :raises SMILEDecodeError: If a document is invalid
+    """
+    if a == b:
+        return []
+    return _compare(a, b, False)
+
+
+def _state(data):
+    """
+    :param data: Encoded document
+    :rtype: DecodeState
+    """
+    if is_compressed(data):
+        data = decompress(data)
+    return DecodeState(data, shared_keys=_Table(MAX_SHARED_NAMES),
+                       shared_values=_Table(MAX_SHARED_STRING_VALUES))
+
+
+def _compare(a, b, first):
+    """
+    :param a: Encoded document
+    :param b: Encoded document
+    :param bool first: Stop at the first change
+    :returns: Changes
+    :rtype: list
+    """
+    sa, sb = _state(a), _state(b)
+    changes = []
+    _walk(sa, sb, changes, first)
+    if not changes or not first:
+        for state in (sa, sb):
+            byt = state.pull_byte()
+            if byt is not None and byt != BYTE_MARKER_END_OF_CONTENT:
+                raise state.error('Trailing data after document', state.index - 1)
+    return changes
+
+
+def _walk(sa, sb, changes, first):
+    """
+    Compare the documents that *sa* and *sb* are positioned at
+
+    :param DecodeState sa: Decoder state of the old document, positioned after the header
+    :param DecodeState sb: Decoder state of the new document, positioned after the header
+    :param list changes: Changes found are appended to it
+    :param bool first: Stop at the first change
+    """
+    keys_a, values_a = sa.shared_key_strings, sa.shared_value_strings
+    keys_b, values_b = sb.shared_key_strings, sb.shared_value_strings
+    same_header = sa.s[:4] == sb.s[:4]
+    synced = same_header
+    # Strings added last that are the same on both sides, for each table: the tables are the
+    # same when they are as long on both sides and no longer than that
+    key_match = value_match = 0
+    # Open containers, outermost first: [is an object, current member name or element index]
+    stack = []
+    # The current member name has been read on both sides, its value has not
+    pending = False
+    while True:
+        if synced:
+            run_end = sa.index + _common_length(sa.s, sa.index, sb.s, sb.index)
+            if run_end > sa.index:
+                offset = sb.index - sa.index
+                pending, done = _follow(sa, run_end, stack, pending)
+                sb.index = sa.index + offset
+                # The tables of *sa* only grew (see _follow)
+                list.extend(keys_b, keys_a[len(keys_b):])
+                list.extend(values_b, values_a[len(values_b):])
+                key_match, value_match = len(keys_a), len(values_a)
+                if done:
+                    return
+
+        added = keys_a.added, keys_b.added, values_a.added, values_b.added
+        top = stack[-1] if stack else None
+        if top is not None and top[0] and not pending:
+            ta, tb = sa.next_byte(), sb.next_byte()
+            if ta == TOKEN_LITERAL_END_OBJECT and tb == TOKEN_LITERAL_END_OBJECT:
+                stack.pop()
+            else:
+                ka = MISSING if ta == TOKEN_LITERAL_END_OBJECT else sa.read_key(ta)
+                kb = MISSING if tb == TOKEN_LITERAL_END_OBJECT else sb.read_key(tb)
+                if ka == kb:
+                    top[1] = ka
+                    pending = True
+                else:
+                    # Members in another order, or added or removed: compare what is left
+                    # of both objects by name
+                    stack.pop()
+                    _diff_values(_path(stack), _rest_of_object(sa, ka),
+                                 _rest_of_object(sb, kb), changes)
+        else:
+            ta, tb = sa.next_byte(), sb.next_byte()
+            in_array = top is not None and not top[0]
+            if in_array and (ta == TOKEN_LITERAL_END_ARRAY or tb == TOKEN_LITERAL_END_ARRAY):
+                stack.pop()
+                if ta != tb:
+                    # Elements added or removed at the end
+                    path = _path(stack)
+                    for ix, value in enumerate(_rest_of_array(sa, ta), top[1] + 1):
+                        changes.append((path + (ix,), value, MISSING))
+                    for ix, value in enumerate(_rest_of_array(sb, tb), top[1] + 1):
+                        changes.append((path + (ix,), MISSING, value))
+            else:
+                if in_array:
+                    top[1] += 1
+                pending = False
+                if ta == tb and (ta == TOKEN_LITERAL_START_ARRAY or
+                                 ta == TOKEN_LITERAL_START_OBJECT):
+                    stack.append([ta == TOKEN_LITERAL_START_OBJECT, -1])
+                else:
+                    old, new = _value(sa, ta), _value(sb, tb)
+                    if not (old == new or old != old and new != new):
+                        changes.append((_path(stack), old, new))
+
+        if not stack or changes and first:
+            return
+        # Identical runs can be skipped again once both sides have the same tables
+        key_match = _matching(keys_a, keys_b, added[0], added[1], key_match)
+        value_match = _matching(values_a, values_b, added[2], added[3], value_match)
+        synced = (same_header and len(keys_a) == len(keys_b) <= key_match and
+                  len(values_a) == len(values_b) <= value_match)
+
+
+def _matching(a, b, added_a, added_b, match):
+    """
+    :param _Table a: Table of one side
+    :param _Table b: Table of the other side
+    :param int added_a: Strings added to *a* before the last step
+    :param int added_b: Strings added to *b* before the last step
+    :param int match: Strings added last that were the same on both sides before the step
+    :returns: Strings added last that are the same on both sides (at least)
+    :rtype: int
+    """
+    count_a, count_b = a.added - added_a, b.added - added_b
+    if not count_a and not count_b:
+        return match
+    # Only the strings of this step are compared: earlier ones are covered by *match* if
+    # both sides added as many, and not worth comparing otherwise
+    n = min(count_a, count_b, len(a), len(b))
+    same = 0
+    while same < n and a[-1 - same] == b[-1 - same]:
+        same += 1
+    if count_a == count_b and same == n:
+        return match + count_a
+    return same
+
+
+def _follow(state, run_end, stack, pending):
+    """
+    Walk the tokens of one side of an identical run, keeping track of the structure
+
+    Stops before a token that does not end inside the run (it differs between the two
+    documents), and before a string that would make a back reference table start over (the
+    table could not be put back as it was if that string turned out to differ).
+
+    :param DecodeState state: Decoder state
+    :param int run_end: Offset of the end of the run
+    :param list stack: Open containers (see :func:`_walk`); updated
+    :param bool pending: See :func:`_walk`
+    :returns: Updated *pending*, and whether the root value is complete
+    :rtype: (bool, bool)
+    """
+    s = state.s
+    keys, values = state.shared_key_strings, state.shared_value_strings
+    share_keys, share_values = state.header.shared_keys, state.header.shared_values
+    read_key = state.read_key
+    while state.index < run_end:
+        start = state.index
+        byt = s[start]
+        top = stack[-1] if stack else None
+        if top is not None and top[0] and not pending:
+            if byt == TOKEN_LITERAL_END_OBJECT:
+                state.index += 1
+                stack.pop()
+                if not stack:
+                    return pending, True
+                continue
+            table = keys if share_keys and (byt >= TOKEN_PREFIX_KEY_ASCII or
+                                            byt == TOKEN_KEY_LONG_STRING) else None
+            if table is not None and len(table) >= table.full:
+                break
+            state.index += 1
+            key = read_key(byt)
+            if state.index > run_end:
+                if table is not None:
+                    table.pop()
+                state.index = start
+                break
+            top[1] = key
+            pending = True
+            continue
+        if top is not None and not top[0] and byt == TOKEN_LITERAL_END_ARRAY:
+            state.index += 1
+            stack.pop()
+            if not stack:
+                return pending, True
+            continue
+        if byt == TOKEN_LITERAL_START_ARRAY or byt == TOKEN_LITERAL_START_OBJECT:
+            state.index += 1
+            if top is not None and not top[0]:
+                top[1] += 1
+            pending = False
+            stack.append([byt == TOKEN_LITERAL_START_OBJECT, -1])
+            continue
+        table = values if share_values and (TOKEN_PREFIX_TINY_ASCII <= byt <
+                                            TOKEN_PREFIX_SMALL_INT) else None
+        if table is not None and len(table) >= table.full:
+            break
+        state.index += 1
+        _SKIPPERS[byt](state, byt)
+        if state.index > run_end:
+            if table is not None:
+                table.pop()
+            state.index = start
+            break
+        if top is None:
+            return pending, True
+        if not top[0]:
+            top[1] += 1
+        pending = False
+    return pending, False
+
+
+def _common_length(a, i, b, j):
+    """
+    :param bytes a: Buffer
+    :param int i: Offset in *a*
+    :param bytes b: Buffer
+    :param int j: Offset in *b*
+    :returns: Length of the longest identical run of bytes at *i* in *a* and *j* in *b*
+    :rtype: int
+    """
+    n = min(len(a) - i, len(b) - j)
+    length = 0
+    size = _RUN_CHUNK
+    while length < n:
+        size = min(size, n - length)
+        if a[i + length:i + length + size] != b[j + length:j + length + size]:
+            # The first difference is in this chunk
+            while size > 1:
+                half = size // 2
+                if a[i + length:i + length + half] == b[j + length:j + length + half]:
+                    length += half
+                    size -= half
+                else:
+                    size = half
+            return length
+        length += size
+        size *= 2
+    return length
+
+
+def _path(stack):
+    """
+    :param list stack: Open containers (see :func:`_walk`)
+    :returns: Path of the current value
+    :rtype: tuple
+    """
+    return tuple(frame[1] for frame in stack)
+
+
+def _value(state, byt):
+    """
+    :param DecodeState state: Decoder state
+    :param int byt: First token of the value, just read
+    :returns: Decoded value
+    """
+    if byt == TOKEN_LITERAL_START_ARRAY or byt == TOKEN_LITERAL_START_OBJECT:
+        state.index -= 1
+        return _decode_tokens(state, None, None, state.next_byte, state.read_key,
+                              _VALUE_DECODERS)
+    return _VALUE_DECODERS[byt](state, byt)
+
+
+def _rest_of_object(state, key):
+    """
+    :param DecodeState state: Decoder state, positioned at the value of *key*
+    :param key: Member name just read, or :data:`MISSING` at the end of the object
+    :returns: Members from *key* to the end of the object
+    :rtype: dict
+    """
+    members = {}
+    while key is not MISSING:
+        members[key] = _value(state, state.next_byte())
+        byt = state.next_byte()
+        key = MISSING if byt == TOKEN_LITERAL_END_OBJECT else state.read_key(byt)
+    return members
+
+
+def _rest_of_array(state, byt):
+    """
+    :param DecodeState state: Decoder state
+    :param int byt: Token just read: the first of an element, or the end of the array
+    :returns: Elements to the end of the array
+    :rtype: list
+    """
+    elements = []
+    while byt != TOKEN_LITERAL_END_ARRAY:
+        elements.append(_value(state, byt))
+        byt = state.next_byte()
+    return elements
+
+
+def _diff_values(path, old, new, changes):
+    """
+    Compare decoded values
+
+    :param tuple path: Path of the values
+    :param old: Old value
+    :param new: New value
+    :param list changes: Changes found are appended to it
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in old.items():
+            _diff_values(path + (key,), value, new.get(key, MISSING), changes)
+        for key, value in new.items():
+            if key not in old:
+                changes.append((path + (key,), MISSING, value))
+    elif isinstance(old, list) and isinstance(new, list):
+        for ix in range(max(len(old), len(new))):
+            _diff_values(path + (ix,), old[ix] if ix < len(old) else MISSING,
+                         new[ix] if ix < len(new) else MISSING, changes)
+    elif not (old == new or old != old and new != new):
+        changes.append((path, old, new))
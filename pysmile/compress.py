@@ -0,0 +1,213 @@
+"""
+SMILE Compressed Container
+
+Block compression of SMILE output with :mod:`zlib`.  A container looks like::
+
+    ':' ')' 'z' <version/method>        4 byte container header
+    <length (>I)> <deflate block>       repeated
+    0x00 0x00 0x00 0x00                 end of container
+
+All blocks belong to a single zlib stream (``MAX_WBITS``, so it carries an adler32 checksum);
+each one ends on a sync flush, so a reader can inflate it as soon as it has been read and
+never needs more than one block of compressed input in memory.
+"""
+import zlib
+import struct
+
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+BLOCK_HEADER = struct.Struct('>I')
+
+COMPRESSED_HEADER = (HEADER_BYTE_1 + HEADER_BYTE_2 + COMPRESSED_HEADER_BYTE_3 +
+                     bytes([COMPRESSED_HEADER_BYTE_4]))
+
+
+class SMILECompressionError(Exception):
+    pass
+
+
+def is_compressed(data):
+    """
+    Check whether *data* starts with a compressed container header
+
+    :param bytes|bytearray data: Data (at least the first 3 bytes)
+    :rtype: bool
+    """
+    return bytes(data[:3]) == COMPRESSED_HEADER[:3]
+
+
+class CompressedWriter(object):
+    """
+    Streaming writer of a compressed container.
+
+    Bytes passed to :meth:`write` are collected until *block_size* of them are pending, then
+    deflated and handed to *sink* as one block; memory use is bounded by the block size no
+    matter how large the document is.  :meth:`close` must be called to finish the container.
+    """
+
+    def __init__(self, sink, level=DEFAULT_COMPRESS_LEVEL, block_size=DEFAULT_COMPRESS_BLOCK_SIZE):
+        """
+        CompressedWriter Initializer
+
+        :param sink: File-like object (``write``) that receives the container
+        :param int level: (optional - Default: 6) zlib compression level
+        :param int block_size: (optional - Default: 64 KiB) Uncompressed bytes per block
+        """
+        self._write = sink.write
+        self.block_size = int(block_size)
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, MAX_WBITS)
+        self.pending = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.closed = False
+        self._emit(COMPRESSED_HEADER)
+
+    def _emit(self, data):
+        self._write(data)
+        self.bytes_out += len(data)
+
+    def _emit_block(self, chunk, mode=zlib.Z_SYNC_FLUSH):
+        block = self.compressor.compress(bytes(chunk)) + self.compressor.flush(mode)
+        if block:
+            self._emit(BLOCK_HEADER.pack(len(block)) + block)
+
+    def write(self, data):
+        """
+        Compress *data*
+
+        :param bytes|bytearray data: Uncompressed SMILE bytes
+        """
+        if self.closed:
+            raise SMILECompressionError('Write to a closed container')
+        pending = self.pending
+        pending.extend(data)
+        self.bytes_in += len(data)
+        block_size = self.block_size
+        if len(pending) >= block_size:
+            offset = 0
+            while len(pending) - offset >= block_size:
+                self._emit_block(pending[offset:offset + block_size])
+                offset += block_size
+            del pending[:offset]
+
+    def close(self):
+        """Flush the last block and write the end of container marker"""
+        if self.closed:
+            return
+        self._emit_block(self.pending, zlib.Z_FINISH)
+        self.pending = bytearray()
+        self._emit(BLOCK_HEADER.pack(0))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+
+def _buffer_reader(data):
+    """
+    ``read(n)`` over an in-memory buffer without copying it up front
+
+    :param bytes|bytearray data: Data
+    """
+    view = memoryview(data)
+    pos = [0]
+
+    def _read(n):
+        start = pos[0]
+        pos[0] = start + n
+        return view[start:start + n].tobytes()
+    return _read
+
+
+def iter_decompress(src):
+    """
+    Inflate a compressed container block by block
+
+    :param src: Container bytes or a file-like object (``read``) positioned at its start
+    :returns: Generator of uncompressed chunks of at most 64 KiB
+    :raises SMILECompressionError: On a bad header, truncated input or corrupt data
+    """
+    read = src.read if hasattr(src, 'read') else _buffer_reader(src)
+    header = read(len(COMPRESSED_HEADER))
+    if len(header) < 4 or header[:3] != COMPRESSED_HEADER[:3]:
+        raise SMILECompressionError('Invalid compressed container header: {!r}'.format(header))
+    if header[3] & 0x0F != COMPRESSED_METHOD_ZLIB:
+        raise SMILECompressionError(
+            'Unsupported compression method: 0x{:x}'.format(header[3] & 0x0F))
+    decompressor = zlib.decompressobj(MAX_WBITS)
+    while True:
+        raw = read(BLOCK_HEADER.size)
+        if len(raw) < BLOCK_HEADER.size:
+            raise SMILECompressionError('Truncated compressed container')
+        length, = BLOCK_HEADER.unpack(raw)
+        if not length:
+            break
+        block = read(length)
+        if len(block) < length:
+            raise SMILECompressionError('Truncated compressed block')
+        # Inflated a block size at a time: a block can expand a thousandfold
+        while True:
+            try:
+                chunk = decompressor.decompress(block, DEFAULT_COMPRESS_BLOCK_SIZE)
+            except zlib.error as e:
+                raise SMILECompressionError('Corrupt compressed block: {}'.format(e))
+            if chunk:
+                yield chunk
+            block = decompressor.unconsumed_tail
+            if not block and len(chunk) < DEFAULT_COMPRESS_BLOCK_SIZE:
+                break
+    if not decompressor.eof:
+        # A block is missing: the end marker came before the end of the zlib stream (and
+        # its checksum)
+        raise SMILECompressionError('Truncated compressed stream')
+    if decompressor.unused_data or decompressor.unconsumed_tail:
+        raise SMILECompressionError('Trailing data inside compressed container')
+
+
+def compress(data, level=DEFAULT_COMPRESS_LEVEL, block_size=DEFAULT_COMPRESS_BLOCK_SIZE,
+             threshold=DEFAULT_COMPRESS_THRESHOLD):
+    """
+    Wrap already encoded SMILE data in a compressed container
+
+    :param bytes data: SMILE data
+    :param int level: (optional - Default: 6) zlib compression level
+    :param int block_size: (optional - Default: 64 KiB) Uncompressed bytes per block
+    :param int threshold: (optional - Default: 1 KiB) *data* shorter than this is returned as-is
+    :returns: Compressed container (or *data* if below *threshold*)
+    :rtype: bytes
+    """
+    if len(data) < threshold:
+        return bytes(data)
+    out = _Sink()
+    with CompressedWriter(out, level, block_size) as writer:
+        writer.write(data)
+    return bytes(out.data)
+
+
+def decompress(data):
+    """
+    Unwrap a compressed container
+
+    :param data: Container bytes or a file-like object (``read``)
+    :returns: SMILE data
+    :rtype: bytearray
+    """
+    out = bytearray()
+    for chunk in iter_decompress(data):
+        out.extend(chunk)
+    return out
+
+
+class _Sink(object):
+    """Minimal in-memory ``write`` target"""
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data.extend(data)
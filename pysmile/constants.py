@@ -84,17 +84,17 @@ BYTE_MARKER_END_OF_CONTENT = 0xFF
 #
 # First byte of data header (0x3A)
 #
-HEADER_BYTE_1 = ':'
+HEADER_BYTE_1 = b':'
 
 #
 # Second byte of data header (0x29)
 #
-HEADER_BYTE_2 = ')'
+HEADER_BYTE_2 = b')'
 
 #
 # Third byte of data header
 #
-HEADER_BYTE_3 = '\n'
+HEADER_BYTE_3 = b'\n'
 
 NULL_BIT = 0x0
 #
@@ -315,8 +315,75 @@ TOKEN_BYTE_BIG_INTEGER = int((TOKEN_PREFIX_INTEGER + TOKEN_MISC_INTEGER_BIG))
 TOKEN_BYTE_FLOAT_32 = int((TOKEN_PREFIX_FP | TOKEN_MISC_FLOAT_32))
 TOKEN_BYTE_FLOAT_64 = int((TOKEN_PREFIX_FP | TOKEN_MISC_FLOAT_64))
 TOKEN_BYTE_BIG_DECIMAL = int((TOKEN_PREFIX_FP | TOKEN_MISC_FLOAT_BIG))
-MIN_INT_AS_LONG = long(-sys.maxint - 1)
-MAX_INT_AS_LONG = long(sys.maxint)
+MIN_INT_AS_LONG = -sys.maxsize - 1
+MAX_INT_AS_LONG = sys.maxsize
+
+#
+# Java int/long ranges: integers outside the long range are written as
+# BigInteger, BigDecimal scales must fit an int
+#
+MIN_INT_32 = -(1 << 31)
+MAX_INT_32 = (1 << 31) - 1
+MIN_LONG = -(1 << 63)
+MAX_LONG = (1 << 63) - 1
+
+#
+# Float encoding policies: LOSSLESS writes a value as 32-bit float only if
+# that is exact (otherwise 64-bit), DOUBLE always writes 64-bit floats
+#
+FLOAT_MODE_LOSSLESS = 'lossless'
+FLOAT_MODE_DOUBLE = 'double'
 
 DEFAULT_NAME_BUFFER_LENGTH = 64
 DEFAULT_STRING_VALUE_BUFFER_LENGTH = 64
+
+#
+#
+#  Compressed container
+#
+# Compressed SMILE output is wrapped in a small container so decoders can
+# tell it apart from a plain document: the first two bytes match the SMILE
+# header (":)"), the third is 'z' instead of '\n' and the fourth holds the
+# container version nibble and the compression method.
+#
+COMPRESSED_HEADER_BYTE_3 = b'z'
+COMPRESSED_VERSION_0 = NULL_BIT
+COMPRESSED_METHOD_ZLIB = 0x00
+COMPRESSED_HEADER_BYTE_4 = (COMPRESSED_VERSION_0 << 4) | COMPRESSED_METHOD_ZLIB
+
+#
+# Uncompressed bytes collected before a compressed block is emitted; also
+# the most a reader has to hold in memory for a single block
+#
+DEFAULT_COMPRESS_BLOCK_SIZE = 64 * 1024
+
+#
+# Documents smaller than this are written as plain SMILE even when
+# compression is requested; deflate does not pay off for them
+#
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+DEFAULT_COMPRESS_LEVEL = 6
+
+#
+# Document streams (multiple documents read from one file): bytes read at a
+# time, and the largest single document a reader buffers before giving up
+#
+DEFAULT_READ_SIZE = 64 * 1024
+DEFAULT_MAX_DOCUMENT_SIZE = 64 * 1024 * 1024
+
+#
+# Decode limits for untrusted input (see pysmile.decode.DecodeLimits):
+# nesting depth, bytes per string / binary value / big number payload, and
+# values (scalars, arrays and objects) per document
+#
+DEFAULT_MAX_DEPTH = 1000
+DEFAULT_MAX_STRING_LENGTH = 20 * 1024 * 1024
+DEFAULT_MAX_BINARY_LENGTH = 20 * 1024 * 1024
+DEFAULT_MAX_NUMBER_LENGTH = 1000
+DEFAULT_MAX_ELEMENTS = 10 * 1024 * 1024
+
+#
+# Encoded sub-objects kept by a pysmile.fragment.FragmentCache
+#
+DEFAULT_FRAGMENT_CACHE_SIZE = 128
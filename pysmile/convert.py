@@ -0,0 +1,347 @@
+"""
+SMILE Conversion
+
+Bulk conversion between JSON, NDJSON and (multi-document) SMILE.
+
+Formats:
+
+``json``
+    A single JSON document.  Several documents are written as a JSON array.
+``ndjson``
+    One JSON document per line.
+``smile``
+    One or more SMILE documents, each with a header and followed by an end marker, as read
+    by :func:`pysmile.decode.iter_load`; optionally wrapped in one compressed container.
+
+Documents are read, converted and written one at a time, so memory use does not grow with
+the number of documents (a ``json`` input is a single document and is loaded whole).  NDJSON
+input can be converted by several worker processes; output order is preserved.
+
+Key order is preserved in every direction.
+"""
+import json
+import time
+import base64
+import collections
+
+from pysmile.constants import *
+from pysmile.encode import encode
+from pysmile.decode import iter_load
+from pysmile.compress import CompressedWriter, is_compressed
+
+__author__ = 'Jonathan Hosmer'
+
+FORMATS = ('json', 'ndjson', 'smile')
+
+EXTENSIONS = {
+    '.json': 'json',
+    '.jsn': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.smile': 'smile',
+    '.sml': 'smile',
+}
+"""Format by file extension"""
+
+DEFAULT_BATCH_LINES = 1000
+"""NDJSON lines handed to a worker process at a time"""
+
+
+class SMILEConvertError(Exception):
+    pass
+
+
+def guess_format(path, head=b''):
+    """
+    :param str path: File name (``-`` for stdin/stdout)
+    :param bytes head: (optional) First bytes of an input file
+    :returns: Format, or ``None`` if it can not be told
+    :rtype: str
+    """
+    if head[:3] == HEADER_BYTE_1 + HEADER_BYTE_2 + HEADER_BYTE_3 or is_compressed(head):
+        return 'smile'
+    for ext, fmt in EXTENSIONS.items():
+        if path.lower().endswith(ext):
+            return fmt
+    return None
+
+
+class _HasDecimal(Exception):
+    pass
+
+
+def _json_default(obj):
+    """Values SMILE has and JSON does not: binary as base64 (decimals: see :func:`json_text`)"""
+    import decimal
+    if isinstance(obj, decimal.Decimal):
+        raise _HasDecimal()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(obj).decode('ascii')
+    raise TypeError(repr(obj) + ' is not JSON serializable')
+
+
+def json_text(doc, ensure_ascii=False):
+    """
+    Compact JSON text of a document
+
+    Decimals are written as numbers with all of their digits, which ``json.dumps`` can not
+    do: documents that hold any are written a value at a time.
+
+    :param doc: Document
+    :param bool ensure_ascii: (optional - Default: `False`) Escape non-ASCII characters
+    :rtype: str
+    """
+    try:
+        return json.dumps(doc, separators=(',', ':'), ensure_ascii=ensure_ascii,
+                          default=_json_default)
+    except _HasDecimal:
+        pieces = []
+        _decimal_json(doc, ensure_ascii, pieces)
+        return ''.join(pieces)
+
+
+def _decimal_json(value, ensure_ascii, pieces):
+    """
+    :param value: Value
+    :param bool ensure_ascii: See :func:`json_text`
+    :param list pieces: JSON text of *value* is appended to it
+    """
+    import decimal
+    if isinstance(value, decimal.Decimal):
+        pieces.append(str(value))
+    elif isinstance(value, dict):
+        pieces.append('{')
+        for i, (key, member) in enumerate(value.items()):
+            if i:
+                pieces.append(',')
+            # Keys as json.dumps() makes them strings
+            pieces.append(json.dumps({key: 0}, separators=(',', ':'),
+                                     ensure_ascii=ensure_ascii)[1:-3])
+            pieces.append(':')
+            _decimal_json(member, ensure_ascii, pieces)
+        pieces.append('}')
+    elif isinstance(value, (list, tuple)):
+        pieces.append('[')
+        for i, element in enumerate(value):
+            if i:
+                pieces.append(',')
+            _decimal_json(element, ensure_ascii, pieces)
+        pieces.append(']')
+    else:
+        pieces.append(json.dumps(value, ensure_ascii=ensure_ascii, default=_json_default))
+
+
+def serialize(doc, fmt, **encode_kwargs):
+    """
+    Serialize a single document for the output stream of *fmt*
+
+    :param doc: Document
+    :param str fmt: Output format
+    :param encode_kwargs: :func:`pysmile.encode` keyword arguments (``smile`` only)
+    :rtype: bytes
+    """
+    if fmt == 'smile':
+        return encode(doc, ender=True, **encode_kwargs)
+    text = json_text(doc)
+    if fmt == 'ndjson':
+        text += '\n'
+    return text.encode('utf-8')
+
+
+def read_documents(fp, fmt):
+    """
+    :param fp: Binary file-like object
+    :param str fmt: Input format
+    :returns: Generator of documents
+    :rtype: generator
+    """
+    if fmt == 'smile':
+        for doc in iter_load(fp, object_pairs_hook=collections.OrderedDict, binary_view=True):
+            yield doc
+    elif fmt == 'ndjson':
+        for line in _ndjson_lines(fp):
+            yield json.loads(line, object_pairs_hook=collections.OrderedDict)
+    elif fmt == 'json':
+        yield json.load(fp, object_pairs_hook=collections.OrderedDict)
+    else:
+        raise SMILEConvertError('Unknown format: {!r}'.format(fmt))
+
+
+def _ndjson_lines(fp):
+    for line in fp:
+        if line.strip():
+            yield line
+
+
+class DocumentWriter(object):
+    """Write serialized documents (see :func:`serialize`) as one output stream"""
+
+    def __init__(self, fp, fmt, compress=False):
+        """
+        DocumentWriter Initializer
+
+        :param fp: Binary file-like object
+        :param str fmt: Output format
+        :param bool compress: (optional - Default: `False`) Wrap ``smile`` output in a
+                              compressed container
+        """
+        if fmt not in FORMATS:
+            raise SMILEConvertError('Unknown format: {!r}'.format(fmt))
+        if compress and fmt != 'smile':
+            raise SMILEConvertError('Only smile output can be compressed')
+        self.fmt = fmt
+        self.fp = CompressedWriter(fp) if compress else fp
+        self.documents = 0
+        # json: the first document is held back until it is known whether an array is needed
+        self.pending = None
+
+    def write(self, data):
+        """
+        :param bytes data: Serialized document
+        """
+        if self.fmt == 'json':
+            if self.documents == 1:
+                self.fp.write(b'[')
+                self.fp.write(self.pending)
+                self.pending = None
+            if self.documents:
+                self.fp.write(b',\n')
+                self.fp.write(data)
+            else:
+                self.pending = data
+        else:
+            self.fp.write(data)
+        self.documents += 1
+
+    def close(self):
+        """Finish the output stream (the underlying file is not closed)"""
+        if self.fmt == 'json':
+            if self.pending is not None:
+                self.fp.write(self.pending)
+            elif self.documents:
+                self.fp.write(b']')
+            self.fp.write(b'\n')
+        if isinstance(self.fp, CompressedWriter):
+            self.fp.close()
+
+
+class _Counting(object):
+    """File wrapper that counts the bytes going through it"""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.count = 0
+
+    def read(self, n=-1):
+        data = self.fp.read(n)
+        self.count += len(data)
+        return data
+
+    def readline(self, n=-1):
+        data = self.fp.readline(n)
+        self.count += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def write(self, data):
+        self.fp.write(data)
+        self.count += len(data)
+
+
+def _convert_lines(lines, fmt, encode_kwargs):
+    """Worker: serialize a batch of NDJSON lines"""
+    return [serialize(json.loads(line, object_pairs_hook=collections.OrderedDict), fmt,
+                      **encode_kwargs)
+            for line in lines]
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _parallel(lines, fmt, encode_kwargs, workers, batch_lines):
+    """
+    Serialize NDJSON lines in *workers* processes, in input order
+
+    At most two batches per worker are in flight, so memory stays bounded.
+    """
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = collections.deque()
+        for batch in _batches(lines, batch_lines):
+            pending.append(pool.apply_async(_convert_lines, (batch, fmt, encode_kwargs)))
+            if len(pending) >= 2 * workers:
+                for data in pending.popleft().get():
+                    yield data
+        while pending:
+            for data in pending.popleft().get():
+                yield data
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def convert(src, dst, src_format, dst_format, workers=1, compress=False,
+            batch_lines=DEFAULT_BATCH_LINES, **encode_kwargs):
+    """
+    Convert every document of *src* from *src_format* to *dst_format*
+
+    :param src: Binary file-like object to read
+    :param dst: Binary file-like object to write
+    :param str src_format: ``json``, ``ndjson`` or ``smile``
+    :param str dst_format: ``json``, ``ndjson`` or ``smile``
+    :param int workers: (optional - Default: 1) Processes used for ``ndjson`` input
+    :param bool compress: (optional - Default: `False`) Compress ``smile`` output
+    :param int batch_lines: (optional - Default: 1000) NDJSON lines per worker task
+    :param encode_kwargs: :func:`pysmile.encode` keyword arguments for ``smile`` output
+                          (``shared_keys``, ``shared_vals``, ``bin_7bit``, ``float_mode``)
+    :returns: ``documents``, ``bytes_in``, ``bytes_out`` and ``seconds``
+    :rtype: dict
+    """
+    if src_format not in FORMATS or dst_format not in FORMATS:
+        raise SMILEConvertError('Unknown format: {!r}'.format(
+            src_format if src_format not in FORMATS else dst_format))
+    start = time.time()
+    reader = _Counting(src)
+    counter = _Counting(dst)
+    writer = DocumentWriter(counter, dst_format, compress)
+    if src_format == 'ndjson' and workers > 1:
+        pieces = _parallel(_ndjson_lines(reader), dst_format, encode_kwargs, workers,
+                           batch_lines)
+    else:
+        pieces = (serialize(doc, dst_format, **encode_kwargs)
+                  for doc in read_documents(reader, src_format))
+    for data in pieces:
+        writer.write(data)
+    writer.close()
+    return {
+        'documents': writer.documents,
+        'bytes_in': reader.count,
+        'bytes_out': counter.count,
+        'seconds': time.time() - start,
+    }
+
+
+def format_throughput(result):
+    """
+    :param dict result: :func:`convert` result
+    :returns: One line summary
+    :rtype: str
+    """
+    seconds = max(result['seconds'], 1e-9)
+    return ('{documents:,d} documents, {mb_in:.2f} MB -> {mb_out:.2f} MB in {seconds:.2f}s '
+            '({docs_per_sec:,.0f} docs/s, {mb_per_sec:.2f} MB/s)').format(
+        mb_in=result['bytes_in'] / 1e6, mb_out=result['bytes_out'] / 1e6,
+        docs_per_sec=result['documents'] / seconds,
+        mb_per_sec=result['bytes_in'] / 1e6 / seconds, **result)
@@ -1,35 +1,100 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """
 SMILE Decode
 """
-import os
-import json
-import struct
-import logging
-import collections
+import sys
 
 from pysmile.constants import *
-from pysmile import util
-
-log = logging.getLogger()
-if not log.handlers:
-    log.addHandler(logging.NullHandler())
+from pysmile import util, varint
+from pysmile.stats import HEADER, phase
+from pysmile.compress import is_compressed, decompress, iter_decompress
 
 __author__ = 'Jonathan Hosmer'
 
 
-class SMILEDecodeError(StandardError):
+class SMILEDecodeError(Exception):
     pass
 
 
-class DecodeMode(object):
-    HEAD = 0       # Waiting for magic header :)
-    ROOT = 1       # Waiting for Root object
-    ARRAY = 2      # In array context
-    VALUE = 3      # Waiting for value
-    KEY = 4        # Waiting for key
-    DONE = 5       # Done -- remain here until reset
-    BAD = 6        # Got a data error -- remain here until reset
+class SMILELimitError(SMILEDecodeError):
+    """The input exceeds a :class:`DecodeLimits` limit"""
+
+    def __init__(self, msg, limit=None, offset=None):
+        super(SMILELimitError, self).__init__(msg)
+        self.limit = limit
+        """Name of the :class:`DecodeLimits` attribute that was exceeded"""
+
+        self.offset = offset
+        """Byte offset of the offending token"""
+
+
+def _limit_error(msg, limit, offset):
+    return SMILELimitError('{} at offset {}'.format(msg, offset), limit, offset)
+
+
+class DecodeLimits(object):
+    """
+    Bounds on the work and memory a single document can demand from the decoder.
+
+    Every limit is checked in constant time when the token it applies to is read, before the
+    memory it asks for is allocated; the first violation raises :class:`SMILELimitError` with
+    the byte offset of the offending token.  ``None`` disables a limit.
+
+    With every limit in place decoding is linear in the size of the input.  Pass an instance
+    as *limits* to :func:`decode`, :func:`load`, :func:`iter_load` or a session decoder when
+    the input comes from an untrusted source; without one only the input size bounds the
+    decoder.
+    """
+
+    def __init__(self, max_depth=DEFAULT_MAX_DEPTH, max_string_length=DEFAULT_MAX_STRING_LENGTH,
+                 max_binary_length=DEFAULT_MAX_BINARY_LENGTH,
+                 max_number_length=DEFAULT_MAX_NUMBER_LENGTH,
+                 max_document_size=DEFAULT_MAX_DOCUMENT_SIZE,
+                 max_elements=DEFAULT_MAX_ELEMENTS, max_shared_strings=MAX_SHARED_NAMES):
+        """
+        DecodeLimits Initializer
+
+        :param int max_depth: (optional - Default: 1000) Arrays and objects open at once
+        :param int max_string_length: (optional - Default: 20 MiB) UTF-8 bytes of a key or
+                                      string value
+        :param int max_binary_length: (optional - Default: 20 MiB) Bytes of a binary value
+        :param int max_number_length: (optional - Default: 1000) Bytes of the unscaled value of
+                                      a BigInteger or BigDecimal; converting those to decimal
+                                      digits is quadratic in their length
+        :param int max_document_size: (optional - Default: 64 MiB) Bytes of the document,
+                                      after decompression
+        :param int max_elements: (optional - Default: 10 Mi) Values (scalars, arrays and
+                                 objects) in the document
+        :param int max_shared_strings: (optional - Default: 1024) Entries in each back
+                                       reference table of a document (session tables are
+                                       bounded by their own capacity)
+        """
+        self.max_depth = max_depth
+        self.max_string_length = max_string_length
+        self.max_binary_length = max_binary_length
+        self.max_number_length = max_number_length
+        self.max_document_size = max_document_size
+        self.max_elements = max_elements
+        self.max_shared_strings = max_shared_strings
+
+    def check_document_size(self, size):
+        """
+        :param int size: Document bytes
+        :raises SMILELimitError: If *size* is over :attr:`max_document_size`
+        """
+        if self.max_document_size is not None and size > self.max_document_size:
+            raise _limit_error('Document larger than {} bytes'.format(self.max_document_size),
+                               'max_document_size', self.max_document_size)
+
+
+NO_LIMITS = DecodeLimits(max_depth=None, max_string_length=None, max_binary_length=None,
+                         max_number_length=None, max_document_size=None, max_elements=None,
+                         max_shared_strings=None)
+"""Only the size of the input bounds the decoder"""
+
+
+def _bound(limit):
+    return sys.maxsize if limit is None else limit
 
 
 class SmileHeader(object):
@@ -40,412 +105,806 @@ class SmileHeader(object):
         self.shared_values = shared_values
 
 
-class DecodeState(object):
-    def __init__(self, string):
-        if isinstance(string, unicode):
-            string = string.encode('UTF-8')
-        self.s = bytearray(string)
-        """Input"""
-
-        self.out = []
-        """Output"""
-
-        self.mode = DecodeMode.HEAD
-        """Current Decoder State"""
+class _SharedStrings(list):
+    """Back reference table of a single document: starts over once it is full, like Jackson"""
 
-        self.error = None
-        """Error message"""
+    def __init__(self, capacity, max_entries=None):
+        super(_SharedStrings, self).__init__()
+        self.capacity = capacity
+        self.full = min(capacity, _bound(max_entries))
 
-        self.index = 0
-        """Current read index"""
+    def append(self, value):
+        if len(self) >= self.full:
+            if self.full < self.capacity:
+                raise SMILELimitError('Back reference table over {} entries'.format(self.full),
+                                      'max_shared_strings')
+            del self[:]
+        super(_SharedStrings, self).append(value)
 
-        self.nested_depth = 0
-        """current nest level"""
 
-        self.in_array = collections.defaultdict(lambda: False)
-        # self.in_array = [False] * 30
-        """true if in array context"""
+class DecodeState(object):
+    def __init__(self, string, header=None, shared_keys=None, shared_values=None,
+                 binary_view=False, limits=None, offset=0):
+        """
+        DecodeState Initializer
+
+        :param bytes|bytearray|memoryview string: SMILE formatted data
+        :param SmileHeader header: (optional) Header to use if *string* does not start with one
+                                   (documents after the first in a session)
+        :param shared_keys: (optional) Key back reference table to start from
+        :param shared_values: (optional) Value back reference table to start from
+        :param bool binary_view: (optional - Default: `False`) Decode binary values to
+                                 ``memoryview`` instead of ``bytes``
+        :param DecodeLimits limits: (optional - Default: :data:`NO_LIMITS`) Limits; the
+                                    document size is checked by the caller
+        :param int offset: (optional - Default: 0) Where the document starts in *string*
+        """
+        if isinstance(string, str):
+            raise TypeError('SMILE data must be bytes, not str')
+        self.s = string if isinstance(string, (bytes, bytearray)) else bytes(string)
+        """Input"""
 
-        self.first_array_element = collections.defaultdict(lambda: False)
-        # self.first_array_element = [False] * 30
-        """# true if the next token is the first value of an array (used for printing)"""
+        self.index = offset
+        """Current read index"""
 
-        self.first_key = collections.defaultdict(lambda: False)
-        # self.first_key = [False] * 30
-        """true if the next token is the first key of an object (used for printing)"""
+        self.start = offset
+        """Where the document starts; error offsets are relative to it"""
 
         self.header = None
         """smile header"""
 
-        self.shared_key_strings = []
+        if limits is None:
+            limits = NO_LIMITS
+        self.shared_key_strings = (_SharedStrings(MAX_SHARED_NAMES, limits.max_shared_strings)
+                                   if shared_keys is None else shared_keys)
         """Cached Keys for back references"""
 
-        self.shared_value_strings = []
+        self.shared_value_strings = (_SharedStrings(MAX_SHARED_STRING_VALUES,
+                                                    limits.max_shared_strings)
+                                     if shared_values is None else shared_values)
         """Cached Values for back references"""
 
+        self.binary_view = binary_view
+
+        self.max_depth = _bound(limits.max_depth)
+        self.max_string_length = _bound(limits.max_string_length)
+        self.max_binary_length = _bound(limits.max_binary_length)
+        self.max_number_length = _bound(limits.max_number_length)
+        self.max_elements = _bound(limits.max_elements)
+
+        if self.s[offset:offset + 3] == HEADER_BYTE_1 + HEADER_BYTE_2 + HEADER_BYTE_3:
+            self.read_header()
+        elif header is not None:
+            self.header = header
+        else:
+            raise SMILEDecodeError('Bad State: Invalid Header!')
+
+    def error(self, msg, offset=None):
+        """
+        :param str msg: Message
+        :param int offset: (optional - Default: current read index) Offset of the problem
+        :returns: Exception to raise
+        :rtype: SMILEDecodeError
+        """
+        return SMILEDecodeError('{} at offset {}'.format(
+            msg, (self.index if offset is None else offset) - self.start))
+
+    def limit_error(self, msg, limit, offset=None):
+        """
+        :param str msg: Message
+        :param str limit: Name of the :class:`DecodeLimits` attribute
+        :param int offset: (optional - Default: current read index) Offset of the token
+        :returns: Exception to raise
+        :rtype: SMILELimitError
+        """
+        return _limit_error(msg, limit, (self.index if offset is None else offset) - self.start)
+
+    def read_header(self):
+        start = self.index
+        features = self.s[start + 3] if len(self.s) > start + 3 else 0
+        self.header = SmileHeader(features & HEADER_BIT_VERSION,
+                                  bool(features & HEADER_BIT_HAS_RAW_BINARY),
+                                  bool(features & HEADER_BIT_HAS_SHARED_NAMES),
+                                  bool(features & HEADER_BIT_HAS_SHARED_STRING_VALUES))
+        self.index = start + 4
+
     def pull_byte(self):
-        ret_s = None
+        """
+        :returns: Next byte, or ``None`` at the end of the input
+        :rtype: int
+        """
         try:
-            ret_s = self.s[self.index]
+            ret = self.s[self.index]
         except IndexError:
-            self.mode = DecodeMode.DONE
-        else:
-            self.index += 1
-        return ret_s
-
-    def pull_bits(self, n):
-        ret_s = bytearray()
-        for _ in xrange(abs(n)):
-            byt = self.pull_byte()
-            if byt is None:
-                break
-            ret_s.append(byt)
-        return ret_s
-
-    def write(self, *args):
-        if args:
-            self.out.extend(args)
-
-    def get_value(self):
-        return ''.join(map(str, self.out))
-
-    @staticmethod
-    def _escape(o):
-        return str(o).replace('\n', r'\n').replace('"', r'\"')
-
-    def save_key_string(self, key_str):
-        log.debug('key_str: {!r}'.format(key_str))
-        self.shared_key_strings.append(key_str)
-
-    def save_value_string(self, val_str):
-        log.debug('val_str: {!r}'.format(val_str))
-        self.shared_value_strings.append(val_str)
-
-    def copy_key_string(self, n=0):
-        key_str = self._escape(self.s[self.index:self.index + n])
-        if self.header.shared_keys:
-            self.save_key_string(key_str)
-        self.write('"', key_str, '":')
-        self.index += n
-
-    def copy_value_string(self, n=0):
-        val_str = self._escape(self.s[self.index:self.index + n])
-        if self.header.shared_values:
-            self.save_value_string(val_str)
-        self.write('"', val_str, '"')
-        self.index += n
+            return None
+        self.index += 1
+        return ret
+
+    def next_byte(self):
+        """
+        :returns: Next byte
+        :rtype: int
+        :raises SMILEDecodeError: At the end of the input
+        """
+        try:
+            ret = self.s[self.index]
+        except IndexError:
+            raise self.error('Unexpected end of input')
+        self.index += 1
+        return ret
+
+    def read_text(self, n):
+        """
+        :param int n: Number of UTF-8 bytes
+        :rtype: str
+        """
+        start = self.index
+        if n > self.max_string_length:
+            raise self.limit_error('String longer than {} bytes'.format(self.max_string_length),
+                                   'max_string_length', start - 1)
+        end = start + n
+        if end > len(self.s):
+            raise self.error('Truncated string', start - 1)
+        self.index = end
+        try:
+            return self.s[start:end].decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise self.error('Invalid UTF-8 ({})'.format(e), start)
+
+    def read_terminated_text(self):
+        """
+        Text up to the end-of-String marker (0xFC)
+
+        The search for the marker stops after ``max_string_length`` bytes.
+
+        :rtype: str
+        """
+        start = self.index
+        limit = self.max_string_length
+        end = self.s.find(BYTE_MARKER_END_OF_STRING, start, start + limit + 1)
+        if end < 0:
+            if len(self.s) - start > limit:
+                raise self.limit_error('String longer than {} bytes'.format(limit),
+                                       'max_string_length', start - 1)
+            raise self.error('Unterminated string', start - 1)
+        self.index = end + 1
+        try:
+            return self.s[start:end].decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise self.error('Invalid UTF-8 ({})'.format(e), start)
 
-    def copy_shared_key_string(self):
+    def shared_key(self, ix):
         if not self.header.shared_keys:
-            raise SMILEDecodeError('Cannot lookup shared key, sharing disabled!')
+            raise self.error('Cannot lookup shared key, sharing disabled!')
         try:
-            sh_str = self.shared_key_strings[self.s[self.index - 1] - 0x40]
+            return self.shared_key_strings[ix]
         except IndexError:
-            log.debug('self.index: {!r}'.format(self.index))
-            log.debug('self.shared_key_strings: {!r}'.format(self.shared_key_strings))
-        else:
-            self.write('"', sh_str, '":')
+            raise self.error('Unknown shared key reference {}'.format(ix))
 
-    def copy_shared_value_string(self):
+    def shared_value(self, ix):
         if not self.header.shared_values:
-            raise SMILEDecodeError('Cannot lookup shared value, sharing disabled!')
+            raise self.error('Cannot lookup shared value, sharing disabled!')
         try:
-            svr = self.shared_value_strings[self.s[self.index - 1] - 1]
+            return self.shared_value_strings[ix]
         except IndexError:
-            log.debug('self.index: {!r}'.format(self.index))
-            log.debug('self.shared_value_strings: {!r}'.format(self.shared_value_strings))
-        else:
-            self.write('"', svr, '"')
+            raise self.error('Unknown shared value reference {}'.format(ix))
+
+    def long_shared_reference_index(self, byt):
+        """
+        Index of a 2 byte back reference: 2 LSB of the token byte followed by one more byte
 
-    def copy_variable_length_string(self):
-        i = self.s.index('\xfc', self.index)
-        self.write('"', self._escape(self.s[self.index:i]), '"')
-        self.index = i + 1
+        :param int byt: Token byte
+        :rtype: int
+        """
+        low = self.pull_byte()
+        if low is None:
+            raise self.error('Truncated shared string reference')
+        return ((byt & 0x03) << 8) | low
 
     def varint_decode(self):
-        smile_zzvarint_decode = 0
-        tmp = self.s[self.index:]
-        for i, ch in enumerate(tmp):
-            self.index += 1
-            if ch & 0x80:
-                smile_zzvarint_decode <<= 6
-                smile_zzvarint_decode |= (ch & 0x3F)
-                break
-            smile_zzvarint_decode <<= 7
-            smile_zzvarint_decode |= ch
-        return smile_zzvarint_decode
-
-    def zzvarint_decode(self):
-        self.write(util.zigzag_decode(self.varint_decode()))
-
-
-def decode(string):
+        """
+        Unsigned variable length int: 7 bits per byte, the last byte (high bit set) holds 6
+
+        :rtype: int
+        """
+        try:
+            value, self.index = varint.read_vint(self.s, self.index)
+        except ValueError as e:
+            raise SMILEDecodeError(str(e))
+        return value
+
+    def read_float(self, n, unpack):
+        """
+        Decode an *n* byte 7-bit encoded float payload
+
+        :param int n: Payload length (5 or 10)
+        :param unpack: :func:`util.float32_from_7bit` or :func:`util.float64_from_7bit`
+        :rtype: float
+        """
+        if self.index + n > len(self.s):
+            raise self.error('Truncated float', self.index - 1)
+        value = unpack(self.s, self.index)
+        self.index += n
+        return value
+
+    def read_7bit_bytes(self, max_length, limit, token=None):
+        """
+        Length prefixed 7-bit encoded bytes
+
+        :param int max_length: Largest accepted (decoded) length
+        :param str limit: Name of the :class:`DecodeLimits` attribute *max_length* comes from
+        :param int token: (optional - Default: the preceding byte) Offset of the value's token
+        :rtype: bytearray
+        """
+        if token is None:
+            token = self.index - 1
+        length = self.varint_decode()
+        if length > max_length:
+            raise self.limit_error('Value longer than {} bytes'.format(max_length), limit, token)
+        start = self.index
+        end = start + util.encoded_7bit_length(length)
+        if end > len(self.s):
+            raise self.error('Truncated binary value', start)
+        self.index = end
+        return util.decode_7bit(self.s, start, length)
+
+    def read_7bit_binary(self):
+        data = self.read_7bit_bytes(self.max_binary_length, 'max_binary_length')
+        if self.binary_view:
+            return memoryview(data)
+        return bytes(data)
+
+    def read_raw_binary(self):
+        token = self.index - 1
+        length = self.varint_decode()
+        if length > self.max_binary_length:
+            raise self.limit_error('Binary value longer than {} bytes'.format(
+                self.max_binary_length), 'max_binary_length', token)
+        start = self.index
+        end = start + length
+        if end > len(self.s):
+            raise self.error('Truncated binary value', start)
+        self.index = end
+        if self.binary_view:
+            return memoryview(self.s)[start:end]
+        return bytes(self.s[start:end])
+
+    def read_key(self, byt):
+        """
+        Decode the field name starting with token *byt*
+
+        :param int byt: Token byte
+        :rtype: str
+        """
+        if byt >= TOKEN_PREFIX_KEY_SHARED_SHORT:
+            if byt < TOKEN_PREFIX_KEY_ASCII:
+                # "Short" shared key name reference (1 byte lookup)
+                return self.shared_key(byt - TOKEN_PREFIX_KEY_SHARED_SHORT)
+            if byt < TOKEN_PREFIX_KEY_UNICODE:
+                # Short ASCII names, 1 to 64 bytes
+                key = self.read_text((byt & 0x3F) + 1)
+            elif byt <= TOKEN_RESERVED:
+                # Short Unicode names, 2 to 57 bytes
+                key = self.read_text((byt - TOKEN_PREFIX_KEY_UNICODE) + 2)
+            else:
+                raise self.error('Invalid key token 0x{:x}'.format(byt), self.index - 1)
+        elif byt == TOKEN_KEY_EMPTY_STRING:
+            return ''
+        elif TOKEN_PREFIX_KEY_SHARED_LONG <= byt < TOKEN_KEY_LONG_STRING:
+            return self.shared_key(self.long_shared_reference_index(byt))
+        elif byt == TOKEN_KEY_LONG_STRING:
+            key = self.read_terminated_text()
+        else:
+            raise self.error('Invalid key token 0x{:x}'.format(byt), self.index - 1)
+        if self.header.shared_keys:
+            self.shared_key_strings.append(key)
+        return key
+
+    def read_value(self, byt):
+        """
+        Decode the scalar value starting with token *byt*
+
+        :param int byt: Token byte
+        :returns: Decoded value
+        """
+        return _VALUE_DECODERS[byt](self, byt)
+
+
+def _shared_value_short(state, byt):
+    return state.shared_value(byt - 1)
+
+
+def _shared_value_long(state, byt):
+    return state.shared_value(state.long_shared_reference_index(byt))
+
+
+def _literal(value):
+    return lambda state, byt: value
+
+
+def _integer(state, byt):
+    try:
+        value, state.index = varint.read_int(state.s, state.index)
+    except ValueError as e:
+        raise SMILEDecodeError(str(e))
+    return value
+
+
+def _big_integer(state, byt):
+    return util.int_from_bytes(state.read_7bit_bytes(state.max_number_length,
+                                                     'max_number_length'))
+
+
+def _big_decimal(state, byt):
+    # Imported on first use: decimal costs more to import than the rest of the package
+    import decimal
+    token = state.index - 1
+    scale = varint.zigzag_decode(state.varint_decode())
+    unscaled = util.int_from_bytes(state.read_7bit_bytes(state.max_number_length,
+                                                         'max_number_length', token))
+    # Digits without a detour through str(), which is subject to sys.set_int_max_str_digits
+    digits = decimal.Decimal(unscaled).as_tuple()
+    return decimal.Decimal((digits.sign, digits.digits, -scale))
+
+
+def _float32(state, byt):
+    return state.read_float(5, util.float32_from_7bit)
+
+
+def _float64(state, byt):
+    return state.read_float(10, util.float64_from_7bit)
+
+
+def _short_text(length):
+    def _read(state, byt):
+        value = state.read_text(length(byt))
+        if state.header.shared_values:
+            state.shared_value_strings.append(value)
+        return value
+    return _read
+
+
+def _small_int(state, byt):
+    return varint.zigzag_decode(byt & 0x1F)
+
+
+def _long_text(state, byt):
+    return state.read_terminated_text()
+
+
+def _binary_7bit(state, byt):
+    return state.read_7bit_binary()
+
+
+def _binary_raw(state, byt):
+    return state.read_raw_binary()
+
+
+def _invalid(state, byt):
+    raise state.error('Invalid value token 0x{:x}'.format(byt), state.index - 1)
+
+
+_VALUE_DECODERS = [_invalid] * 256
+"""Scalar value decoder by token byte"""
+
+for _byt in range(0x01, 0x20):
+    _VALUE_DECODERS[_byt] = _shared_value_short
+_VALUE_DECODERS[TOKEN_LITERAL_EMPTY_STRING] = _literal('')
+_VALUE_DECODERS[TOKEN_LITERAL_NULL] = _literal(None)
+_VALUE_DECODERS[TOKEN_LITERAL_FALSE] = _literal(False)
+_VALUE_DECODERS[TOKEN_LITERAL_TRUE] = _literal(True)
+_VALUE_DECODERS[TOKEN_BYTE_INT_32] = _integer
+_VALUE_DECODERS[TOKEN_BYTE_INT_64] = _integer
+_VALUE_DECODERS[TOKEN_BYTE_BIG_INTEGER] = _big_integer
+_VALUE_DECODERS[TOKEN_BYTE_FLOAT_32] = _float32
+_VALUE_DECODERS[TOKEN_BYTE_FLOAT_64] = _float64
+_VALUE_DECODERS[TOKEN_BYTE_BIG_DECIMAL] = _big_decimal
+# Tiny/Small ASCII (1 - 64 bytes), Tiny/Short Unicode (2 - 65 bytes)
+_ascii = _short_text(lambda byt: (byt & 0x3F) + 1)
+_unicode = _short_text(lambda byt: (byt & 0x3F) + 2)
+for _byt in range(TOKEN_PREFIX_TINY_ASCII, TOKEN_PREFIX_TINY_UNICODE):
+    _VALUE_DECODERS[_byt] = _ascii
+for _byt in range(TOKEN_PREFIX_TINY_UNICODE, TOKEN_PREFIX_SMALL_INT):
+    _VALUE_DECODERS[_byt] = _unicode
+for _byt in range(TOKEN_PREFIX_SMALL_INT, TOKEN_PREFIX_MISC_OTHER):
+    _VALUE_DECODERS[_byt] = _small_int
+_VALUE_DECODERS[TOKEN_MISC_LONG_TEXT_ASCII] = _long_text
+_VALUE_DECODERS[TOKEN_MISC_LONG_TEXT_UNICODE] = _long_text
+_VALUE_DECODERS[TOKEN_MISC_BINARY_7BIT] = _binary_7bit
+for _byt in range(TOKEN_PREFIX_SHARED_STRING_LONG, TOKEN_PREFIX_SHARED_STRING_LONG + 4):
+    _VALUE_DECODERS[_byt] = _shared_value_long
+_VALUE_DECODERS[TOKEN_MISC_BINARY_RAW] = _binary_raw
+del _byt, _ascii, _unicode
+
+
+def decode(string, object_hook=None, object_pairs_hook=None, binary_view=False, stats=None,
+           limits=None, records=None, lazy=False):
     """
     Decode SMILE format string into a Python Object
 
-    :param basestring string: SMILE formatted data string
+    Compressed containers (see :mod:`pysmile.compress`) are detected and inflated first.
+
+    :param bytes|bytearray|memoryview string: SMILE formatted data
+    :param object_hook: (optional) Called with every decoded object (``dict``); its return
+                        value is used instead of the ``dict``
+    :param object_pairs_hook: (optional) Called with the ``(key, value)`` pairs of every
+                              decoded object, in document order; takes priority over
+                              *object_hook*
+    :param bool binary_view: (optional - Default: `False`) Return binary values as
+                             ``memoryview`` (raw binary: a zero-copy slice of the input)
+                             instead of ``bytes``
+    :param pysmile.stats.SmileStats stats: (optional) Collect token and timing statistics
+    :param DecodeLimits limits: (optional) Reject input over these limits
+                                (:class:`SMILELimitError`)
+    :param records: (optional) Decode objects that match a record type into instances of it
+                    rather than ``dict``: a :class:`pysmile.schema.RecordDecoder`, or record
+                    types and schemas to make one of; takes priority over the hooks
+    :param bool lazy: (optional - Default: `False`) Return read-only proxies that decode
+                      objects and arrays when they are accessed (see :mod:`pysmile.lazy`);
+                      can not be combined with hooks, *records* or *stats*
     :returns: Decoded python object
     :rtype: list | dict
     """
-    log.debug('Decoding: {!r}'.format(string))
-    state = DecodeState(string)
-    while state.mode not in (DecodeMode.BAD, DecodeMode.DONE):
-        if state.mode == DecodeMode.HEAD:
-            head = state.pull_bits(3)
-            if not (head and head.startswith(HEADER_BYTE_1+HEADER_BYTE_2+HEADER_BYTE_3)):
-                state.mode = DecodeMode.BAD
-                state.error = 'Invalid Header!'
+    if lazy and (object_hook or object_pairs_hook or records is not None or stats is not None):
+        raise ValueError('Lazy decoding does not support hooks, records or stats')
+    if records is not None:
+        object_pairs_hook = _record_hook(records)
+    if is_compressed(string):
+        with phase(stats, 'decompress'):
+            string = _inflate(string, limits)
+    elif limits is not None:
+        limits.check_document_size(len(string))
+    state = DecodeState(string, binary_view=binary_view, limits=limits)
+    if lazy:
+        from pysmile.lazy import decode_lazy
+        return decode_lazy(state)
+    return _decode(state, object_hook, object_pairs_hook, stats)
+
+
+def _record_hook(records):
+    """
+    :param records: See :func:`decode`
+    :rtype: pysmile.schema.RecordDecoder
+    """
+    from pysmile.schema import RecordDecoder
+    if isinstance(records, RecordDecoder):
+        return records
+    if isinstance(records, (type, dict)):
+        records = (records,)
+    return RecordDecoder(*records)
+
+
+def _inflate(src, limits):
+    """
+    Unwrap a compressed container, giving up as soon as the output is over the document size
+    limit (a small container can inflate to a thousand times its size)
+
+    :param src: Container bytes or a file-like object (``read``)
+    :param DecodeLimits limits: Limits (or ``None``)
+    :rtype: bytearray
+    """
+    if limits is None or limits.max_document_size is None:
+        return decompress(src)
+    out = bytearray()
+    for chunk in iter_decompress(src):
+        out += chunk
+        limits.check_document_size(len(out))
+    return out
+
+
+def _decode(state, object_hook=None, object_pairs_hook=None, stats=None, single=True):
+    """
+    Decode one document
+
+    :param DecodeState state: Decoder state, positioned after the header
+    :param object_hook: (optional) See :func:`decode`
+    :param object_pairs_hook: (optional) See :func:`decode`
+    :param pysmile.stats.SmileStats stats: (optional) See :func:`decode`
+    :param bool single: (optional - Default: `True`) Nothing but an end marker may follow the
+                        document; otherwise ``state.index`` is left just past it
+    :returns: Decoded python object
+    """
+    try:
+        if stats is None:
+            value = _decode_tokens(state, object_hook, object_pairs_hook, state.next_byte,
+                                   state.read_key, _VALUE_DECODERS)
+        else:
+            with stats.phase('decode'):
+                value = _decode_tokens(state, object_hook, object_pairs_hook,
+                                       *_counting(state, stats))
+    except SMILELimitError as e:
+        if e.offset is not None:
+            raise
+        # Raised by a back reference table, which does not know the offset
+        raise state.limit_error(str(e), e.limit)
+    if single:
+        byt = state.pull_byte()
+        if byt is not None and byt != BYTE_MARKER_END_OF_CONTENT:
+            raise state.error('Trailing data after document', state.index - 1)
+    return value
+
+
+def _counting(state, stats):
+    """
+    Token readers that report every token of *state* to *stats*
+
+    :param DecodeState state: Decoder state
+    :param pysmile.stats.SmileStats stats: Statistics
+    :returns: ``next_byte``, ``read_key`` and value decoder table for :func:`_decode_tokens`
+    :rtype: tuple
+    """
+    if state.index == 4:
+        stats.record(HEADER, 4)
+    next_byte = state.next_byte
+    read_key = state.read_key
+    table = _VALUE_DECODERS
+
+    def counted_next_byte():
+        byt = next_byte()
+        if byt == TOKEN_LITERAL_START_ARRAY or byt == TOKEN_LITERAL_START_OBJECT:
+            stats.start_container()
+        elif byt == TOKEN_LITERAL_END_ARRAY or byt == TOKEN_LITERAL_END_OBJECT:
+            stats.end_container()
+        return byt
+
+    def counted_key(byt):
+        start = state.index - 1
+        key = read_key(byt)
+        stats.record_key(byt, state.index - start, state.header.shared_keys)
+        return key
+
+    def counted_value(st, byt):
+        start = st.index - 1
+        value = table[byt](st, byt)
+        stats.record_value(byt, st.index - start, st.header.shared_values)
+        return value
+
+    return counted_next_byte, counted_key, [counted_value] * 256
+
+
+def _decode_tokens(state, object_hook, object_pairs_hook, next_byte, read_key, decoders):
+    """
+    Decode one document from the tokens returned by *next_byte*
+
+    Containers are tracked on an explicit stack, so nesting depth is only limited by memory
+    (and ``state.max_depth``).
+
+    :param DecodeState state: Decoder state, positioned after the header
+    :param object_hook: See :func:`decode`
+    :param object_pairs_hook: See :func:`decode`
+    :param next_byte: :meth:`DecodeState.next_byte`
+    :param read_key: :meth:`DecodeState.read_key`
+    :param list decoders: Scalar value decoder by token byte
+    :returns: Decoded python object
+    """
+    stack = []
+    # Innermost open container: list (array), dict or list of pairs (object); None at the root
+    container = None
+    in_object = False
+    key = None
+    max_depth = state.max_depth
+    # Values that may still be read
+    elements = state.max_elements
+    while True:
+        byt = next_byte()
+        if in_object and key is None:
+            if byt != TOKEN_LITERAL_END_OBJECT:
+                key = read_key(byt)
                 continue
-            state.mode = DecodeMode.ROOT
-            features = state.pull_byte()
-            version = features & HEADER_BIT_VERSION
-            shared_keys = bool(features & HEADER_BIT_HAS_SHARED_NAMES)
-            shared_values = bool((features & HEADER_BIT_HAS_SHARED_STRING_VALUES) >> 1)
-            raw_binary = bool((features & HEADER_BIT_HAS_RAW_BINARY) >> 2)
-            state.header = SmileHeader(version, raw_binary, shared_keys, shared_values)
-        elif state.mode in (DecodeMode.ROOT, DecodeMode.ARRAY, DecodeMode.VALUE):
-            byt = state.pull_byte()
-            if byt is None:
-                log.debug('No bytes left to read!')
-                state.mode = DecodeMode.DONE
-                break
-            log.debug('Pulled Byte: 0x{:x}'.format(byt))
-
-            if state.in_array[state.nested_depth]:
-                if state.first_array_element[state.nested_depth]:
-                    state.first_array_element[state.nested_depth] = False
-                elif byt != TOKEN_LITERAL_END_ARRAY:
-                    state.write(',')
-
-            if byt == NULL_BIT:
-                log.debug('Token: Null Bit (skip)')
-            elif 0x01 <= byt <= 0x1F:
-                log.debug('Token: Shared Value String')
-                state.copy_shared_value_string()
-            elif TOKEN_LITERAL_EMPTY_STRING <= byt <= TOKEN_LITERAL_TRUE:
-                # Simple literals, numbers
-                if byt == TOKEN_LITERAL_EMPTY_STRING:
-                    log.debug('Token: Empty String')
-                    state.write('""')
-                elif byt == TOKEN_LITERAL_NULL:
-                    log.debug('Token: Literal Null')
-                    state.write('null')
-                elif byt == TOKEN_LITERAL_FALSE:
-                    log.debug('Token: Literal False')
-                    state.write('false')
-                elif byt == TOKEN_LITERAL_TRUE:
-                    log.debug('Token: Literal True')
-                    state.write('true')
-            elif TOKEN_PREFIX_INTEGER <= byt < TOKEN_PREFIX_FP:
-                # Integral numbers
-                log.debug('Token: Integral Numbers')
-                smile_value_length = byt & 0x03
-                if smile_value_length < 2:
-                    state.zzvarint_decode()
-                elif smile_value_length == 2:
-                    # BigInteger
-                    log.warn('Not Yet Implemented: Value BigInteger')
-                else:
-                    # Reserved for future use
-                    log.warn('Reserved: integral numbers with length >= 3')
-            elif TOKEN_PREFIX_FP <= byt <= 0x2B:
-                # Floating point numbers
-                if byt == TOKEN_BYTE_FLOAT_32:
-                    fp = state.pull_bits(5)
-                    b1 = fp[0]
-                    b2 = fp[1] << 7
-                    b3 = fp[2] << 7 << 7
-                    b4 = fp[3] << 7 << 7 << 7
-                    b5 = fp[4] << 7 << 7 << 7 << 7
-                    byt = (b1 | b2 | b3 | b4 | b5)
-                    try:
-                        flt = util.bits_to_float(byt)
-                    except struct.error:
-                        flt = util.long_bits_to_float(byt)
-                    state.write(flt)
-                elif byt == TOKEN_BYTE_FLOAT_64:
-                    fp = state.pull_bits(9)
-                    b1 = fp[0]
-                    b2 = fp[1] << 7
-                    b3 = fp[2] << 7 << 7
-                    b4 = fp[3] << 7 << 7 << 7
-                    b5 = fp[4] << 7 << 7 << 7 << 7
-                    b6 = fp[4] << 7 << 7 << 7 << 7 << 7
-                    b7 = fp[4] << 7 << 7 << 7 << 7 << 7 << 7
-                    b8 = fp[4] << 7 << 7 << 7 << 7 << 7 << 7 << 7
-                    b9 = fp[4] << 7 << 7 << 7 << 7 << 7 << 7 << 7 << 7
-                    byt = (b1 | b2 | b3 | b4 | b5 | b6 | b7 | b8 | b9)
-                    flt = util.long_bits_to_float(byt)
-                    state.write(flt)
-                else:
-                    log.warn('Not Yet Implemented')
-            elif 0x2C <= byt <= 0x3F:
-                # Reserved for future use
-                log.warn('Reserved: 0x2C <= value <= 0x3F')
-            elif 0x40 <= byt <= 0x5F or 0x80 <= byt <= 0x9F:
-                # Tiny ASCII/Unicode
-                log.debug('Token: Tiny ASCII/Unicode')
-                smile_value_length = (byt & 0x1F) + 1
-                state.copy_value_string(smile_value_length)
-            elif 0x60 <= byt <= 0x7F or 0xA0 <= byt <= 0xBF:
-                # Small ASCII/Unicode
-                log.debug('Token: Small ASCII/Unicode')
-                smile_value_length = (byt & 0x1F) + 33
-                state.copy_value_string(smile_value_length)
-            elif 0xC0 <= byt <= 0xDF:
-                # Small Integers
-                log.debug('Token: Small Integer')
-                state.write(util.zigzag_decode(byt & 0x1F))
+            if object_pairs_hook is not None:
+                value = object_pairs_hook(container)
+            elif object_hook is not None:
+                value = object_hook(container)
             else:
-                # Misc binary / text / structure markers
-                if TOKEN_MISC_LONG_TEXT_ASCII <= byt < TOKEN_MISC_LONG_TEXT_UNICODE:
-                    # Long (variable length) ASCII text
-                    log.debug('Token: Long (var length) ASCII Test')
-                    state.copy_variable_length_string()
-                elif TOKEN_MISC_LONG_TEXT_UNICODE <= byt < INT_MISC_BINARY_7BIT:
-                    log.warn('Not Yet Implemented: Value Long Unicode')
-                elif INT_MISC_BINARY_7BIT <= byt < TOKEN_PREFIX_SHARED_STRING_LONG:
-                    log.warn('Not Yet Implemented: Value Long Shared String Reference')
-                elif TOKEN_PREFIX_SHARED_STRING_LONG <= byt < HEADER_BIT_VERSION:
-                    # Binary, 7-bit encoded
-                    log.warn('Not Yet Implemented: Value Binary')
-                elif HEADER_BIT_VERSION <= byt < TOKEN_LITERAL_START_ARRAY:
-                    log.warn('Reserved: 0xF0 <= value <= 0xF8')
-                elif byt == TOKEN_LITERAL_START_ARRAY:
-                    # START_ARRAY
-                    log.debug('Token: Start Array')
-                    state.write('[')
-                    state.nested_depth += 1
-                    state.in_array[state.nested_depth] = True
-                    state.first_array_element[state.nested_depth] = True
-                    state.first_key[state.nested_depth] = False
-                elif byt == TOKEN_LITERAL_END_ARRAY:
-                    # END_ARRAY
-                    log.debug('Token: End Array')
-                    state.write(']')
-                    state.nested_depth -= 1
-                elif byt == TOKEN_LITERAL_START_OBJECT:
-                    # START_OBJECT
-                    log.debug('Token: Start Object')
-                    state.write('{')
-                    state.nested_depth += 1
-                    state.in_array[state.nested_depth] = False
-                    state.first_array_element[state.nested_depth] = False
-                    state.first_key[state.nested_depth] = True
-                    state.mode = DecodeMode.KEY
-                    continue
-                elif byt == TOKEN_LITERAL_END_OBJECT:
-                    log.debug('Token: End Object')
-                    log.warn('Reserved: value == 0xFB')
-                elif byt == BYTE_MARKER_END_OF_STRING:
-                    log.error('Found end-of-String marker (0xFC) in value mode')
-                elif byt == INT_MISC_BINARY_RAW:
-                    log.warn('Not Yet Implemented: Raw Binary Data')
-                elif byt == BYTE_MARKER_END_OF_CONTENT:
-                    log.debug('Token: End Marker')
-                    state.mode = DecodeMode.DONE
-                    break
-            if not state.in_array[state.nested_depth]:
-                state.mode = DecodeMode.KEY
-        elif state.mode == DecodeMode.KEY:
-            byt = state.pull_byte()
-            if byt is None or byt == BYTE_MARKER_END_OF_CONTENT:
-                log.debug('No bytes left to read!')
-                state.mode = DecodeMode.DONE
-                break
-            log.debug('Pulled Byte: 0x{:x}'.format(byt))
-
-            try:
-                if state.first_key[state.nested_depth]:
-                    state.first_key[state.nested_depth] = False
-                elif byt != TOKEN_LITERAL_END_OBJECT:
-                    state.write(',')
-            except IndexError:
-                state.first_key.append(False)
-
-            # Byte ranges are divided in 4 main sections (64 byte values each)
-            if 0x00 <= byt <= 0x1F:
-                log.warn('Reserved: 0x01 <= key <= 0x1F')
-            elif byt == TOKEN_LITERAL_EMPTY_STRING:
-                # Empty String
-                log.debug('Token: Literal Empty String')
-                state.write('""')
-            elif TOKEN_LITERAL_NULL <= byt <= 0x2F:
-                log.warn('Reserved: 0x21 <= key <= 0x2F')
-            elif TOKEN_PREFIX_KEY_SHARED_LONG <= byt <= 0x33:
-                # "Long" shared key name reference
-                log.warn('Not Yet Implemented: Long Shared Key Name Reference')
-            elif byt == 0x32:
-                # Long (not-yet-shared) Unicode name, 64 bytes or more
-                log.warn('Not Yet Implemented: Long Key Name')
-            elif 0x35 <= byt <= 0x39:
-                log.warn('Reserved: 0x35 <= key <= 0x39')
-            elif byt == 0x3A:
-                log.error('0x3A NOT allowed in Key mode')
-            elif 0x3B <= byt <= 0x3F:
-                log.warn('Reserved: 0x3B <= key <= 0x3F')
-            elif TOKEN_PREFIX_KEY_SHARED_SHORT <= byt <= 0x7F:
-                # "Short" shared key name reference (1 byte lookup)
-                log.debug('Token: Short Shared Key Name Reference')
-                state.copy_shared_key_string()
-            elif TOKEN_PREFIX_KEY_ASCII <= byt <= 0xBF:
-                # Short Ascii names
-                # 5 LSB used to indicate lengths from 2 to 32 (bytes == chars)
-                log.debug('Token: Short ASCII Name')
-                smile_key_length = (byt & 0x1F) + 1
-                state.copy_key_string(smile_key_length)
-            elif TOKEN_PREFIX_KEY_UNICODE <= byt <= TOKEN_RESERVED:
-                # Short Unicode names
-                # 5 LSB used to indicate lengths from 2 to 57
-                log.debug('Token: Short Unicode Name')
-                smile_key_length = (byt - 0xC0) + 2
-                state.copy_key_string(smile_key_length)
-            elif TOKEN_LITERAL_START_ARRAY <= byt <= TOKEN_LITERAL_START_OBJECT:
-                log.warn('Reserved: 0xF8 <= key <= 0xFA')
-            elif byt == TOKEN_LITERAL_END_OBJECT:
-                log.debug('Token: Literal End Object')
-                state.write('}')
-                state.nested_depth -= 1
-                try:
-                    in_arry = state.in_array[state.nested_depth]
-                except IndexError:
-                    in_arry = False
-                if in_arry:
-                    state.mode = DecodeMode.VALUE
-                else:
-                    state.mode = DecodeMode.KEY
-                continue
-            elif byt >= BYTE_MARKER_END_OF_STRING:
-                log.warn('Reserved: key >= 0xFC')
-            state.mode = DecodeMode.VALUE
-        elif state.mode == DecodeMode.BAD:
-            if state.error is None:
-                state.error = 'Unknown Error!'
-            break
-        elif state.mode == DecodeMode.DONE:
-            log.debug('Decoding Done!')
+                value = container
+            container, in_object, key = stack.pop()
+        elif byt == TOKEN_LITERAL_START_ARRAY:
+            elements -= 1
+            if elements < 0 or len(stack) >= max_depth:
+                raise _container_error(state, elements, len(stack))
+            stack.append((container, in_object, key))
+            container, in_object, key = [], False, None
+            continue
+        elif byt == TOKEN_LITERAL_START_OBJECT:
+            elements -= 1
+            if elements < 0 or len(stack) >= max_depth:
+                raise _container_error(state, elements, len(stack))
+            stack.append((container, in_object, key))
+            container = [] if object_pairs_hook is not None else {}
+            in_object, key = True, None
+            continue
+        elif byt == TOKEN_LITERAL_END_ARRAY:
+            if in_object or container is None:
+                raise state.error('Unexpected end of array', state.index - 1)
+            value = container
+            container, in_object, key = stack.pop()
+        else:
+            elements -= 1
+            if elements < 0:
+                raise _elements_error(state)
+            value = decoders[byt](state, byt)
+
+        if container is None:
             break
-    if state.mode == DecodeMode.BAD:
-        raise SMILEDecodeError('Bad State: {}'.format(state.error), state.get_value())
-    ret_val = state.get_value()
-    try:
-        jsonified = json.loads(ret_val)
-    except (ValueError, UnicodeDecodeError):
-        msg = 'Unable to jsonify string: {!r}'.format(ret_val)
-        log.exception(msg)
-        raise SMILEDecodeError(msg, ret_val)
-    return jsonified
-    # return state.get_value()
+        if in_object:
+            if object_pairs_hook is not None:
+                container.append((key, value))
+            else:
+                container[key] = value
+            key = None
+        else:
+            container.append(value)
+    return value
+
+
+def _elements_error(state):
+    return state.limit_error('More than {} values'.format(state.max_elements), 'max_elements',
+                             state.index - 1)
+
+
+def _container_error(state, elements, depth):
+    if elements < 0:
+        return _elements_error(state)
+    return state.limit_error('Nesting deeper than {}'.format(state.max_depth), 'max_depth',
+                             state.index - 1)
+
+
+def load(fp, object_hook=None, object_pairs_hook=None, binary_view=False, stats=None,
+         limits=None, records=None, lazy=False):
+    """
+    Decode SMILE data read from a file-like object
+
+    Compressed containers are inflated block by block while reading, so only the
+    uncompressed document is ever held in memory.  With *limits* no more than
+    ``limits.max_document_size`` (+ 1) bytes are read.
+
+    :param fp: File-like object (``read``)
+    :param object_hook: (optional) See :func:`decode`
+    :param object_pairs_hook: (optional) See :func:`decode`
+    :param bool binary_view: (optional - Default: `False`) See :func:`decode`
+    :param pysmile.stats.SmileStats stats: (optional) See :func:`decode`
+    :param DecodeLimits limits: (optional) See :func:`decode`
+    :param records: (optional) See :func:`decode`
+    :param bool lazy: (optional - Default: `False`) See :func:`decode`
+    :returns: Decoded python object
+    :rtype: list | dict
+    """
+    head = fp.read(4)
+    if is_compressed(head):
+        with phase(stats, 'decompress'):
+            data = _inflate(_Prefixed(head, fp), limits)
+    else:
+        data = bytearray(head)
+        if limits is None or limits.max_document_size is None:
+            data.extend(fp.read())
+        else:
+            # One byte over the limit is enough to reject the document
+            _read_into(data, fp, limits.max_document_size + 1)
+    return decode(data, object_hook, object_pairs_hook, binary_view, stats, limits, records,
+                  lazy)
+
+
+def _read_into(data, fp, size):
+    """Read from *fp* until *data* holds *size* bytes or the end of the file"""
+    while len(data) < size:
+        chunk = fp.read(size - len(data))
+        if not chunk:
+            return
+        data.extend(chunk)
+
+
+def iter_load(fp, object_hook=None, object_pairs_hook=None, binary_view=False,
+              read_size=DEFAULT_READ_SIZE, max_document_size=DEFAULT_MAX_DOCUMENT_SIZE,
+              limits=None, records=None):
+    """
+    Decode a stream of SMILE documents read from a file-like object
+
+    Every document starts with a header and may be followed by end markers (0xFF), which is
+    what ``dump(..., ender=True)`` writes.  The stream may also be wrapped in a single
+    compressed container.  Only the document being decoded is held in memory.
+
+    A document that does not fit the buffer is parsed again once at least twice as much has
+    been read, so the time spent is linear in the size of the stream.
+
+    :param fp: File-like object (``read``)
+    :param object_hook: (optional) See :func:`decode`
+    :param object_pairs_hook: (optional) See :func:`decode`
+    :param bool binary_view: (optional - Default: `False`) See :func:`decode`
+    :param int read_size: (optional - Default: 64 KiB) Bytes read at a time
+    :param int max_document_size: (optional - Default: 64 MiB) Largest document accepted
+    :param DecodeLimits limits: (optional) Per document limits; a smaller
+                                ``limits.max_document_size`` takes precedence over
+                                *max_document_size*
+    :param records: (optional) See :func:`decode`; one record decoder serves the whole
+                    stream
+    :returns: Generator of decoded python objects
+    :raises SMILEDecodeError: On invalid or truncated data, or a document over
+                              *max_document_size*
+    """
+    if limits is not None and limits.max_document_size is not None:
+        max_document_size = min(max_document_size, limits.max_document_size)
+    if records is not None:
+        object_pairs_hook = _record_hook(records)
+    head = fp.read(4)
+    if is_compressed(head):
+        chunks = iter_decompress(_Prefixed(head, fp))
+    else:
+        chunks = _iter_read(head, fp, read_size)
+    # The buffer is replaced rather than resized: binary values decoded with *binary_view*
+    # may still be views into it.  Documents are decoded in place from *pos*, so a buffer
+    # holding many small documents is not copied once per document.
+    buf = bytearray()
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] == BYTE_MARKER_END_OF_CONTENT:
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                return
+            chunk = next(chunks, b'')
+            buf = bytearray(chunk)
+            pos = 0
+            eof = not chunk
+            continue
+        try:
+            state = DecodeState(buf, binary_view=binary_view, limits=limits, offset=pos)
+            value = _decode(state, object_hook, object_pairs_hook, single=False)
+        except SMILELimitError:
+            raise
+        except SMILEDecodeError:
+            # Most likely the document continues past the buffer: read at least as much
+            # again, so a large document is parsed a logarithmic number of times
+            size = len(buf) - pos
+            if eof or size > max_document_size:
+                raise
+            parts = [memoryview(buf)[pos:]]
+            want = size * 2
+            while not eof and size < want:
+                chunk = next(chunks, b'')
+                parts.append(chunk)
+                size += len(chunk)
+                eof = not chunk
+            buf = bytearray().join(parts)
+            pos = 0
+            continue
+        pos = state.index
+        yield value
+
+
+def _iter_read(head, fp, read_size):
+    if head:
+        yield head
+    while True:
+        data = fp.read(read_size)
+        if not data:
+            return
+        yield data
+
+
+class _Prefixed(object):
+    """``read`` that returns *head* before continuing with *fp*"""
+    def __init__(self, head, fp):
+        self.head = head
+        self.fp = fp
+
+    def read(self, n):
+        if self.head:
+            ret, self.head = self.head[:n], self.head[n:]
+            if len(ret) < n:
+                ret += self.fp.read(n - len(ret))
+            return ret
+        return self.fp.read(n)
 
 if __name__ == '__main__':
     a = {'a': '1', 'b': 2, 'c': [3], 'd': -1, 'e': 4.20}
-    b = decode(':)\n\x03\xfa\x80a@1\x80c\xf8\xc6\xf9\x80b\xc4\x80e(fL\x19\x04\x04\x80d\xc1\xfb')
+    b = decode(b':)\n\x03\xfa\x80a@1\x80c\xf8\xc6\xf9\x80b\xc4\x80e)\x00@\x083\x19Lf3\x19M\x80d\xc1\xfb')
     if a != b:
-        print repr(a)
-        print repr(b)
+        print(repr(a))
+        print(repr(b))
 
     a = {'a': {'b': {'c': {'d': ['e']}}}}
-    b = decode(':)\n\x03\xfa\x80a\xfa\x80b\xfa\x80c\xfa\x80d\xf8@e\xf9\xfb\xfb\xfb\xfb')
+    b = decode(b':)\n\x03\xfa\x80a\xfa\x80b\xfa\x80c\xfa\x80d\xf8@e\xf9\xfb\xfb\xfb\xfb')
     if a != b:
-        print repr(a)
-        print repr(b)
+        print(repr(a))
+        print(repr(b))
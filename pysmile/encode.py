@@ -1,48 +1,23 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """
 SMILE Encode
 """
-import re
 import sys
-import struct
-import decimal
-import copy
-import logging
-import json
-import json.encoder
+import itertools
 
 from pysmile.constants import *
-from pysmile import util
-
-log = logging.getLogger()
-if not log.handlers:
-    log.addHandler(logging.NullHandler())
+from pysmile import util, varint
+from pysmile.stats import HEADER, FRAGMENT, phase
+from pysmile.compress import CompressedWriter, _Sink
+from pysmile.fragment import RawSmile
 
 __author__ = 'Jonathan Hosmer'
 
 
-def _utf_8_encode(s):
-    try:
-        return s.encode('UTF-8')
-    except UnicodeEncodeError:
-        return s
-
-
-class SMILEEncodeError(StandardError):
+class SMILEEncodeError(Exception):
     pass
 
 
-class SharedStringNode(object):
-    """
-    Helper class used for keeping track of possibly shareable String references (for field names
-    and/or short String values)
-    """
-    def __init__(self, value, index, nxt):
-        self.value = value
-        self.index = index
-        self.next = nxt
-
-
 class SmileGenerator(object):
     """
     To simplify certain operations, we require output buffer length
@@ -55,26 +30,43 @@ class SmileGenerator(object):
     64-character Strings.
     """
 
-    def __init__(self, shared_keys=True, shared_values=True, encode_as_7bit=True):
+    def __init__(self, shared_keys=True, shared_values=True, encode_as_7bit=True,
+                 float_mode=FLOAT_MODE_DOUBLE, stats=None, canonical=False):
         """
         SmileGenerator Initializer
 
         :param bool encode_as_7bit: (optional - Default: `True`) Encode raw data as 7-bit
         :param bool shared_keys: (optional - Default: `True`) Shared Key String References
         :param bool shared_values: (optional - Default: `True`) Shared Value String References
+        :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) Write every float as
+                               64-bit (`FLOAT_MODE_DOUBLE`) or use 32-bit floats wherever that is
+                               exact (`FLOAT_MODE_LOSSLESS`)
+        :param pysmile.stats.SmileStats stats: (optional) Collect token statistics of
+                                               everything written by :func:`_encode`
+        :param bool canonical: (optional - Default: `False`) Deterministic output (see
+                               :func:`encode`); requires `FLOAT_MODE_DOUBLE`
         """
         # Encoded data
         self.output = bytearray()
 
-        # Shared Key Strings
-        self.shared_keys = []
+        # Shared Key Strings: back reference index by name
+        self.shared_keys = {}
+        self.seen_name_count = 0
 
-        # Shared Value Strings
-        self.shared_values = []
+        # Shared Value Strings: back reference index by value
+        self.shared_values = {}
+        self.seen_string_count = 0
 
         self.share_keys = bool(shared_keys)
         self.share_values = bool(shared_values)
         self.encode_as_7bit = bool(encode_as_7bit)
+        if float_mode not in (FLOAT_MODE_LOSSLESS, FLOAT_MODE_DOUBLE):
+            raise ValueError('Invalid float_mode: {!r}'.format(float_mode))
+        if canonical and float_mode != FLOAT_MODE_DOUBLE:
+            raise ValueError('Canonical encoding writes every float as 64-bit')
+        self.float_mode = float_mode
+        self.stats = stats
+        self.canonical = bool(canonical)
 
     def write_header(self):
         """
@@ -92,19 +84,21 @@ class SmileGenerator(object):
         if not self.encode_as_7bit:
             last |= HEADER_BIT_HAS_RAW_BINARY
         self.write_bytes(HEADER_BYTE_1, HEADER_BYTE_2, HEADER_BYTE_3, int(last))
+        if self.stats is not None:
+            self.stats.record(HEADER, 4)
 
     def write_end_marker(self):
         """Write optional end marker (BYTE_MARKER_END_OF_CONTENT - 0xFF)"""
-        self.write_byte(BYTE_MARKER_END_OF_CONTENT)
+        self.output.append(BYTE_MARKER_END_OF_CONTENT)
 
     def write_field_name(self, name):
         """
         Write Field Name
+
         :param str name: Name
         """
-        str_len = len(name)
         if not name:
-            return self.write_byte(TOKEN_KEY_EMPTY_STRING)
+            return self.output.append(TOKEN_KEY_EMPTY_STRING)
 
         # First: is it something we can share?
         if self.share_keys:
@@ -112,46 +106,33 @@ class SmileGenerator(object):
             if ix >= 0:
                 return self.write_shared_name_reference(ix)
 
-        if str_len > MAX_SHORT_NAME_UNICODE_BYTES:
+        if len(name) > MAX_SHORT_NAME_UNICODE_BYTES:
             #  can not be a 'short' String; off-line (rare case)
             return self.write_non_short_field_name(name)
-        if isinstance(name, unicode):
-            utf_8_name = name.encode('utf-8')
-            if len(utf_8_name) == str_len:
-                return self.write_field_name(utf_8_name)
-
-            if len(utf_8_name) <= MAX_SHORT_NAME_UNICODE_BYTES:
-                #  yes, is short indeed
-                #  note: since 2 is smaller allowed length, offset differs from one used for
-                type_token = int(((TOKEN_PREFIX_KEY_UNICODE - 2) + len(utf_8_name)))
-                self.write_bytes(type_token, utf_8_name)
-            else:
-                self.write_bytes(TOKEN_KEY_LONG_STRING, utf_8_name, BYTE_MARKER_END_OF_STRING)
-            if self.share_keys:
-                self._add_seen_name(utf_8_name)
-        else:  # if isinstance(name, str):
-            if str_len <= MAX_SHORT_NAME_ASCII_BYTES:
-                self.write_bytes(int(((TOKEN_PREFIX_KEY_ASCII - 1) + str_len)), name)
-            else:
-                self.write_bytes(TOKEN_KEY_LONG_STRING, name, BYTE_MARKER_END_OF_STRING)
-            if self.share_keys:
-                self._add_seen_name(name)
+        utf_8_name = name.encode('utf-8')
+        if len(utf_8_name) == len(name):
+            # ASCII
+            self.output.append((TOKEN_PREFIX_KEY_ASCII - 1) + len(utf_8_name))
+            self.output += utf_8_name
+        elif len(utf_8_name) <= MAX_SHORT_NAME_UNICODE_BYTES:
+            #  yes, is short indeed
+            #  note: since 2 is smaller allowed length, offset differs from one used for
+            self.output.append((TOKEN_PREFIX_KEY_UNICODE - 2) + len(utf_8_name))
+            self.output += utf_8_name
+        else:
+            self.write_bytes(TOKEN_KEY_LONG_STRING, utf_8_name, BYTE_MARKER_END_OF_STRING)
+        if self.share_keys:
+            self._add_seen_name(name)
 
     def write_non_short_field_name(self, name):
         """
         Write nonshort field name
 
-        :param basestring name: Name
+        :param str name: Name
         """
-        self.write_byte(TOKEN_KEY_LONG_STRING)
-        try:
-            utf_8_name = name.encode('utf-8')
-        except UnicodeEncodeError:
-            utf_8_name = name
-        self.write_bytes(utf_8_name)
+        self.write_bytes(TOKEN_KEY_LONG_STRING, name.encode('utf-8'), BYTE_MARKER_END_OF_STRING)
         if self.share_keys:
             self._add_seen_name(name)
-        self.write_byte(BYTE_MARKER_END_OF_STRING)
 
     def write_string_field(self, name, value):
         """
@@ -172,7 +153,7 @@ class SmileGenerator(object):
         if text is None:
             return self.write_null()
         if not text:
-            return self.write_byte(TOKEN_LITERAL_EMPTY_STRING)
+            return self.output.append(TOKEN_LITERAL_EMPTY_STRING)
         # Longer string handling off-lined
         if len(text) > MAX_SHARED_STRING_LENGTH_BYTES:
             return self.write_non_shared_string(text)
@@ -183,45 +164,33 @@ class SmileGenerator(object):
             if ix >= 0:
                 return self.write_shared_string_value_reference(ix)
 
-        if isinstance(text, unicode):
-            utf_8_text = text.encode('utf-8')
-            if len(utf_8_text) <= MAX_SHORT_VALUE_STRING_BYTES:
-                if self.share_values:
-                    self._add_seen_string_value(text)
-                if len(utf_8_text) == len(text):
-                    self.write_byte(int((TOKEN_PREFIX_TINY_ASCII - 1) + len(utf_8_text)))
-                else:
-                    self.write_byte(int((TOKEN_PREFIX_TINY_UNICODE - 2) + len(utf_8_text)))
-                self.write_bytes(utf_8_text)
+        utf_8_text = text.encode('utf-8')
+        if len(utf_8_text) <= MAX_SHORT_VALUE_STRING_BYTES:
+            if self.share_values:
+                self._add_seen_string_value(text)
+            if len(utf_8_text) == len(text):
+                self.output.append((TOKEN_PREFIX_TINY_ASCII - 1) + len(utf_8_text))
             else:
-                if len(utf_8_text) == len(text):
-                    self.write_byte(TOKEN_BYTE_LONG_STRING_ASCII)
-                else:
-                    self.write_byte(TOKEN_MISC_LONG_TEXT_UNICODE)
-                self.write_bytes(utf_8_text, BYTE_MARKER_END_OF_STRING)
+                self.output.append((TOKEN_PREFIX_TINY_UNICODE - 2) + len(utf_8_text))
+            self.output += utf_8_text
         else:
-            if len(text) <= MAX_SHORT_VALUE_STRING_BYTES:
-                if self.share_values:
-                    self._add_seen_string_value(text)
-                self.write_bytes(int((TOKEN_PREFIX_TINY_ASCII - 1) + len(text)), text)
-            else:
-                self.write_bytes(TOKEN_BYTE_LONG_STRING_ASCII, text, BYTE_MARKER_END_OF_STRING)
+            self._write_long_string(text, utf_8_text)
 
     def write_start_array(self):
         """Write start array token"""
-        self.write_byte(TOKEN_LITERAL_START_ARRAY)
+        self.output.append(TOKEN_LITERAL_START_ARRAY)
 
     def write_end_array(self):
         """Write end array token"""
-        self.write_byte(TOKEN_LITERAL_END_ARRAY)
+        self.output.append(TOKEN_LITERAL_END_ARRAY)
 
     def write_start_object(self):
         """Write start object token"""
-        self.write_byte(TOKEN_LITERAL_START_OBJECT)
+        self.output.append(TOKEN_LITERAL_START_OBJECT)
 
     def write_end_object(self):
         """Write end object token"""
-        self.write_byte(TOKEN_LITERAL_END_OBJECT)
+        self.output.append(TOKEN_LITERAL_END_OBJECT)
 
     def write_shared_name_reference(self, ix):
         """
@@ -229,14 +198,12 @@ class SmileGenerator(object):
 
         :param int ix: Index
         """
-        if ix >= len(self.shared_keys)-1:
-            raise ValueError(
-                'Trying to write shared name with index {} but have only seen {}!'.format(
-                    ix, len(self.shared_keys)))
+        if not 0 <= ix < MAX_SHARED_NAMES:
+            raise ValueError('Invalid shared name index {}'.format(ix))
         if ix < 64:
-            self.write_byte(int((TOKEN_PREFIX_KEY_SHARED_SHORT + ix)))
+            self.output.append(TOKEN_PREFIX_KEY_SHARED_SHORT + ix)
         else:
-            self.write_bytes((int((TOKEN_PREFIX_KEY_SHARED_LONG + (ix >> 8)))), int(ix))
+            self.write_bytes((int((TOKEN_PREFIX_KEY_SHARED_LONG + (ix >> 8)))), int(ix & 0xFF))
 
     def write_shared_string_value_reference(self, ix):
         """
@@ -244,15 +211,13 @@ class SmileGenerator(object):
 
         :param int ix: Index
         """
-        if ix > len(self.shared_values)-1:
-            raise IllegalArgumentException(
-                'Internal error: trying to write shared String value with index {}; but have '
-                'only seen {} so far!'.format(ix, len(self.shared_values)))
+        if not 0 <= ix < MAX_SHARED_STRING_VALUES:
+            raise ValueError('Invalid shared String value index {}'.format(ix))
         if ix < 31:
             #  add 1, as byte 0 is omitted
-            self.write_byte(TOKEN_PREFIX_SHARED_STRING_SHORT + 1 + ix)
+            self.output.append(TOKEN_PREFIX_SHARED_STRING_SHORT + 1 + ix)
         else:
-            self.write_bytes(TOKEN_PREFIX_SHARED_STRING_LONG + (ix >> 8), int(ix))
+            self.write_bytes(TOKEN_PREFIX_SHARED_STRING_LONG + (ix >> 8), int(ix & 0xFF))
 
     def write_non_shared_string(self, text):
         """
@@ -261,49 +226,71 @@ class SmileGenerator(object):
 
         :param str text: Text
         """
-        if isinstance(text, unicode):
-            utf_8_text = text.encode('utf-8')
-            if len(utf_8_text) <= MAX_SHORT_VALUE_STRING_BYTES:
-                if len(utf_8_text) == len(text):
-                    self.write_byte(int((TOKEN_PREFIX_TINY_ASCII - 1) + len(utf_8_text)))
-                else:
-                    self.write_byte(int((TOKEN_PREFIX_TINY_UNICODE - 2) + len(utf_8_text)))
-                self.write_bytes(utf_8_text)
+        utf_8_text = text.encode('utf-8')
+        if len(utf_8_text) <= MAX_SHORT_VALUE_STRING_BYTES:
+            if len(utf_8_text) == len(text):
+                self.output.append((TOKEN_PREFIX_TINY_ASCII - 1) + len(utf_8_text))
             else:
-                if len(utf_8_text) == len(text):
-                    self.write_byte(TOKEN_MISC_LONG_TEXT_ASCII)
-                else:
-                    self.write_byte(TOKEN_MISC_LONG_TEXT_UNICODE)
-                self.write_bytes(utf_8_text, BYTE_MARKER_END_OF_STRING)
+                self.output.append((TOKEN_PREFIX_TINY_UNICODE - 2) + len(utf_8_text))
+            self.output += utf_8_text
         else:
-            if len(text) <= MAX_SHORT_VALUE_STRING_BYTES:
-                self.write_bytes(int((TOKEN_PREFIX_TINY_ASCII - 1) + len(text)), text)
-            else:
-                self.write_bytes(TOKEN_MISC_LONG_TEXT_ASCII, text, BYTE_MARKER_END_OF_STRING)
+            self._write_long_string(text, utf_8_text)
+
+    def _write_long_string(self, text, utf_8_text):
+        """
+        :param str text: Text
+        :param bytes utf_8_text: *text* encoded
+        """
+        if len(utf_8_text) == len(text):
+            self.output.append(TOKEN_MISC_LONG_TEXT_ASCII)
+        else:
+            self.output.append(TOKEN_MISC_LONG_TEXT_UNICODE)
+        self.output += utf_8_text
+        self.output.append(BYTE_MARKER_END_OF_STRING)
 
     def write_binary(self, data):
         """
         Write Data
 
-        :param data: Data
+        7-bit encoded unless the generator was created with ``encode_as_7bit=False``, in
+        which case the bytes are copied as-is (and the header says so).
+
+        :param bytes|bytearray|memoryview data: Data
         """
         if data is None:
             return self.write_null()
         if self.encode_as_7bit:
-            self.write_byte(TOKEN_MISC_BINARY_7BIT)
+            self.output.append(TOKEN_MISC_BINARY_7BIT)
             self.write_7bit_binary(data)
         else:
-            self.write_byte(TOKEN_MISC_BINARY_RAW)
+            self.output.append(TOKEN_MISC_BINARY_RAW)
             self.write_positive_vint(len(data))
-            self.write_bytes(data)
+            self.output += data
+
+    def write_raw(self, fragment):
+        """
+        Write an encoded value as-is, and add its strings to the back reference tables like a
+        decoder reading it will
+
+        :param pysmile.fragment.RawSmile fragment: Encoded value
+        """
+        self.output += fragment
+        if self.share_keys:
+            for name in fragment.key_strings:
+                self._add_seen_name(name)
+        if self.share_values:
+            for text in fragment.value_strings:
+                self._add_seen_string_value(text)
+        if self.stats is not None:
+            self.stats.record(FRAGMENT, len(fragment))
 
     def write_true(self):
         """Write True Value"""
-        self.write_byte(TOKEN_LITERAL_TRUE)
+        self.output.append(TOKEN_LITERAL_TRUE)
 
     def write_false(self):
         """Write True Value"""
-        self.write_byte(TOKEN_LITERAL_FALSE)
+        self.output.append(TOKEN_LITERAL_FALSE)
 
     def write_boolean(self, state):
         """
@@ -311,138 +298,97 @@ class SmileGenerator(object):
 
         :param bool state: Bool state
         """
-        self.write_byte(state and TOKEN_LITERAL_TRUE or TOKEN_LITERAL_FALSE)
+        self.output.append(state and TOKEN_LITERAL_TRUE or TOKEN_LITERAL_FALSE)
 
     def write_null(self):
         """ generated source for method writeNull """
-        self.write_byte(TOKEN_LITERAL_NULL)
+        self.output.append(TOKEN_LITERAL_NULL)
 
     def write_number(self, i):
         """
         Write Numner
 
-        :param int|long|float|str i: number
+        :param int|float|decimal.Decimal|str i: number
         """
         if isinstance(i, int):
-            #  First things first: let's zigzag encode number
-            i = util.zigzag_encode(i)
-            #  tiny (single byte) or small (type + 6-bit value) number?
-            if 0x3F >= i >= 0:
-                if i <= 0x1F:
-                    self.write_byte(int((TOKEN_PREFIX_SMALL_INT + i)))
-                    return
-                #  nope, just small, 2 bytes (type, 1-byte zigzag value) for 6 bit value
-                self.write_bytes(TOKEN_BYTE_INT_32, int((0x80 + i)))
-                return
-            #  Ok: let's find minimal representation then
-            b0 = int((0x80 + (i & 0x3F)))
-            i >>= 6
-            if i <= 0x7F:
-                #  13 bits is enough (== 3 byte total encoding)
-                self.write_bytes(TOKEN_BYTE_INT_32, int(i), b0)
-                return
-            b1 = int((i & 0x7F))
-            i >>= 7
-            if i <= 0x7F:
-                self.write_bytes(TOKEN_BYTE_INT_32, int(i), b1, b0)
-                return
-            b2 = int((i & 0x7F))
-            i >>= 7
-            if i <= 0x7F:
-                self.write_bytes(TOKEN_BYTE_INT_32, int(i), b2, b1, b0)
-                return
-            #  no, need all 5 bytes
-            b3 = int((i & 0x7F))
-            self.write_bytes(TOKEN_BYTE_INT_32, int((i >> 7)), b3, b2, b1, b0)
-        elif isinstance(i, long):
-            #  First: maybe 32 bits is enough?
-            if MAX_INT_AS_LONG >= i >= MIN_INT_AS_LONG:
-                return self.write_number(int(i))
-
-            # Then let's zigzag encode it
-            l = util.zigzag_encode(i)
-            #  Ok, well, we do know that 5 lowest-significant bytes are needed
-            i = int(l)
-            #  4 can be extracted from lower int
-            b0 = int((0x80 + (i & 0x3F)))
-            #  sign bit set in the last byte
-            b1 = int(((i >> 6) & 0x7F))
-            b2 = int(((i >> 13) & 0x7F))
-            b3 = int(((i >> 20) & 0x7F))
-            #  fifth one is split between ints:
-            l = bsr(l, 27)
-            b4 = int(((int(l)) & 0x7F))
-            #  which may be enough?
-            i = int((l >> 7))
-            if i == 0:
-                self.write_bytes(TOKEN_BYTE_INT_64, b4, b3, b2, b1, b0)
-                return
-            if i <= 0x7F:
-                self.write_bytes(TOKEN_BYTE_INT_64, int(i), b4, b3, b2, b1, b0)
-                return
-            b5 = int((i & 0x7F))
-            i >>= 7
-            if i <= 0x7F:
-                self.write_bytes(TOKEN_BYTE_INT_64, int(i), b5, b4, b3, b2, b1, b0)
-                return
-            b6 = int((i & 0x7F))
-            i >>= 7
-            if i <= 0x7F:
-                self.write_bytes(TOKEN_BYTE_INT_64, int(i), b6, b5, b4, b3, b2, b1, b0)
-                return
-            b7 = int((i & 0x7F))
-            i >>= 7
-            if i <= 0x7F:
-                self.write_bytes(TOKEN_BYTE_INT_64, int(i), b7, b6, b5, b4, b3, b2, b1, b0)
-                return
-            b8 = int((i & 0x7F))
-            i >>= 7
-            #  must be done, with 10 bytes! (9 * 7 + 6 == 69 bits; only need 63)
-            self.write_bytes(TOKEN_BYTE_INT_64, int(i), b8, b7, b6, b5, b4, b3, b2, b1, b0)
-
-        elif isinstance(i, basestring):
+            if MAX_LONG >= i >= MIN_LONG:
+                varint.write_int(self.output, i)
+            else:
+                self.write_big_number(i)
+        elif isinstance(i, str):
             if not i:
                 self.write_null()
                 return
             neg = i.startswith('-')
-            i = i.strip('-')
+            i = i.lstrip('-+')
             if i.isdigit():
                 self.write_integral_number(i, neg)
             else:
-                self.write_decimal_number(i)
-        elif isinstance(i, (float, decimal.Decimal)):
-            if isinstance(i, decimal.Decimal) and isinstance(int(float(i)), long):
-                self.write_byte(TOKEN_BYTE_BIG_DECIMAL)
-                scale = i.as_tuple().exponent
-                self.write_signed_vint(scale)
-                self.write_7bit_binary(bytearray(str(i.to_integral_value())))
-            else:
-                i = float(i)
-                try:
-                    i = util.float_to_bits(i)
-                    self.write_byte(TOKEN_BYTE_FLOAT_32)
-                    self.write_byte(int(i & 0x7F))
-                    for _ in xrange(4):
-                        i >>= 7
-                        self.write_byte(int(i & 0x7F))
-                except struct.error:
-                    i = util.float_to_raw_long_bits(i)
-                    self.write_byte(TOKEN_BYTE_FLOAT_64)
-                    self.write_byte(int(i & 0x7F))
-                    for _ in xrange(9):
-                        i >>= 7
-                        self.write_byte(int(i & 0x7F))
+                self.write_decimal_number('-' + i if neg else i)
+        elif isinstance(i, float):
+            self.write_float(i)
+        elif _is_decimal_type(type(i)):
+            self.write_big_decimal(i)
+
+    def write_float(self, f):
+        """
+        Write a floating point number as 32 or 64-bit IEEE value, depending on `float_mode`
+
+        :param float f: Value
+        """
+        if self.float_mode == FLOAT_MODE_LOSSLESS and util.is_float32_exact(f):
+            self.output.append(TOKEN_BYTE_FLOAT_32)
+            self.output.extend(util.float32_to_7bit(f))
+        else:
+            self.write_double(f)
+
+    def write_double(self, f):
+        """
+        Write a floating point number as 64-bit IEEE value
+
+        :param float f: Value
+        """
+        if f != f and self.canonical:
+            # One NaN, whatever the sign and payload bits of this one
+            f = _NAN
+        self.output.append(TOKEN_BYTE_FLOAT_64)
+        self.output.extend(util.float64_to_7bit(f))
 
     def write_big_number(self, i):
         """
-        Write Big Number
+        Write Big Number: length and 7-bit encoded bytes of the minimal two's complement
+        representation (Java ``BigInteger.toByteArray()``)
 
-        :param i: Big Number
+        :param int i: Big Number
         """
         if i is None:
             return self.write_null()
-        self.write_byte(TOKEN_BYTE_BIG_INTEGER)
-        self.write_7bit_binary(bytearray(str(i)))
+        self.output.append(TOKEN_BYTE_BIG_INTEGER)
+        self.write_7bit_binary(util.int_to_bytes(i))
+
+    def write_big_decimal(self, d):
+        """
+        Write Big Decimal: zigzag encoded scale, then the unscaled value as for
+        :meth:`write_big_number` (``d == unscaled * 10 ** -scale``)
+
+        NaN and Infinity have no BigDecimal form and are written as floats.
+
+        :param decimal.Decimal d: Decimal
+        """
+        if d is None:
+            return self.write_null()
+        if not d.is_finite():
+            return self.write_float(float('nan') if d.is_nan() else float(d))
+        sign, digits, exponent = d.as_tuple()
+        if not MAX_INT_32 >= -exponent >= MIN_INT_32:
+            raise ValueError('BigDecimal scale out of range: {!r}'.format(d))
+        # Already imported by whoever made *d*
+        import decimal
+        # Not through str(), which is subject to sys.set_int_max_str_digits
+        unscaled = int(decimal.Decimal((sign, digits, 0)))
+        self.output.append(TOKEN_BYTE_BIG_DECIMAL)
+        self.write_signed_vint(-exponent)
+        self.write_7bit_binary(util.int_to_bytes(unscaled))
 
     def write_integral_number(self, num, neg=False):
         """
@@ -453,16 +399,8 @@ class SmileGenerator(object):
         """
         if num is None:
             return self.write_null()
-        num_len = len(num)
-        if neg:
-            num_len -= 1
-        # try:
-        if num_len <= 9:
-            self.write_number(int(num))
-        elif num_len <= 18:
-            self.write_number(long(num))
-        else:
-            self.write_big_number(num)
+        num = int(num)
+        self.write_number(-num if neg else num)
 
     def write_decimal_number(self, num):
         """
@@ -472,27 +410,23 @@ class SmileGenerator(object):
         """
         if num is None:
             return self.write_null()
-        self.write_number(decimal.Decimal(num))
+        import decimal
+        self.write_big_decimal(decimal.Decimal(num))
 
     def write_byte(self, c):
         """
         Write byte
 
-        :param int|long|float|basestring c: byte
-        """
-        if isinstance(c, basestring):
-            if isinstance(c, unicode):
-                c = c.encode('utf-8')
-        elif isinstance(c, float):
-            c = str(c)
-        elif isinstance(c, (int, long)):
-            try:
-                c = chr(c)
-            except ValueError:
-                c = str(c)
+        :param int|bytes|str c: Byte value, or bytes (text is written UTF-8 encoded)
+        """
+        if isinstance(c, int):
+            self.output.append(c)
+        elif isinstance(c, str):
+            self.output += c.encode('utf-8')
+        elif isinstance(c, (bytes, bytearray, memoryview)):
+            self.output += c
         else:
             raise ValueError('Invalid type for param "c"!')
-        self.output.extend(c)
 
     def write_bytes(self, *args):
         """
@@ -500,202 +434,86 @@ class SmileGenerator(object):
 
         :param args: args
         """
-        map(self.write_byte, args)
+        for c in args:
+            self.write_byte(c)
 
     def write_positive_vint(self, i):
         """
-        Helper method for writing a 32-bit positive (really 31-bit then) value.
+        Helper method for writing a positive value as VInt.
         Value is NOT zigzag encoded (since there is no sign bit to worry about)
 
         :param int i: Int
         """
-        #  At most 5 bytes (4 * 7 + 6 bits == 34 bits)
-        b0 = int((0x80 + (i & 0x3F)))
-        i >>= 6
-        if i <= 0x7F:
-            #  6 or 13 bits is enough (== 2 or 3 byte total encoding)
-            if i > 0:
-                self.write_byte(int(i))
-            self.write_byte(b0)
-            return
-        b1 = int((i & 0x7F))
-        i >>= 7
-        if i <= 0x7F:
-            self.write_bytes(int(i), b1, b0)
-        else:
-            b2 = int((i & 0x7F))
-            i >>= 7
-            if i <= 0x7F:
-                self.write_bytes(int(i), b2, b1, b0)
-            else:
-                b3 = int((i & 0x7F))
-                self.write_bytes(int((i >> 7)), b3, b2, b1, b0)
+        varint.write_vint(self.output, i)
 
     def write_signed_vint(self, i):
         """
-        Helper method for writing 32-bit signed value, using
+        Helper method for writing signed value, using
         "zig zag encoding" (see protocol buffers for explanation -- basically,
         sign bit is moved as LSB, rest of value shifted left by one)
         coupled with basic variable length encoding
 
         :param int i: Signed int
         """
-        self.write_positive_vint(util.zigzag_encode(i))
+        varint.write_vint(self.output, varint.zigzag_encode(i))
 
     def write_7bit_binary(self, data, offset=0):
-        l = len(data)
-        self.write_positive_vint(l)
-        while l >= 7:
-            i = data[offset]
-            offset += 1
-            for x in xrange(1, 7):
-                self.write_byte(int(((i >> x) & 0x7F)))
-                i = (i << 8) | (data[offset + x] & 0xFF)
-                offset += 1
-            self.write_bytes(int(((i >> 7) & 0x7F)), int((i & 0x7F)))
-            l -= 7
-        #  and then partial piece, if any
-        if l > 0:
-            i = data[offset]
-            offset += 1
-            self.write_byte(int(((i >> 1) & 0x7F)))
-            if l > 1:
-                i = ((i & 0x01) << 8) | (data[offset] & 0xFF)
-                offset += 1
-
-                #  2nd
-                self.write_byte(int(((i >> 2) & 0x7F)))
-                if l > 2:
-                    i = ((i & 0x03) << 8) | (data[offset] & 0xFF)
-                    offset += 1
-                    #  3rd
-                    self.write_byte(int(((i >> 3) & 0x7F)))
-                    if l > 3:
-                        i = ((i & 0x07) << 8) | (data[offset] & 0xFF)
-                        offset += 1
-                        #  4th
-                        self.write_byte(int(((i >> 4) & 0x7F)))
-                        if l > 4:
-                            i = ((i & 0x0F) << 8) | (data[offset] & 0xFF)
-                            offset += 1
-                            #  5th
-                            self.write_byte(int(((i >> 5) & 0x7F)))
-                            if l > 5:
-                                i = ((i & 0x1F) << 8) | (data[offset] & 0xFF)
-                                offset += 1
-                                #  6th
-                                self.write_byte(int(((i >> 6) & 0x7F)))
-                                self.write_byte(int((i & 0x3F)))
-                                #  last 6 bits
-                            else:
-                                self.write_byte(int((i & 0x1F)))
-                                #  last 5 bits
-                        else:
-                            self.write_byte(int((i & 0x0F)))
-                            #  last 4 bits
-                    else:
-                        self.write_byte(int((i & 0x07)))
-                        #  last 3 bits
-                else:
-                    self.write_byte(int((i & 0x03)))
-                    #  last 2 bits
-            else:
-                self.write_byte(int((i & 0x01)))
-                #  last bit
+        """
+        Write the length of *data* followed by its 7-bit encoding (see :func:`util.encode_7bit`)
+
+        :param bytes|bytearray|memoryview data: Data
+        :param int offset: (optional - Default: 0) Start of the bytes to write
+        """
+        if offset:
+            data = memoryview(data)[offset:]
+        self.write_positive_vint(len(data))
+        self.output += util.encode_7bit(data)
 
     def _find_seen_name(self, name):
-        n_hash = util.hash_string(name)
-        try:
-            head = self.shared_keys[n_hash & (len(self.shared_keys) - 1)]
-        except IndexError:
-            return -1
-        if head is None:
-            return -1
-
-        if head.value is name:
-            return head.index
-
-        node = head
-        while node:
-            if node.value is name:
-                return node.index
-            node = node.next
-        node = head
-        while node:
-            if node.value == name and util.hash_string(node.value) == n_hash:
-                return node.index
-            node = node.next
+        """
+        :param str name: Field name
+        :returns: Back reference index of *name*, or -1
+        :rtype: int
+        """
+        return self.shared_keys.get(name, -1)
 
     def _add_seen_name(self, name):
-        # if self.seen_name_count == len(self.shared_keys):
-        if self.shared_keys:
-            if len(self.shared_keys) == MAX_SHARED_NAMES:
-                # self.seen_name_count = 0
-                self.shared_keys = [None] * len(self.shared_keys)
-            else:
-                old = copy.copy(self.shared_keys)
-                self.shared_keys = [None] * MAX_SHARED_NAMES
-                mask = MAX_SHARED_NAMES - 1
-                for node in old:
-                    while node:
-                        ix = util.hash_string(node.value) & mask
-                        next_node = node.next
-                        try:
-                            node.next = self.shared_keys[ix]
-                        except IndexError:
-                            node.next = None
-                        self.shared_keys[ix] = node
-                        node = next_node
-            # ref = self.seen_name_count
-            if _is_valid_back_ref(len(self.shared_keys)):
-                ix = util.hash_string(name) & (len(self.shared_keys) - 1)
-                self.shared_keys[ix] = SharedStringNode(name, ref, self.shared_keys[ix])
-            # self.seen_name_count = ref + 1
+        """
+        Remember a field name that was written in full.  Like Jackson, the table starts over
+        once all 1024 indexes are used, and indexes that would produce the illegal bytes
+        0xFE/0xFF are skipped (the decoder still counts them).
+
+        :param str name: Field name
+        """
+        ref = self.seen_name_count
+        if ref == MAX_SHARED_NAMES:
+            self.shared_keys.clear()
+            ref = 0
+        if _is_valid_back_ref(ref):
+            self.shared_keys[name] = ref
+        self.seen_name_count = ref + 1
 
     def _find_seen_string_value(self, text):
-        hash_ = util.hash_string(text)
-        try:
-            head = self.shared_values[hash_ & (len(self.shared_values) - 1)]
-        except IndexError:
-            return -1
-        if head is None:
-            return -1
-        node = head
-        while node:
-            if node.value is text:
-                return node.index
-            node = node.next
-        node = head
-        while node:
-            if util.hash_string(node.value) == hash_ and node.value == text:
-                return node.index
-            node = node.next
+        """
+        :param str text: Short string value
+        :returns: Back reference index of *text*, or -1
+        :rtype: int
+        """
+        return self.shared_values.get(text, -1)
 
     def _add_seen_string_value(self, text):
-        # if self.seen_string_count == len(self.shared_values):
-        if self.shared_values:
-            if self.seen_string_count == MAX_SHARED_STRING_VALUES:
-                self.seen_string_count = 0
-                self.shared_values = [None] * len(self.shared_values)
-            else:
-                old = copy.copy(self.shared_values)
-                self.shared_values = [None] * MAX_SHARED_STRING_VALUES
-                mask = MAX_SHARED_STRING_VALUES - 1
-                for node in old:
-                    while node:
-                        ix = util.hash_string(node.value) & mask
-                        next_node = node.next
-                        try:
-                            node.next = self.shared_values[ix]
-                        except IndexError:
-                            node.next = None
-                        self.shared_values[ix] = node
-                        node = next_node
-            # ref = self.seen_string_count
-            if _is_valid_back_ref(len(self.shared_values)):
-                ix = util.hash_string(text) & (len(self.shared_values) - 1)
-                self.shared_values[ix] = SharedStringNode(text, ref, self.shared_values[ix])
-            # self.seen_string_count = ref + 1
+        """
+        Remember a short string value that was written in full (see :meth:`_add_seen_name`)
+
+        :param str text: Short string value
+        """
+        ref = self.seen_string_count
+        if ref == MAX_SHARED_STRING_VALUES:
+            self.shared_values.clear()
+            ref = 0
+        if _is_valid_back_ref(ref):
+            self.shared_values[text] = ref
+        self.seen_string_count = ref + 1
 
 
 def _is_valid_back_ref(index):
@@ -712,100 +530,439 @@ def _is_valid_back_ref(index):
     return (index & 0xFF) < 0xFE
 
 
-def encode(py_obj, header=True, ender=False, shared_keys=True, shared_vals=True, bin_7bit=True):
+def encode(py_obj, header=True, ender=False, shared_keys=True, shared_vals=True, bin_7bit=True,
+           compress=False, compress_threshold=DEFAULT_COMPRESS_THRESHOLD,
+           float_mode=FLOAT_MODE_DOUBLE, check_circular=True, default=None, stats=None,
+           canonical=False, fragments=None):
     """
     SMILE Encode object
 
-    :param list|dict py_obj: The object to be encoded
+    With *canonical* set, equal documents encode to the same bytes, so the output can be
+    used as (or hashed into, see :func:`fingerprint`) a cache or deduplication key:
+
+    * object members are written in order of their (string coerced) field names; keys that
+      coerce to the same name (``1`` and ``'1'``) are refused with :class:`ValueError`
+    * sets are written in order of their members' canonical encodings
+    * floats are always 64-bit and every NaN is written the same way
+    * shared key and value references follow from the order above, so they are the same too
+
+    Values that compare equal but are of different type or precision (``1`` and ``1.0``,
+    ``Decimal('1.0')`` and ``Decimal('1.00')``) are still told apart.
+
+    :param py_obj: The object to be encoded
     :param bool header: (optional - Default: `True`)
     :param bool ender: (optional - Default: `False`)
     :param bool bin_7bit: (optional - Default: `True`) Encode raw data as 7-bit
     :param bool shared_keys: (optional - Default: `True`) Shared Key String References
     :param bool shared_vals: (optional - Default: `True`) Shared Value String References
+    :param bool compress: (optional - Default: `False`) Wrap the output in a zlib compressed
+                          container (see :mod:`pysmile.compress`)
+    :param int compress_threshold: (optional - Default: 1 KiB) Output smaller than this is
+                                   left uncompressed even if *compress* is set
+    :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) 64-bit floats, or
+                           `FLOAT_MODE_LOSSLESS` for 32-bit floats wherever that is exact
+    :param bool check_circular: (optional - Default: `True`) Detect containers that contain
+                                themselves (:class:`ValueError`); disable to save the
+                                bookkeeping on documents known to be trees
+    :param default: (optional) Called as ``default(obj)`` for objects that cannot otherwise be
+                    encoded; returns an encodable replacement or raises :class:`TypeError`
+    :param pysmile.stats.SmileStats stats: (optional) Collect token and timing statistics
+    :param bool canonical: (optional - Default: `False`) Deterministic output (see above);
+                           can not be combined with `FLOAT_MODE_LOSSLESS`
+    :param pysmile.fragment.FragmentCache fragments: (optional) Write the registered
+                                                     objects of this cache from their cached
+                                                     encodings
     :returns: SMILE encoded data
-    :rtype: str
+    :rtype: bytes
+    """
+    if compress:
+        out = _Sink()
+        dump(py_obj, out, header, ender, shared_keys, shared_vals, bin_7bit,
+             compress=True, compress_threshold=compress_threshold, float_mode=float_mode,
+             check_circular=check_circular, default=default, stats=stats, canonical=canonical,
+             fragments=fragments)
+        return bytes(out.data)
+
+    sg = SmileGenerator(shared_keys, shared_vals, bin_7bit, float_mode, stats, canonical)
+    if header:
+        sg.write_header()
+    with phase(stats, 'encode'):
+        _encode(py_obj, sg, check_circular=check_circular, default=default,
+                fragments=fragments)
+    if ender:
+        sg.write_end_marker()
+    return bytes(sg.output)
+
+
+def dump(py_obj, fp, header=True, ender=False, shared_keys=True, shared_vals=True, bin_7bit=True,
+         compress=False, compress_threshold=DEFAULT_COMPRESS_THRESHOLD,
+         compress_level=DEFAULT_COMPRESS_LEVEL, block_size=DEFAULT_COMPRESS_BLOCK_SIZE,
+         float_mode=FLOAT_MODE_DOUBLE, check_circular=True, default=None, stats=None,
+         canonical=False, fragments=None):
+    """
+    SMILE Encode object into a file-like object
+
+    Output is handed to *fp* (or to the compressor) every *block_size* bytes, so neither the
+    encoded nor the compressed document is ever held in memory as a whole.
+
+    :param py_obj: The object to be encoded
+    :param fp: File-like object (``write``)
+    :param bool header: (optional - Default: `True`)
+    :param bool ender: (optional - Default: `False`)
+    :param bool shared_keys: (optional - Default: `True`) Shared Key String References
+    :param bool shared_vals: (optional - Default: `True`) Shared Value String References
+    :param bool bin_7bit: (optional - Default: `True`) Encode raw data as 7-bit
+    :param bool compress: (optional - Default: `False`) Write a zlib compressed container
+    :param int compress_threshold: (optional - Default: 1 KiB) Output smaller than this is
+                                   written uncompressed even if *compress* is set
+    :param int compress_level: (optional - Default: 6) zlib compression level
+    :param int block_size: (optional - Default: 64 KiB) Bytes buffered before each write
+    :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) 64-bit floats, or
+                           `FLOAT_MODE_LOSSLESS` for 32-bit floats wherever that is exact
+    :param bool check_circular: (optional - Default: `True`) Detect containers that contain
+                                themselves (:class:`ValueError`); disable to save the
+                                bookkeeping on documents known to be trees
+    :param default: (optional) Called as ``default(obj)`` for objects that cannot otherwise be
+                    encoded; returns an encodable replacement or raises :class:`TypeError`
+    :param pysmile.stats.SmileStats stats: (optional) Collect token and timing statistics;
+                                           time spent writing (and compressing) is reported
+                                           as the ``write`` phase
+    :param bool canonical: (optional - Default: `False`) Deterministic output (see
+                           :func:`encode`)
+    :param pysmile.fragment.FragmentCache fragments: (optional) As for :func:`encode`
     """
-    if isinstance(py_obj, (tuple, set)):
-        py_obj = list(py_obj)
-    elif not isinstance(py_obj, (list, dict)):
-        raise ValueError('Invalid type for "obj" paramater.  Must be list or tuple')
+    sg = SmileGenerator(shared_keys, shared_vals, bin_7bit, float_mode, stats, canonical)
+    writer = []
+
+    def _drain():
+        with phase(stats, 'write'):
+            if not writer:
+                writer.append(CompressedWriter(fp, compress_level, block_size) if compress
+                              else fp)
+            writer[0].write(sg.output)
+            sg.output = bytearray()
 
-    sg = SmileGenerator(shared_keys, shared_vals, bin_7bit)
     if header:
         sg.write_header()
+    with phase(stats, 'encode'):
+        _encode(py_obj, sg, _drain, max(block_size, compress_threshold if compress else 0),
+                check_circular, default, fragments)
+    if ender:
+        sg.write_end_marker()
+    if not writer and not (compress and len(sg.output) >= compress_threshold):
+        # Never reached the threshold: plain SMILE
+        with phase(stats, 'write'):
+            fp.write(bytes(sg.output))
+        return
+    _drain()
+    if compress:
+        with phase(stats, 'write'):
+            writer[0].close()
+
+
+def fingerprint(py_obj, algorithm='sha256', default=None, block_size=DEFAULT_COMPRESS_BLOCK_SIZE):
+    """
+    Hash of the canonical encoding of *py_obj*: equal documents have equal fingerprints
 
-    def _floatstr(f):
-        """
-        Convert a Python float into a JSON float string
+    The encoded document is fed to the hash every *block_size* bytes rather than built in
+    memory first.  The result is the digest of ``encode(py_obj, canonical=True)``.
 
-        :param float f: Floating point number
-        :returns: JSON String representation of the float
-        :rtype: str
-        """
-        _inf = float('inf')
-        if f != f:
-            text = 'NaN'
-        elif f == _inf:
-            text = 'Infinity'
-        elif f == -_inf:
-            text = '-Infinity'
-        else:
-            return repr(f)
-        return text
-
-    def _iterencode(obj):
-        if isinstance(obj, basestring):
-            sg.write_string(obj)
-        elif obj is None:
-            sg.write_null()
-        elif obj is True:
-            sg.write_true()
-        elif obj is False:
-            sg.write_false()
-        elif isinstance(obj, float):
-            sg.write_number(obj)
-        elif isinstance(obj, (int, long)):
-            sg.write_number(obj)
-        elif isinstance(obj, (list, tuple, set)):
-            sg.write_start_array()
-            for v in list(obj):
-                _iterencode(v)
-            sg.write_end_array()
-        elif isinstance(obj, dict):
+    :param py_obj: The object to be hashed
+    :param str algorithm: (optional - Default: ``sha256``) :mod:`hashlib` algorithm name
+    :param default: (optional) As for :func:`encode`
+    :param int block_size: (optional - Default: 64 KiB) Bytes buffered before each update
+    :returns: Hex digest
+    :rtype: str
+    """
+    import hashlib
+    digest = hashlib.new(algorithm)
+    sg = SmileGenerator(canonical=True)
+
+    def _drain():
+        digest.update(sg.output)
+        sg.output = bytearray()
+
+    sg.write_header()
+    _encode(py_obj, sg, _drain, block_size, default=default)
+    _drain()
+    return digest.hexdigest()
+
+
+_INF = float('inf')
+_NAN = float('nan')
+
+
+def _floatstr(f):
+    """
+    Convert a Python float into a JSON float string
+
+    :param float f: Floating point number
+    :returns: JSON String representation of the float
+    :rtype: str
+    """
+    if f != f:
+        return 'NaN'
+    elif f == _INF:
+        return 'Infinity'
+    elif f == -_INF:
+        return '-Infinity'
+    return repr(f)
+
+
+def _key_string(key):
+    """
+    Coerce a dict key to a field name the way :mod:`json` does
+
+    :param key: Key
+    :rtype: str
+    """
+    if isinstance(key, str):
+        return key
+    elif key is True:
+        return 'true'
+    elif key is False:
+        return 'false'
+    elif key is None:
+        return 'null'
+    elif isinstance(key, int):
+        return str(key)
+    elif isinstance(key, float):
+        return _floatstr(key)
+    raise TypeError('Key ' + repr(key) + ' is not a string')
+
+
+# Value kinds: index into the per-generator writer table
+_STRING = 0
+_NULL = 1
+_BOOL = 2
+_INTEGER = 3
+_FLOAT = 4
+_BINARY = 5
+_DECIMAL = 6
+_RAW = 7
+_UNKNOWN = 8
+# Containers (pushed on the traversal stack)
+_ARRAY = 9
+_OBJECT = 10
+_VALUE = 11
+
+_TYPE_KINDS = {
+    str: _STRING,
+    type(None): _NULL,
+    bool: _BOOL,
+    int: _INTEGER,
+    float: _FLOAT,
+    bytes: _BINARY,
+    bytearray: _BINARY,
+    memoryview: _BINARY,
+    RawSmile: _RAW,
+    list: _ARRAY,
+    tuple: _ARRAY,
+    set: _ARRAY,
+    frozenset: _ARRAY,
+    dict: _OBJECT,
+}
+"""Kind of every concrete type seen so far; filled in by :func:`_resolve_kind`"""
+
+
+def _is_decimal_type(tp):
+    """
+    :mod:`decimal` is not imported here: a program that has a ``Decimal`` to write has
+    already imported it, so a type can only be a ``Decimal`` once the module is loaded
+
+    :param type tp: Type
+    :rtype: bool
+    """
+    decimal = sys.modules.get('decimal')
+    return decimal is not None and issubclass(tp, decimal.Decimal)
+
+
+def _resolve_kind(tp):
+    """
+    Classify a type that is not in :data:`_TYPE_KINDS` yet (subclasses of the builtins,
+    types handled by a ``default`` hook) and cache the result
+
+    :param type tp: Concrete type
+    :rtype: int
+    """
+    if issubclass(tp, str):
+        kind = _STRING
+    elif issubclass(tp, float):
+        kind = _FLOAT
+    elif issubclass(tp, int):
+        kind = _INTEGER
+    elif issubclass(tp, RawSmile):
+        kind = _RAW
+    elif issubclass(tp, (bytes, bytearray)):
+        kind = _BINARY
+    elif _is_decimal_type(tp):
+        kind = _DECIMAL
+    elif issubclass(tp, (list, tuple, set, frozenset)):
+        kind = _ARRAY
+    elif issubclass(tp, dict):
+        kind = _OBJECT
+    else:
+        kind = _UNKNOWN
+    _TYPE_KINDS[tp] = kind
+    return kind
+
+
+def _encode(py_obj, sg, drain=None, drain_size=0, check_circular=True, default=None,
+            fragments=None):
+    """
+    Write *py_obj* with *sg*
+
+    The document is walked with an explicit stack of iterators rather than by recursion, so
+    nesting depth is only limited by memory.
+
+    ``bytes``, ``bytearray`` and ``memoryview`` values are written as binary; ``str`` is text.
+    :class:`~pysmile.fragment.RawSmile` values are copied into the output as they are.
+
+    :param py_obj: The object to be encoded
+    :param SmileGenerator sg: Generator
+    :param drain: (optional) Called whenever ``sg.output`` has grown to *drain_size* bytes
+    :param int drain_size: (optional) Output size that triggers *drain*
+    :param bool check_circular: (optional - Default: `True`) Raise :class:`ValueError` on
+                                containers that contain themselves instead of looping forever
+    :param default: (optional) ``default(obj)`` returns an encodable replacement for *obj*
+                    or raises :class:`TypeError`
+    :param pysmile.fragment.FragmentCache fragments: (optional) Arrays, objects and unknown
+                                                     values registered here are written from
+                                                     their cached encoding
+    """
+    canonical = sg.canonical
+    write_null = sg.write_null
+    write_field_name = sg.write_field_name
+    writers = (sg.write_string, lambda _: write_null(), sg.write_boolean, sg.write_number,
+               sg.write_float, sg.write_binary, sg.write_big_decimal, sg.write_raw)
+    kinds = _TYPE_KINDS
+    stats = sg.stats
+    if stats is not None:
+        write_field_name = _counted(sg, write_field_name, stats.record_key, sg.share_keys)
+        # Fragments are counted by write_raw, as a whole
+        writers = tuple(_counted(sg, write, stats.record_value, sg.share_values)
+                        for write in writers[:_RAW]) + writers[_RAW:]
+
+    markers = {} if check_circular else None
+    # Each frame: (iterator, kind, marker id)
+    stack = []
+
+    def _push(obj, kind):
+        marker = None
+        if markers is not None:
+            marker = id(obj)
+            if marker in markers:
+                raise ValueError('Circular reference detected')
+            markers[marker] = obj
+        if kind == _OBJECT:
             sg.write_start_object()
-            for key, val in obj.iteritems():
-                if key is True:
-                    key = 'true'
-                elif key is False:
-                    key = 'false'
-                elif key is None:
-                    key = 'null'
-                elif isinstance(key, (int, long)):
-                    key = str(key)
-                elif isinstance(key, float):
-                    key = _floatstr(key)
-                elif not isinstance(key, basestring):
-                    raise TypeError('Key ' + repr(key) + ' is not a string')
-                sg.write_field_name(key)
-                _iterencode(val)
-            sg.write_end_object()
+            if stats is not None:
+                stats.start_container()
+            items = obj.items()
+            if canonical:
+                items = _canonical_items(items)
+            stack.append((iter(items), kind, marker))
+        elif kind == _ARRAY:
+            sg.write_start_array()
+            if canonical and isinstance(obj, (set, frozenset)):
+                obj = sorted(obj, key=lambda value: encode(
+                    value, header=False, shared_keys=False, shared_vals=False,
+                    default=default, canonical=True))
+            it = iter(obj)
+            if stats is not None:
+                stats.start_container()
+            elif type(obj) in (list, tuple) and obj and type(obj[0]) is int:
+                # Leading run of plain ints in one batch
+                start = varint.write_ints(sg.output, obj)
+                if start:
+                    it = itertools.islice(obj, start, None)
+            stack.append((it, kind, marker))
         else:
-            _iterencode(obj)
-    _iterencode(py_obj)
-    if ender:
-        sg.write_end_marker()
-    return str(sg.output)
+            # Replacement for an unknown value; written without delimiters
+            if default is None:
+                raise TypeError(repr(obj) + ' is not SMILE serializable')
+            stack.append((iter((default(obj),)), kind, marker))
+
+    stack.append((iter((py_obj,)), _VALUE, None))
+    while stack:
+        it, kind, marker = stack[-1]
+        is_object = kind == _OBJECT
+        for value in it:
+            if is_object:
+                key, value = value
+                write_field_name(_key_string(key))
+            tp = type(value)
+            value_kind = kinds.get(tp)
+            if value_kind is None:
+                value_kind = _resolve_kind(tp)
+            if value_kind >= _UNKNOWN:
+                raw = fragments.get(value) if fragments is not None else None
+                if raw is None:
+                    _push(value, value_kind)
+                    break
+                value, value_kind = raw, _RAW
+            writers[value_kind](value)
+            if drain and len(sg.output) >= drain_size:
+                drain()
+        else:
+            stack.pop()
+            if is_object or kind == _ARRAY:
+                if is_object:
+                    sg.write_end_object()
+                else:
+                    sg.write_end_array()
+                if stats is not None:
+                    stats.end_container()
+            if marker is not None:
+                del markers[marker]
+            if drain and len(sg.output) >= drain_size:
+                drain()
+
 
+def _first(pair):
+    return pair[0]
+
+
+def _canonical_items(items):
+    """
+    :param items: Members of an object
+    :returns: Members with their keys coerced to field names, in order of field name
+    :rtype: list
+    :raises ValueError: If two keys coerce to the same field name (``1`` and ``'1'``): their
+                        order would depend on the order of the object
+    """
+    items = sorted(((_key_string(k), v) for k, v in items), key=_first)
+    for i in range(1, len(items)):
+        if items[i][0] == items[i - 1][0]:
+            raise ValueError('Keys coerce to the same field name: {!r}'.format(items[i][0]))
+    return items
+
+
+def _counted(sg, write, record, shared):
+    """
+    Wrap a writer of *sg* to report the token it writes
+
+    :param SmileGenerator sg: Generator
+    :param write: Writer that outputs exactly one token
+    :param record: :meth:`SmileStats.record_key` or :meth:`SmileStats.record_value`
+    :param bool shared: Back references are enabled for this kind of token
+    """
+    def counted(value):
+        start = len(sg.output)
+        write(value)
+        output = sg.output
+        record(output[start], len(output) - start, shared)
+    return counted
 
 if __name__ == '__main__':
-    a = ':)\n\x03\xfa\x80a@1\x80c\xf8\xc6\xf9\x80b\xc4\x80e(fL\x19\x04\x04\x80d\xc1\xfb'
+    a = b':)\n\x03\xfa\x80a@1\x80b\xc4\x80c\xf8\xc6\xf9\x80d\xc1\x80e)\x00@\x083\x19Lf3\x19M\xfb'
     b = encode({'a': '1', 'b': 2, 'c': [3], 'd': -1, 'e': 4.20})
     if a != b:
-        print repr(a)
-        print repr(b)
+        print(repr(a))
+        print(repr(b))
 
-    a = ':)\n\x03\xfa\x80a\xfa\x80b\xfa\x80c\xfa\x80d\xf8@e\xf9\xfb\xfb\xfb\xfb'
+    a = b':)\n\x03\xfa\x80a\xfa\x80b\xfa\x80c\xfa\x80d\xf8@e\xf9\xfb\xfb\xfb\xfb'
     b = encode({'a': {'b': {'c': {'d': ['e']}}}})
     if a != b:
-        print repr(a)
-        print repr(b)
+        print(repr(a))
+        print(repr(b))
@@ -0,0 +1,174 @@
+"""
+SMILE Fragments
+
+Values that are encoded once and spliced into any number of documents.
+
+A :class:`RawSmile` holds the encoding of a single value (no header) and is written into
+the output as-is wherever it appears in an encoded object::
+
+    descriptor = RawSmile.from_object(SERVICE_DESCRIPTOR)
+    pysmile.encode({'service': descriptor, 'result': result})
+
+A fragment can not contain back references: they would point into the tables of whatever
+document it ends up in.  Every string of a fragment is written in full instead, and since a
+decoder adds those strings to its back reference tables, the encoder adds them to its own
+as well (:attr:`RawSmile.key_strings`, :attr:`RawSmile.value_strings`) so that references
+later in the document stay valid.
+
+:class:`FragmentCache` keeps the fragments of registered objects, so that passing it as
+*fragments* to :func:`pysmile.encode` writes them without re-encoding::
+
+    cache = FragmentCache()
+    cache.register(SERVICE_DESCRIPTOR)
+    pysmile.encode({'service': SERVICE_DESCRIPTOR, 'result': result}, fragments=cache)
+"""
+from pysmile.constants import *
+from pysmile.decode import DecodeState, SmileHeader, _decode
+
+__author__ = 'Jonathan Hosmer'
+
+_FRAGMENT_HEADER = SmileHeader(0, raw_bin=True, shared_names=True, shared_values=True)
+
+
+class _Strings(list):
+    """Strings a fragment adds to a back reference table; references into it are refused"""
+
+    def __getitem__(self, ix):
+        raise IndexError(ix)
+
+
+class RawSmile(bytes):
+    """
+    SMILE encoding of a single value, without header, written into documents verbatim
+
+    The fragment is checked once, when it is created: it has to hold exactly one complete
+    value and no back references (:class:`pysmile.SMILEDecodeError` otherwise).
+    """
+
+    def __new__(cls, data):
+        """
+        :param bytes|bytearray|memoryview data: Encoded value
+        """
+        self = super(RawSmile, cls).__new__(cls, data)
+        keys, values = _Strings(), _Strings()
+        state = DecodeState(self, _FRAGMENT_HEADER, keys, values)
+        # Decode from the first byte even if it is a header: a whole document is not a value
+        state.index = 0
+        state.header = _FRAGMENT_HEADER
+        _decode(state, single=False)
+        if state.index != len(self):
+            raise state.error('Trailing data after fragment')
+
+        self.key_strings = tuple(keys)
+        """Field names a decoder adds to its shared key table, in order"""
+
+        self.value_strings = tuple(values)
+        """String values a decoder adds to its shared value table, in order"""
+
+        return self
+
+    @classmethod
+    def from_object(cls, py_obj, bin_7bit=True, float_mode=FLOAT_MODE_DOUBLE, canonical=False,
+                    default=None):
+        """
+        Encode *py_obj* as a fragment
+
+        :param py_obj: The object to be encoded
+        :param bool bin_7bit: (optional - Default: `True`) Encode raw data as 7-bit
+        :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) As for
+                               :func:`pysmile.encode`
+        :param bool canonical: (optional - Default: `False`) As for :func:`pysmile.encode`
+        :param default: (optional) As for :func:`pysmile.encode`
+        :rtype: RawSmile
+        """
+        from pysmile.encode import encode
+        return cls(encode(py_obj, header=False, shared_keys=False, shared_vals=False,
+                          bin_7bit=bin_7bit, float_mode=float_mode, canonical=canonical,
+                          default=default))
+
+    def __repr__(self):
+        return 'RawSmile({})'.format(super(RawSmile, self).__repr__())
+
+
+class FragmentCache(object):
+    """
+    Least-recently-used cache of the encodings of registered objects
+
+    Objects are registered by identity and must not change while they are registered
+    (:meth:`unregister` and register them again after a change).  Only the encodings are
+    evicted, never the registrations: an evicted object is encoded again the next time it
+    is written.
+    """
+
+    def __init__(self, maxsize=DEFAULT_FRAGMENT_CACHE_SIZE, float_mode=FLOAT_MODE_DOUBLE,
+                 canonical=False):
+        """
+        FragmentCache Initializer
+
+        :param int maxsize: (optional - Default: 128) Encodings kept
+        :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) Used to encode
+                               fragments (see :meth:`RawSmile.from_object`)
+        :param bool canonical: (optional - Default: `False`) Used to encode fragments
+        """
+        self.maxsize = int(maxsize)
+        self.float_mode = float_mode
+        self.canonical = canonical
+
+        self.registered = {}
+        """Registered objects by ``id``"""
+
+        # A plain dict (insertion ordered) rather than OrderedDict: collections costs more
+        # to import than most of the package
+        self.fragments = {}
+        """Encodings by ``id``, least recently used first"""
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.registered)
+
+    def __contains__(self, py_obj):
+        return id(py_obj) in self.registered
+
+    def register(self, py_obj):
+        """
+        :param py_obj: Object (array or object) to keep the encoding of
+        :returns: *py_obj*
+        """
+        self.registered[id(py_obj)] = py_obj
+        return py_obj
+
+    def unregister(self, py_obj):
+        """
+        :param py_obj: Registered object
+        """
+        self.registered.pop(id(py_obj), None)
+        self.fragments.pop(id(py_obj), None)
+
+    def clear(self):
+        """Forget every registration and encoding"""
+        self.registered.clear()
+        self.fragments.clear()
+
+    def get(self, py_obj):
+        """
+        :param py_obj: Object
+        :returns: Encoding of *py_obj*, or ``None`` if it is not registered
+        :rtype: RawSmile
+        """
+        key = id(py_obj)
+        if key not in self.registered:
+            return None
+        fragments = self.fragments
+        raw = fragments.get(key)
+        if raw is not None:
+            fragments[key] = fragments.pop(key)
+            self.hits += 1
+            return raw
+        self.misses += 1
+        raw = RawSmile.from_object(py_obj, float_mode=self.float_mode, canonical=self.canonical)
+        fragments[key] = raw
+        if len(fragments) > self.maxsize:
+            del fragments[next(iter(fragments))]
+        return raw
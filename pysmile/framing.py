@@ -0,0 +1,272 @@
+"""
+SMILE Framing
+
+Length-prefixed framing for sending SMILE documents over a stream transport (TCP, pipes).
+
+Every frame is a 4 byte, big-endian, unsigned payload length followed by the payload
+(usually one complete SMILE document)::
+
+    +----------------+---------------------------+
+    | length (>I)    | payload (length bytes)    |
+    +----------------+---------------------------+
+
+A reader never has to scan the payload for an end marker, and payloads may contain any
+byte values (including 0xFF and raw binary).
+"""
+import struct
+
+from pysmile.encode import encode
+from pysmile.decode import decode
+
+__author__ = 'Jonathan Hosmer'
+
+FRAME_HEADER = struct.Struct('>I')
+"""Frame header: payload length as 32-bit big-endian unsigned int"""
+
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024 * 1024
+"""Largest payload a reader accepts by default (64 MiB)"""
+
+DEFAULT_BATCH_SIZE = 64 * 1024
+"""Pending bytes that trigger an automatic flush of a :class:`FrameWriter`"""
+
+DEFAULT_RECV_SIZE = 64 * 1024
+"""Initial size of the :class:`FrameReader` receive buffer"""
+
+
+class SMILEFrameError(Exception):
+    pass
+
+
+def encode_frame(payload):
+    """
+    Frame a single payload
+
+    :param bytes payload: Payload (usually a SMILE document)
+    :returns: Length prefix followed by *payload*
+    :rtype: bytearray
+    """
+    frame = bytearray(FRAME_HEADER.pack(len(payload)))
+    frame.extend(payload)
+    return frame
+
+
+def decode_frame(data, offset=0, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """
+    Parse a single frame from *data*
+
+    :param bytes|bytearray|memoryview data: Buffer that holds (at least) one frame
+    :param int offset: (optional - Default: 0) Position of the frame header in *data*
+    :param int max_frame_size: (optional) Largest payload that is accepted
+    :returns: ``(payload, next_offset)`` or ``(None, offset)`` if *data* does not hold a
+              complete frame yet.  *payload* is a :class:`memoryview` into *data*.
+    :rtype: tuple
+    :raises SMILEFrameError: If the frame length exceeds *max_frame_size*
+    """
+    end = offset + FRAME_HEADER_SIZE
+    if len(data) < end:
+        return None, offset
+    length, = FRAME_HEADER.unpack_from(data, offset)
+    if length > max_frame_size:
+        raise SMILEFrameError(
+            'Frame of {} bytes at offset {} exceeds the limit of {} bytes'.format(
+                length, offset, max_frame_size))
+    if len(data) < end + length:
+        return None, offset
+    if not isinstance(data, memoryview):
+        data = memoryview(data)
+    return data[end:end + length], end + length
+
+
+class FrameWriter(object):
+    """
+    Batching frame writer.
+
+    Frames are accumulated in a single pending buffer and handed to the transport in one
+    ``sendall`` (or ``write``) call, so many small messages cost one syscall instead of two
+    per message (header + payload).  The buffer is flushed automatically once it grows past
+    *batch_size*; call :meth:`flush` to push out whatever is still pending.
+    """
+
+    def __init__(self, sink, batch_size=DEFAULT_BATCH_SIZE, **encode_kwargs):
+        """
+        FrameWriter Initializer
+
+        :param sink: Socket (anything with ``sendall``) or file-like object (``write``)
+        :param int batch_size: (optional - Default: 64 KiB) Pending bytes that trigger a flush
+        :param encode_kwargs: (optional) Keyword arguments passed to :func:`pysmile.encode`
+                              by :meth:`write_object`
+        """
+        self._send = getattr(sink, 'sendall', None) or sink.write
+        self.batch_size = int(batch_size)
+        self.encode_kwargs = encode_kwargs
+        self.pending = bytearray()
+        self.frames_written = 0
+        self.flush_count = 0
+
+    def write(self, payload):
+        """
+        Queue an already encoded payload
+
+        :param bytes payload: Payload (usually a SMILE document)
+        """
+        pending = self.pending
+        pending.extend(FRAME_HEADER.pack(len(payload)))
+        pending.extend(payload)
+        self.frames_written += 1
+        if len(pending) >= self.batch_size:
+            self.flush()
+
+    def write_object(self, obj):
+        """
+        SMILE encode *obj* and queue it as one frame
+
+        :param list|dict obj: Object to encode
+        """
+        self.write(encode(obj, **self.encode_kwargs))
+
+    def write_many(self, payloads):
+        """
+        Queue several already encoded payloads
+
+        :param payloads: Iterable of payloads
+        """
+        for payload in payloads:
+            self.write(payload)
+
+    def flush(self):
+        """Hand every pending frame to the transport in a single call"""
+        if self.pending:
+            self._send(self.pending)
+            self.flush_count += 1
+            self.pending = bytearray()
+
+    def close(self):
+        """Flush pending frames"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+
+class FrameReader(object):
+    """
+    Incremental frame parser over a single growable receive buffer.
+
+    Data is received straight into the buffer (``recv_into``) or appended with :meth:`feed`;
+    :meth:`frames` yields every complete payload as a :class:`memoryview` slice of that buffer,
+    so no per-frame copy is made.  A yielded view is only valid until the next call to
+    :meth:`feed`, :meth:`recv_from` or :meth:`frames` -- copy it (``bytes(view)``) or decode
+    it before then.
+    """
+
+    def __init__(self, max_frame_size=DEFAULT_MAX_FRAME_SIZE, recv_size=DEFAULT_RECV_SIZE):
+        """
+        FrameReader Initializer
+
+        :param int max_frame_size: (optional - Default: 64 MiB) Largest payload accepted
+        :param int recv_size: (optional - Default: 64 KiB) Initial receive buffer size
+        """
+        self.max_frame_size = int(max_frame_size)
+        self.buf = bytearray(max(int(recv_size), FRAME_HEADER_SIZE))
+        # buf[start:end] holds received bytes that have not been returned as frames yet
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _compact(self, need):
+        """
+        Make room for at least *need* more bytes at the end of the buffer
+
+        :param int need: Number of bytes
+        """
+        if len(self.buf) - self.end >= need:
+            return
+        pending = self.end - self.start
+        size = len(self.buf)
+        while size - pending < need:
+            size *= 2
+        # Always move into a fresh buffer: views handed out by frames() may still be alive,
+        # and a bytearray with exported views can not be resized or overwritten safely
+        buf = bytearray(size)
+        buf[:pending] = self.buf[self.start:self.end]
+        self.buf, self.start, self.end = buf, 0, pending
+
+    def feed(self, data):
+        """
+        Append received bytes
+
+        :param bytes data: Data
+        """
+        self._compact(len(data))
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def recv_from(self, sock, size=None):
+        """
+        Receive directly into the buffer (no intermediate string)
+
+        :param sock: Connected socket
+        :param int size: (optional) Maximum number of bytes to receive
+        :returns: Number of bytes received (0 on EOF)
+        :rtype: int
+        """
+        if size is None:
+            size = max(len(self.buf) // 2, DEFAULT_RECV_SIZE)
+        self._compact(size)
+        n = sock.recv_into(memoryview(self.buf)[self.end:self.end + size], size)
+        self.end += n
+        return n
+
+    def frames(self):
+        """
+        Yield every complete frame currently buffered
+
+        :returns: Generator of payload memoryviews
+        :raises SMILEFrameError: If a frame length exceeds *max_frame_size*
+        """
+        data, max_frame_size = memoryview(self.buf)[:self.end], self.max_frame_size
+        while True:
+            payload, nxt = decode_frame(data, self.start, max_frame_size)
+            if payload is None:
+                break
+            self.start = nxt
+            yield payload
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def objects(self, **decode_kwargs):
+        """
+        Decode every complete frame currently buffered
+
+        :param decode_kwargs: (optional) Keyword arguments passed to :func:`pysmile.decode`
+        :returns: Generator of decoded objects
+        """
+        for payload in self.frames():
+            yield decode(payload, **decode_kwargs)
+
+
+def iter_frames(sock, max_frame_size=DEFAULT_MAX_FRAME_SIZE, recv_size=DEFAULT_RECV_SIZE):
+    """
+    Read frames from *sock* until EOF
+
+    :param sock: Connected socket
+    :param int max_frame_size: (optional - Default: 64 MiB) Largest payload accepted
+    :param int recv_size: (optional - Default: 64 KiB) Initial receive buffer size
+    :returns: Generator of payloads (copied, so they stay valid)
+    :raises SMILEFrameError: If the stream ends in the middle of a frame
+    """
+    reader = FrameReader(max_frame_size, recv_size)
+    while reader.recv_from(sock):
+        for payload in reader.frames():
+            yield payload.tobytes()
+    if len(reader):
+        raise SMILEFrameError('Stream ended inside a frame ({} bytes left over)'.format(
+            len(reader)))
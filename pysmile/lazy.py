@@ -0,0 +1,377 @@
+"""
+SMILE Lazy Decoding
+
+``decode(data, lazy=True)`` returns read-only :class:`LazyObject` (``Mapping``) and
+:class:`LazyArray` (``Sequence``) proxies instead of ``dict`` and ``list``.  A proxy decodes
+its own members the first time it is accessed and keeps them; members that are containers
+are proxies again, so only the parts of a document that are looked at are built.
+
+A back reference can point to any string written earlier in the document, so the document is
+still scanned once, up front: the scan records where every container ends and collects the
+strings that enter the shared key and value tables, but skips over long strings, binary
+values and numbers that need no table bookkeeping without decoding them.  A proxy resumes
+decoding at its offset with the tables as they were at that point.
+
+Proxies refer to the input buffer, which must not be modified while they are in use.
+Errors in values that are never accessed may go unnoticed.
+"""
+from collections.abc import Mapping, Sequence
+
+from pysmile.constants import *
+from pysmile import util
+from pysmile.decode import DecodeState, SMILELimitError, _VALUE_DECODERS, _decode_tokens, \
+    _container_error, _elements_error
+
+__author__ = 'Jonathan Hosmer'
+
+
+class _Log(list):
+    """
+    Every string added to a back reference table over the whole document, in order
+
+    Indexing resolves a back reference against the table as it is after the last string:
+    the table starts over every *capacity* strings, like :class:`pysmile.decode._SharedStrings`.
+    """
+
+    def __init__(self, capacity, full):
+        """
+        :param int capacity: Strings after which the table starts over
+        :param int full: Strings the table may hold (``max_shared_strings``), up to *capacity*
+        """
+        super(_Log, self).__init__()
+        self.capacity = capacity
+        self.full = full
+
+    def __getitem__(self, ix):
+        return _resolve(self, len(self), ix)
+
+    def append(self, value):
+        # Below capacity the table never starts over, so it holds every string of the log
+        if self.full < self.capacity and len(self) >= self.full:
+            raise SMILELimitError('Back reference table over {} entries'.format(self.full),
+                                  'max_shared_strings')
+        super(_Log, self).append(value)
+
+
+class _LogView(object):
+    """A back reference table as it was after the first *count* strings of a :class:`_Log`"""
+
+    def __init__(self, log, count):
+        self.log = log
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, ix):
+        return _resolve(self.log, self.count, ix)
+
+    def append(self, value):
+        # Already in the log: the scan read this string before
+        self.count += 1
+
+
+def _resolve(log, count, ix):
+    """
+    :param _Log log: Strings
+    :param int count: Strings added so far
+    :param int ix: Back reference
+    :rtype: str
+    """
+    base = (count - 1) // log.capacity * log.capacity if count else 0
+    if not 0 <= ix < count - base:
+        raise IndexError(ix)
+    return list.__getitem__(log, base + ix)
+
+
+def _skip_long_text(state, byt):
+    end = state.s.find(BYTE_MARKER_END_OF_STRING, state.index,
+                       state.index + state.max_string_length + 1)
+    if end < 0:
+        # Raises the appropriate error
+        state.read_terminated_text()
+    state.index = end + 1
+
+
+def _skip_7bit(state, max_length, limit, token):
+    length = state.varint_decode()
+    if length > max_length:
+        raise state.limit_error('Value longer than {} bytes'.format(max_length), limit, token)
+    end = state.index + util.encoded_7bit_length(length)
+    if end > len(state.s):
+        raise state.error('Truncated binary value', state.index)
+    state.index = end
+
+
+def _skip_binary_7bit(state, byt):
+    _skip_7bit(state, state.max_binary_length, 'max_binary_length', state.index - 1)
+
+
+def _skip_big_integer(state, byt):
+    _skip_7bit(state, state.max_number_length, 'max_number_length', state.index - 1)
+
+
+def _skip_big_decimal(state, byt):
+    token = state.index - 1
+    state.varint_decode()
+    _skip_7bit(state, state.max_number_length, 'max_number_length', token)
+
+
+def _skip_binary_raw(state, byt):
+    token = state.index - 1
+    length = state.varint_decode()
+    if length > state.max_binary_length:
+        raise state.limit_error('Binary value longer than {} bytes'.format(
+            state.max_binary_length), 'max_binary_length', token)
+    if state.index + length > len(state.s):
+        raise state.error('Truncated binary value', state.index)
+    state.index += length
+
+
+def _skip_float(n):
+    def _skip(state, byt):
+        if state.index + n > len(state.s):
+            raise state.error('Truncated float', state.index - 1)
+        state.index += n
+    return _skip
+
+
+_SKIPPERS = list(_VALUE_DECODERS)
+"""Scalar value decoders of the scan: values that can not enter a table are skipped"""
+
+_SKIPPERS[TOKEN_MISC_LONG_TEXT_ASCII] = _skip_long_text
+_SKIPPERS[TOKEN_MISC_LONG_TEXT_UNICODE] = _skip_long_text
+_SKIPPERS[TOKEN_MISC_BINARY_7BIT] = _skip_binary_7bit
+_SKIPPERS[TOKEN_MISC_BINARY_RAW] = _skip_binary_raw
+_SKIPPERS[TOKEN_BYTE_BIG_INTEGER] = _skip_big_integer
+_SKIPPERS[TOKEN_BYTE_BIG_DECIMAL] = _skip_big_decimal
+_SKIPPERS[TOKEN_BYTE_FLOAT_32] = _skip_float(5)
+_SKIPPERS[TOKEN_BYTE_FLOAT_64] = _skip_float(10)
+
+
+class _Document(object):
+    """Input buffer, container index and string tables shared by the proxies of a document"""
+
+    def __init__(self, state):
+        """
+        Scan the document that *state* is positioned at
+
+        :param DecodeState state: Decoder state, positioned after the header
+        """
+        self.s = state.s
+        self.header = state.header
+        self.start = state.start
+        self.binary_view = state.binary_view
+        self.keys = _Log(MAX_SHARED_NAMES, state.shared_key_strings.full)
+        self.values = _Log(MAX_SHARED_STRING_VALUES, state.shared_value_strings.full)
+        state.shared_key_strings = self.keys
+        state.shared_value_strings = self.values
+
+        self.containers = {}
+        """``(end, strings in the key log, strings in the value log)`` by container offset"""
+
+        self.root = self._scan(state)
+
+    def _scan(self, state):
+        """
+        :param DecodeState state: Decoder state, positioned after the header
+        :returns: Offset of the root container, or the root value if it is a scalar
+        """
+        containers = self.containers
+        keys, values = self.keys, self.values
+        next_byte, read_key, skippers = state.next_byte, state.read_key, _SKIPPERS
+        max_depth, elements = state.max_depth, state.max_elements
+        # Open containers: (offset, enclosing container is an object)
+        stack = []
+        in_object = False
+        while True:
+            byt = next_byte()
+            if in_object:
+                if byt == TOKEN_LITERAL_END_OBJECT:
+                    start, in_object = stack.pop()
+                    containers[start] = (state.index, len(keys), len(values))
+                    if not stack:
+                        return start
+                    continue
+                read_key(byt)
+                byt = next_byte()
+            elif byt == TOKEN_LITERAL_END_ARRAY and stack:
+                start, in_object = stack.pop()
+                containers[start] = (state.index, len(keys), len(values))
+                if not stack:
+                    return start
+                continue
+            elements -= 1
+            if byt == TOKEN_LITERAL_START_ARRAY or byt == TOKEN_LITERAL_START_OBJECT:
+                if elements < 0 or len(stack) >= max_depth:
+                    raise _container_error(state, elements, len(stack))
+                stack.append((state.index - 1, in_object))
+                in_object = byt == TOKEN_LITERAL_START_OBJECT
+                continue
+            if elements < 0:
+                raise _elements_error(state)
+            if not stack:
+                # A scalar document
+                return _VALUE_DECODERS[byt](state, byt)
+            skippers[byt](state, byt)
+
+    def state(self, offset, key_count, value_count):
+        """
+        :param int offset: Where to start decoding
+        :param int key_count: Strings of the key log added before *offset*
+        :param int value_count: Strings of the value log added before *offset*
+        :returns: Decoder state at *offset* with the tables as they were there
+        :rtype: DecodeState
+        """
+        state = DecodeState(self.s, self.header, _LogView(self.keys, key_count),
+                            _LogView(self.values, value_count), self.binary_view)
+        state.start = self.start
+        state.index = offset
+        return state
+
+    def proxy(self, state, byt):
+        """
+        Proxy of the container whose token *byt* was just read by *state*; *state* is moved
+        past the container
+
+        :param DecodeState state: Decoder state
+        :param int byt: Container token
+        :rtype: LazyObject | LazyArray
+        """
+        offset = state.index - 1
+        keys, values = state.shared_key_strings, state.shared_value_strings
+        proxy = (LazyObject if byt == TOKEN_LITERAL_START_OBJECT else LazyArray)(
+            self, offset, keys.count, values.count)
+        state.index, keys.count, values.count = self.containers[offset]
+        return proxy
+
+
+class _LazyContainer(object):
+    __slots__ = ('_doc', '_offset', '_key_count', '_value_count', '_data')
+
+    def __init__(self, doc, offset, key_count, value_count):
+        self._doc = doc
+        self._offset = offset
+        self._key_count = key_count
+        self._value_count = value_count
+        self._data = None
+
+    def _state(self):
+        return self._doc.state(self._offset + 1, self._key_count, self._value_count)
+
+    def materialize(self):
+        """
+        Decode the whole container
+
+        :returns: ``dict`` or ``list``, without proxies
+        """
+        state = self._doc.state(self._offset, self._key_count, self._value_count)
+        return _decode_tokens(state, None, None, state.next_byte, state.read_key,
+                              _VALUE_DECODERS)
+
+
+class LazyObject(_LazyContainer, Mapping):
+    """Read-only ``Mapping`` over an object of an encoded document"""
+
+    __slots__ = ()
+
+    def _members(self):
+        data = self._data
+        if data is None:
+            doc = self._doc
+            state = self._state()
+            next_byte, read_key = state.next_byte, state.read_key
+            data = {}
+            while True:
+                byt = next_byte()
+                if byt == TOKEN_LITERAL_END_OBJECT:
+                    break
+                key = read_key(byt)
+                byt = next_byte()
+                if byt == TOKEN_LITERAL_START_ARRAY or byt == TOKEN_LITERAL_START_OBJECT:
+                    data[key] = doc.proxy(state, byt)
+                else:
+                    data[key] = _VALUE_DECODERS[byt](state, byt)
+            self._data = data
+        return data
+
+    def __getitem__(self, key):
+        return self._members()[key]
+
+    def __iter__(self):
+        return iter(self._members())
+
+    def __len__(self):
+        return len(self._members())
+
+    def __contains__(self, key):
+        return key in self._members()
+
+    def __repr__(self):
+        return 'LazyObject({!r})'.format(self._members())
+
+
+class LazyArray(_LazyContainer, Sequence):
+    """Read-only ``Sequence`` over an array of an encoded document"""
+
+    __slots__ = ()
+
+    def _members(self):
+        data = self._data
+        if data is None:
+            doc = self._doc
+            state = self._state()
+            next_byte = state.next_byte
+            data = []
+            while True:
+                byt = next_byte()
+                if byt == TOKEN_LITERAL_END_ARRAY:
+                    break
+                if byt == TOKEN_LITERAL_START_ARRAY or byt == TOKEN_LITERAL_START_OBJECT:
+                    data.append(doc.proxy(state, byt))
+                else:
+                    data.append(_VALUE_DECODERS[byt](state, byt))
+            self._data = data
+        return data
+
+    def __getitem__(self, ix):
+        return self._members()[ix]
+
+    def __iter__(self):
+        return iter(self._members())
+
+    def __len__(self):
+        return len(self._members())
+
+    def __eq__(self, other):
+        if isinstance(other, (list, LazyArray)):
+            return self._members() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'LazyArray({!r})'.format(self._members())
+
+
+def decode_lazy(state):
+    """
+    :param DecodeState state: Decoder state, positioned after the header
+    :returns: Proxy of the root container (or the root value if it is a scalar)
+    :rtype: LazyObject | LazyArray
+    """
+    try:
+        doc = _Document(state)
+    except SMILELimitError as e:
+        if e.offset is not None:
+            raise
+        # Raised by a back reference table, which does not know the offset
+        raise state.limit_error(str(e), e.limit)
+    byt = state.pull_byte()
+    if byt is not None and byt != BYTE_MARKER_END_OF_CONTENT:
+        raise state.error('Trailing data after document', state.index - 1)
+    if not doc.containers:
+        return doc.root
+    offset = doc.root
+    cls = LazyObject if doc.s[offset] == TOKEN_LITERAL_START_OBJECT else LazyArray
+    return cls(doc, offset, 0, 0)
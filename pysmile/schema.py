@@ -0,0 +1,584 @@
+"""
+SMILE Schemas
+
+Encoders specialized for records of a fixed shape.
+
+A schema maps field names to what their values may be::
+
+    EVENT = {
+        'id': int,
+        'name': str,
+        'score': (float, None),            # float or null
+        'tags': [str],                     # array of strings
+        'origin': {'host': str, 'port': int},
+        'extra': object,                   # anything pysmile.encode() accepts
+    }
+
+Value specs are ``str``, ``int``, ``float``, ``bool``, ``bytes`` and ``None``, a tuple of
+those, ``object``, ``[spec]`` for an array and a nested schema (or :class:`RecordEncoder`)
+for an object; a tuple may also pair an array or object spec with ``None``.
+
+:func:`compile_encoder` generates the Python source of a function that writes one record:
+fields are read and written in schema order without a loop, the field name tokens are byte
+strings prepared up front, and each value is checked against its spec only.  Fields of a
+record that are not in the schema are not written.  The output is the same as
+:func:`pysmile.encode` of a ``dict`` with the fields in schema order.
+
+Field names take the place of the shared key table lookups as well: once every name of the
+schema is in the generator's table (after the first record of a document) the back references
+for the current table contents are written from a cached tuple.  After a field whose value
+may add names (``object`` and nested objects), the rest of the record uses the cached tuple
+only if the field names are still where it says.
+
+In the other direction :class:`RecordDecoder` (``pysmile.decode(data, records=...)``) builds
+objects as ``namedtuple`` or ``__slots__`` instances rather than ``dict``, which takes a
+fraction of the memory per record.
+"""
+import operator
+
+from pysmile.constants import *
+from pysmile import util, varint
+from pysmile.encode import SmileGenerator, SMILEEncodeError, _encode
+
+__author__ = 'Jonathan Hosmer'
+
+_SCALARS = {
+    str: 'str',
+    int: 'int',
+    float: 'float',
+    bool: 'bool',
+    bytes: 'bytes',
+}
+"""Scalar spec types by name"""
+
+MAX_BUILDERS = 1024
+"""Key sequences a :class:`RecordDecoder` keeps the constructor (or the lack of one) of"""
+
+
+class SMILESchemaError(Exception):
+    pass
+
+
+def _normalize(spec):
+    """
+    :param spec: Value spec
+    :returns: ``('scalar', names, nullable)``, ``('array', element spec, nullable)``,
+              ``('record', RecordEncoder, nullable)`` or ``('any', None, True)``
+    :rtype: tuple
+    """
+    options = spec if isinstance(spec, tuple) else (spec,)
+    nullable = any(option is None or option is type(None) for option in options)
+    options = [option for option in options if option is not None and option is not type(None)]
+    if not options:
+        return 'scalar', (), True
+    scalar = [isinstance(option, type) and option in _SCALARS for option in options]
+    if any(scalar):
+        if not all(scalar):
+            raise SMILESchemaError('Can not mix {!r} in one spec'.format(spec))
+        return 'scalar', tuple(_SCALARS[option] for option in options), nullable
+    if len(options) > 1:
+        raise SMILESchemaError('Can not mix {!r} in one spec'.format(spec))
+    option = options[0]
+    if option is object:
+        return 'any', None, True
+    if isinstance(option, list) and len(option) == 1:
+        return 'array', _normalize(option[0]), nullable
+    if isinstance(option, RecordEncoder):
+        return 'record', option, nullable
+    if isinstance(option, dict):
+        return 'record', RecordEncoder(option), nullable
+    raise SMILESchemaError('Invalid spec {!r}'.format(spec))
+
+
+def _key_literal(name):
+    """
+    :param str name: Field name
+    :returns: Token of *name* written in full
+    :rtype: bytes
+    """
+    sg = SmileGenerator(shared_keys=False)
+    sg.write_field_name(name)
+    return bytes(sg.output)
+
+
+def _key_reference(ix):
+    """
+    :param int ix: Shared key table index
+    :returns: Back reference token
+    :rtype: bytes
+    """
+    if ix < 64:
+        return bytes((TOKEN_PREFIX_KEY_SHARED_SHORT + ix,))
+    return bytes((TOKEN_PREFIX_KEY_SHARED_LONG + (ix >> 8), ix & 0xFF))
+
+
+def _key_references(fields, indexes):
+    """
+    :param tuple fields: Field names
+    :param tuple indexes: Shared key table index of every non-empty field name
+    :returns: Token of every field name
+    :rtype: tuple
+    """
+    indexes = iter(indexes)
+    return tuple(_key_reference(next(indexes)) if field else bytes((TOKEN_KEY_EMPTY_STRING,))
+                 for field in fields)
+
+
+def _adds_names(spec):
+    """
+    :param tuple spec: Normalized spec
+    :returns: Whether writing a value of *spec* may add names to the shared key table
+    :rtype: bool
+    """
+    kind, arg, _ = spec
+    if kind == 'array':
+        return _adds_names(arg)
+    return kind == 'any' or kind == 'record'
+
+
+def _same_references(getter, table, refs):
+    """
+    :param getter: Shared key table indexes of the field names of a schema
+    :param dict table: Shared key table
+    :param tuple refs: Indexes the field names had
+    :returns: Whether the field names still have the indexes *refs*
+    :rtype: bool
+    """
+    try:
+        return getter(table) == refs
+    except KeyError:
+        return False
+
+
+def _write_other(sg, value, spec, field):
+    """
+    Slow path for a value whose type is not one the generated code checks for exactly
+    (subclasses, ``None``, other types)
+
+    :param SmileGenerator sg: Generator
+    :param value: Value
+    :param tuple spec: Normalized spec
+    :param str field: Field name, for errors
+    """
+    kind, arg, nullable = spec
+    if kind == 'any':
+        return _encode(value, sg)
+    if value is None and nullable:
+        return sg.write_null()
+    if kind == 'scalar':
+        for name in arg:
+            if isinstance(value, _TYPES[name]):
+                return _encode(value, sg)
+    elif kind == 'array' and isinstance(value, (list, tuple)):
+        # Elements are checked against the element spec, as on the fast path
+        sg.write_start_array()
+        for item in value:
+            _write_other(sg, item, arg, field)
+        return sg.write_end_array()
+    elif kind == 'record' and isinstance(value, dict):
+        return arg.write(sg, value)
+    raise SMILEEncodeError('Field {!r}: {} is not {}'.format(
+        field, type(value).__name__, _describe(spec)))
+
+
+_TYPES = dict((name, tp) for tp, name in _SCALARS.items())
+
+
+def _describe(spec):
+    kind, arg, nullable = spec
+    if kind == 'scalar':
+        names = list(arg)
+    elif kind == 'array':
+        names = ['array']
+    else:
+        names = ['object']
+    if nullable:
+        names.append('None')
+    return ' or '.join(names)
+
+
+class _Source(object):
+    """Generated source and the names it refers to"""
+
+    def __init__(self):
+        self.lines = []
+        self.names = {}
+
+    def add(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def constant(self, value, prefix='c'):
+        name = '{}{}'.format(prefix, len(self.names))
+        self.names[name] = value
+        return name
+
+
+def _emit_value(src, indent, var, spec, field, depth=0):
+    """
+    Source that writes the value in variable *var*
+
+    :param _Source src: Source
+    :param int indent: Indentation level
+    :param str var: Variable holding the value
+    :param tuple spec: Normalized spec
+    :param str field: Field name, for errors
+    :param int depth: Array nesting, for loop variable names
+    """
+    kind, arg, nullable = spec
+    if kind == 'any':
+        src.add(indent, '_encode({}, sg)'.format(var))
+        return
+    other = '_write_other(sg, {}, {}, {!r})'.format(var, src.constant(spec, 'spec'), field)
+    if kind == 'record':
+        src.add(indent, 'if type({}) is dict:'.format(var))
+        src.add(indent + 1, '{}(sg, {})'.format(src.constant(arg.write, 'record'), var))
+    elif kind == 'array':
+        item = 'x{}'.format(depth)
+        src.add(indent, 'if type({0}) is list or type({0}) is tuple:'.format(var))
+        src.add(indent + 1, 'out.append({})'.format(TOKEN_LITERAL_START_ARRAY))
+        src.add(indent + 1, 'for {} in {}:'.format(item, var))
+        _emit_value(src, indent + 2, item, arg, field, depth + 1)
+        src.add(indent + 1, 'out.append({})'.format(TOKEN_LITERAL_END_ARRAY))
+    else:
+        first = True
+        for name in arg:
+            src.add(indent, '{} type({}) is {}:'.format('if' if first else 'elif', var, name))
+            first = False
+            if name == 'str':
+                src.add(indent + 1, 'write_string({})'.format(var))
+            elif name == 'int':
+                src.add(indent + 1, 'if {} <= {} <= {}:'.format(MIN_LONG, var, MAX_LONG))
+                src.add(indent + 2, 'write_int(out, {})'.format(var))
+                src.add(indent + 1, 'else:')
+                src.add(indent + 2, 'write_number({})'.format(var))
+            elif name == 'float':
+                src.add(indent + 1, 'if double:')
+                src.add(indent + 2, 'out.append({})'.format(TOKEN_BYTE_FLOAT_64))
+                src.add(indent + 2, 'out += float64_to_7bit({})'.format(var))
+                src.add(indent + 1, 'else:')
+                src.add(indent + 2, 'write_float({})'.format(var))
+            elif name == 'bool':
+                src.add(indent + 1, 'out.append({} if {} else {})'.format(
+                    TOKEN_LITERAL_TRUE, var, TOKEN_LITERAL_FALSE))
+            elif name == 'bytes':
+                src.add(indent + 1, 'write_binary({})'.format(var))
+        if first:
+            # Nothing but null
+            src.add(indent, 'if {} is None:'.format(var))
+            src.add(indent + 1, 'out.append({})'.format(TOKEN_LITERAL_NULL))
+    src.add(indent, 'else:')
+    src.add(indent + 1, other)
+
+
+class RecordEncoder(object):
+    """Encoder of records of one schema, see :func:`compile_encoder`"""
+
+    def __init__(self, schema, name='record'):
+        """
+        RecordEncoder Initializer
+
+        :param dict|list schema: Spec by field name (a ``dict`` or ``(name, spec)`` pairs)
+        :param str name: (optional - Default: ``record``) Name of the generated function
+        """
+        fields = list(schema.items() if isinstance(schema, dict) else schema)
+        for field, _ in fields:
+            if not isinstance(field, str):
+                raise SMILESchemaError('Field name {!r} is not a string'.format(field))
+        if len(set(field for field, _ in fields)) != len(fields):
+            raise SMILESchemaError('Duplicate field names')
+        if not name.isidentifier():
+            raise SMILESchemaError('Invalid function name {!r}'.format(name))
+        self.fields = tuple(field for field, _ in fields)
+        self.specs = tuple(_normalize(spec) for _, spec in fields)
+        self.name = name
+        self.source, namespace = self._generate()
+        exec(compile(self.source, '<pysmile schema {}>'.format(name), 'exec'), namespace)
+        self.write = namespace[name]
+        """``write(sg, record)``: write *record* (a ``dict``) with a :class:`SmileGenerator`"""
+
+    def _generate(self):
+        """
+        :returns: Source of the record writer and its global namespace
+        :rtype: tuple
+        """
+        src = _Source()
+        shared = [field for field in self.fields if field]
+        literals = src.constant(tuple(_key_literal(field) for field in self.fields), 'literals')
+        if len(shared) == 1:
+            getter = src.constant(lambda table, _key=shared[0]: (table[_key],), 'getter')
+        elif shared:
+            getter = src.constant(operator.itemgetter(*shared), 'getter')
+        else:
+            getter = None
+        # Table indexes of the field names last seen, and their back references
+        cache = src.constant([None, None], 'cache')
+
+        src.add(0, 'def {}(sg, rec):'.format(self.name))
+        src.add(1, 'out = sg.output')
+        src.add(1, 'write_string = sg.write_string')
+        src.add(1, 'write_number = sg.write_number')
+        src.add(1, 'write_float = sg.write_float')
+        # Floats are written inline unless the generator has a say in how (32-bit, NaN)
+        src.add(1, 'double = sg.float_mode == {!r} and not sg.canonical'.format(
+            FLOAT_MODE_DOUBLE))
+        src.add(1, 'write_binary = sg.write_binary')
+        src.add(1, 'out.append({})'.format(TOKEN_LITERAL_START_OBJECT))
+        src.add(1, 'keys = refs = None')
+        src.add(1, 'if not sg.share_keys:')
+        src.add(2, 'keys = {}'.format(literals))
+        if getter:
+            # Plain generators only: session tables have to see every lookup
+            src.add(1, 'elif type(sg.shared_keys) is dict:')
+            src.add(2, 'try:')
+            src.add(3, 'refs = {}(sg.shared_keys)'.format(getter))
+            src.add(2, 'except KeyError:')
+            src.add(3, 'pass')
+            src.add(2, 'else:')
+            src.add(3, 'if refs != {}[0]:'.format(cache))
+            src.add(4, '{}[:] = refs, _key_references({!r}, refs)'.format(cache, self.fields))
+            src.add(3, 'keys = {}[1]'.format(cache))
+        else:
+            src.add(1, 'else:')
+            src.add(2, 'keys = {}'.format(literals))
+        src.add(1, 'if keys is None:')
+        src.add(2, 'write_field_name = sg.write_field_name')
+        for field, spec in zip(self.fields, self.specs):
+            src.add(2, 'write_field_name({!r})'.format(field))
+            src.add(2, 'v = rec[{!r}]'.format(field))
+            _emit_value(src, 2, 'v', spec, field)
+        src.add(1, 'else:')
+        # Whether a field before this one may have changed the shared key table
+        changed = False
+        for i, (field, spec) in enumerate(zip(self.fields, self.specs)):
+            if changed:
+                src.add(2, 'if keys is None:')
+                src.add(3, 'write_field_name({!r})'.format(field))
+                src.add(2, 'else:')
+                src.add(3, 'out += keys[{}]'.format(i))
+            else:
+                src.add(2, 'out += keys[{}]'.format(i))
+            src.add(2, 'v = rec[{!r}]'.format(field))
+            _emit_value(src, 2, 'v', spec, field)
+            if getter and _adds_names(spec) and i + 1 < len(self.fields):
+                # The value may have added names, and made the table start over: the rest
+                # of the record is written with the cached references only if the field
+                # names still have them
+                src.add(2, 'if refs is not None and not _same_references({}, sg.shared_keys, '
+                           'refs):'.format(getter))
+                src.add(3, 'keys = refs = None')
+                src.add(3, 'write_field_name = sg.write_field_name')
+                changed = True
+        if not self.fields:
+            src.add(2, 'pass')
+        src.add(1, 'out.append({})'.format(TOKEN_LITERAL_END_OBJECT))
+
+        namespace = dict(src.names, _encode=_encode, _write_other=_write_other,
+                         _key_references=_key_references, _same_references=_same_references,
+                         write_int=varint.write_int, float64_to_7bit=util.float64_to_7bit)
+        return '\n'.join(src.lines) + '\n', namespace
+
+    def encode(self, record, header=True, ender=False, shared_keys=True, shared_vals=True,
+               bin_7bit=True, float_mode=FLOAT_MODE_DOUBLE):
+        """
+        SMILE Encode one record as a document
+
+        :param dict record: Record
+        :param bool header: (optional - Default: `True`)
+        :param bool ender: (optional - Default: `False`)
+        :param bool shared_keys: (optional - Default: `True`) Shared Key String References
+        :param bool shared_vals: (optional - Default: `True`) Shared Value String References
+        :param bool bin_7bit: (optional - Default: `True`) Encode raw data as 7-bit
+        :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) As for
+                               :func:`pysmile.encode`
+        :returns: SMILE encoded data
+        :rtype: bytes
+        """
+        sg = SmileGenerator(shared_keys, shared_vals, bin_7bit, float_mode)
+        if header:
+            sg.write_header()
+        self.write(sg, record)
+        if ender:
+            sg.write_end_marker()
+        return bytes(sg.output)
+
+
+def compile_encoder(schema, name='record'):
+    """
+    Generate an encoder for records of *schema* (see the module documentation)
+
+    :param dict|list schema: Spec by field name (a ``dict`` or ``(name, spec)`` pairs)
+    :param str name: (optional - Default: ``record``) Name of the generated function
+    :rtype: RecordEncoder
+    """
+    return RecordEncoder(schema, name)
+
+
+def _record_fields(tp):
+    """
+    :param type tp: Record class
+    :returns: Field names of *tp* (``namedtuple`` fields or ``__slots__``), and whether it is
+              a ``namedtuple``
+    :rtype: tuple
+    """
+    if issubclass(tp, tuple) and hasattr(tp, '_fields'):
+        return tuple(tp._fields), True
+    fields = []
+    for klass in reversed(tp.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        for slot in ((slots,) if isinstance(slots, str) else slots):
+            if slot not in ('__dict__', '__weakref__') and slot not in fields:
+                fields.append(slot)
+    if not fields:
+        raise SMILESchemaError('{} is neither a namedtuple nor a class with __slots__'.format(
+            tp.__name__))
+    return tuple(fields), False
+
+
+def _schema_types(schema, name):
+    """
+    ``namedtuple`` types for a schema and the object specs nested in it
+
+    :param dict|list|RecordEncoder schema: Schema
+    :param str name: Type name
+    :returns: ``(namedtuple class, field names)`` pairs; attributes of field names that are
+              not identifiers are renamed (``_0``, ``_1``, ...), the field names are not
+    :rtype: list
+    """
+    import collections
+    encoder = schema if isinstance(schema, RecordEncoder) else RecordEncoder(schema)
+    tp = collections.namedtuple(name.title().replace('_', ''), encoder.fields, rename=True)
+    types = [(tp, encoder.fields)]
+    for field, spec in zip(encoder.fields, encoder.specs):
+        kind, arg, _ = spec
+        while kind == 'array':
+            kind, arg, _ = arg
+        if kind == 'record':
+            types.extend(_schema_types(arg, field if field.isidentifier() else 'record'))
+    return types
+
+
+class RecordDecoder(object):
+    """
+    ``object_pairs_hook`` that decodes objects into record types instead of ``dict``
+
+    An object becomes an instance of the first record type whose fields are exactly the
+    object's keys (in any order; missing ``namedtuple`` fields with defaults are allowed).
+    Other objects are passed to *fallback*.
+
+    The key-to-field mapping is resolved once per distinct key sequence: after the first
+    record of a document its keys are back references, i.e. the very same string objects,
+    so later records find their (generated) constructor with a single lookup of the key tuple.
+    """
+
+    def __init__(self, *types, **kwargs):
+        """
+        RecordDecoder Initializer
+
+        :param types: ``namedtuple`` classes, classes with ``__slots__`` (built without calling
+                      ``__init__``), and schemas (see :func:`compile_encoder`), for which
+                      ``namedtuple`` classes are made
+        :param fallback: (optional - Default: ``dict``) Called with the ``(key, value)``
+                         pairs of objects that do not match a record type
+        """
+        fallback = kwargs.pop('fallback', dict)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: {}'.format(', '.join(kwargs)))
+        self.fallback = fallback
+        keyed = []
+        for tp in types:
+            if isinstance(tp, (dict, list, RecordEncoder)):
+                keyed.extend(_schema_types(tp, getattr(tp, 'name', 'record')))
+            else:
+                keyed.append((tp, _record_fields(tp)[0]))
+
+        self.types = [tp for tp, _ in keyed]
+        """Record types, including the ``namedtuple`` classes made for schemas"""
+
+        self.fields = {}
+        """``(type, field names, is namedtuple)`` by field name set"""
+
+        for tp, keys in keyed:
+            self.fields.setdefault(frozenset(keys), (tp, keys, _record_fields(tp)[1]))
+
+        self.sizes = set()
+        """Numbers of keys an object can have to match a record type"""
+
+        for tp, keys, named in self.fields.values():
+            defaults = len(getattr(tp, '_field_defaults', ())) if named else 0
+            self.sizes.update(range(len(keys) - defaults, len(keys) + 1))
+
+        self.builders = {}
+        """Constructor (or ``None`` for no match) by key tuple, up to :data:`MAX_BUILDERS`"""
+
+    def __call__(self, pairs):
+        if len(pairs) not in self.sizes:
+            return self.fallback(pairs)
+        keys = tuple([pair[0] for pair in pairs])
+        try:
+            builder = self.builders[keys]
+        except KeyError:
+            builder = self._builder(keys)
+            if len(self.builders) >= MAX_BUILDERS:
+                # Free-form objects with as many keys as a record: start over rather than
+                # grow for as long as the decoder lives
+                self.builders.clear()
+            self.builders[keys] = builder
+        if builder is None:
+            return self.fallback(pairs)
+        return builder(pairs)
+
+    def _builder(self, keys):
+        """
+        :param tuple keys: Keys of an object, in document order
+        :returns: Function that builds the record from the object's pairs, or ``None``
+        """
+        if len(set(keys)) != len(keys):
+            return None
+        match = self.fields.get(frozenset(keys))
+        if match is None:
+            match = self._partial_match(keys)
+            if match is None:
+                return None
+        tp, fields, named = match
+        position = dict((key, i) for i, key in enumerate(keys))
+        defaults = getattr(tp, '_field_defaults', {})
+        attrs, _ = _record_fields(tp)
+        args = []
+        for field, attr in zip(fields, attrs):
+            if field in position:
+                args.append('pairs[{}][1]'.format(position[field]))
+            else:
+                args.append('defaults[{!r}]'.format(attr))
+        if named:
+            source = 'def build(pairs):\n    return new(tp, ({},))\n'.format(', '.join(args))
+            namespace = {'new': tuple.__new__, 'tp': tp, 'defaults': defaults}
+        else:
+            lines = ['def build(pairs):', '    record = new(tp)']
+            lines.extend('    set_{}(record, {})'.format(i, arg) for i, arg in enumerate(args))
+            lines.append('    return record')
+            source = '\n'.join(lines) + '\n'
+            namespace = {'new': object.__new__, 'tp': tp}
+            for i, attr in enumerate(attrs):
+                namespace['set_{}'.format(i)] = _slot(tp, attr).__set__
+        exec(compile(source, '<pysmile record {}>'.format(tp.__name__), 'exec'), namespace)
+        return namespace['build']
+
+    def _partial_match(self, keys):
+        """A ``namedtuple`` type whose missing fields all have defaults"""
+        keys = set(keys)
+        for fields, match in self.fields.items():
+            tp, names, named = match
+            if named and keys < fields:
+                attrs, _ = _record_fields(tp)
+                missing = [attr for name, attr in zip(names, attrs) if name not in keys]
+                if all(attr in tp._field_defaults for attr in missing):
+                    return match
+        return None
+
+
+def _slot(tp, name):
+    """Member descriptor of slot *name* of *tp*"""
+    for klass in tp.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    raise SMILESchemaError('{} has no slot {!r}'.format(tp.__name__, name))
@@ -0,0 +1,300 @@
+"""
+SMILE Sessions
+
+Encoder/decoder pair for a long-lived stream of documents (one connection, one log file) that
+keeps the shared key and shared value back reference tables alive between documents.
+
+A plain document starts with empty tables, so every small message repeats its keys and
+enum-like values (``"OK"``, ``"us-east-1"``) in full.  Within a session a string that was sent
+once is referenced with one or two bytes in every later document.
+
+Both tables use least-recently-used eviction instead of the all-or-nothing reset of a single
+document: when a table is full the slot of the string that was written (or referenced) least
+recently is reused for the new string.  The encoder and decoder apply exactly the same
+operations in exactly the same order -- add on a literal, touch on a back reference -- so both
+sides always agree on every slot.  A document that fails to encode leaves the encoder's
+tables as they were before it.
+
+Documents after the first are written without the 4 byte header unless *repeat_header* is
+set.  Session documents are only decodable, in order, by a :class:`SessionDecoder`.
+"""
+import collections
+
+from pysmile.constants import *
+from pysmile.encode import SmileGenerator, _encode, _is_valid_back_ref
+from pysmile.decode import DecodeState, _decode
+from pysmile.stats import phase
+
+__author__ = 'Jonathan Hosmer'
+
+
+class SharedStringTable(object):
+    """
+    Fixed-capacity back reference table with deterministic LRU eviction.
+
+    Slots are handed out in increasing order, skipping indexes that would produce the
+    illegal bytes 0xFE/0xFF in a 2 byte reference.  Once *capacity* slots are in use the
+    least recently used one is recycled.
+    """
+
+    def __init__(self, capacity=MAX_SHARED_NAMES):
+        """
+        SharedStringTable Initializer
+
+        :param int capacity: (optional - Default: 1024) Highest slot index + 1
+        """
+        self.capacity = int(capacity)
+        self.slots = []
+        """Strings by slot (``None`` for slots that are never used)"""
+
+        self.lookup = {}
+        """Slot by string (encoder side)"""
+
+        self.lru = collections.OrderedDict()
+        """Used slots, least recently used first"""
+
+        self.used = {}
+        """When each used slot was last used (the LRU order, for :meth:`rollback`)"""
+
+        self.clock = 0
+
+        self.journal = None
+        """Changes since :meth:`begin`: ``(slot, last use)`` for a touch, ``(slot, last use,
+        previous string, previous slot count)`` for an append"""
+
+        self.hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, ix):
+        """
+        String in slot *ix*; marks the slot as most recently used
+
+        :param int ix: Slot
+        :rtype: str
+        """
+        value = self.slots[ix]
+        if value is None:
+            raise IndexError('Shared string slot {} is empty'.format(ix))
+        self.touch(ix)
+        return value
+
+    def touch(self, ix):
+        """
+        Mark slot *ix* as most recently used
+
+        :param int ix: Slot
+        """
+        self.lru.move_to_end(ix)
+        self.hits += 1
+        if self.journal is not None:
+            self.journal.append((ix, self.used[ix]))
+        self.clock += 1
+        self.used[ix] = self.clock
+
+    def find(self, value):
+        """
+        Slot holding *value*; marks it as most recently used
+
+        :param str value: String
+        :returns: Slot or -1
+        :rtype: int
+        """
+        ix = self.lookup.get(value, -1)
+        if ix >= 0:
+            self.touch(ix)
+        return ix
+
+    def append(self, value):
+        """
+        Store *value* in the next free slot, or in the least recently used one if full
+
+        :param str value: String
+        :returns: Slot
+        :rtype: int
+        """
+        slots = self.slots
+        count = len(slots)
+        while len(slots) < self.capacity and not _is_valid_back_ref(len(slots)):
+            slots.append(None)
+        if len(slots) < self.capacity:
+            ix = len(slots)
+            slots.append(value)
+            previous = None
+        else:
+            ix, _ = self.lru.popitem(last=False)
+            previous = slots[ix]
+            self.lookup.pop(previous, None)
+            slots[ix] = value
+            self.evictions += 1
+        if self.journal is not None:
+            self.journal.append((ix, self.used.get(ix), previous, count))
+        self.lookup[value] = ix
+        self.lru[ix] = None
+        self.clock += 1
+        self.used[ix] = self.clock
+        return ix
+
+    def begin(self):
+        """Start recording changes, to be undone by :meth:`rollback`"""
+        self.journal = [(self.hits, self.evictions)]
+
+    def commit(self):
+        """Keep the changes since :meth:`begin`"""
+        self.journal = None
+
+    def rollback(self):
+        """Undo the changes since :meth:`begin` (encoder side: :meth:`append` of strings
+        that were not in the table, and :meth:`find`)"""
+        journal, self.journal = self.journal, None
+        slots, lookup, used = self.slots, self.lookup, self.used
+        for change in reversed(journal[1:]):
+            ix = change[0]
+            if len(change) == 2:
+                used[ix] = change[1]
+                continue
+            _, last_use, previous, count = change
+            lookup.pop(slots[ix], None)
+            if last_use is None:
+                del slots[count:]
+                del used[ix]
+            else:
+                slots[ix] = previous
+                lookup[previous] = ix
+                used[ix] = last_use
+        self.hits, self.evictions = journal[0]
+        self.lru = collections.OrderedDict((ix, None) for ix in sorted(used, key=used.get))
+
+
+class SessionGenerator(SmileGenerator):
+    """:class:`SmileGenerator` that writes back references into session-wide LRU tables"""
+
+    def __init__(self, shared_keys=True, shared_values=True, encode_as_7bit=True,
+                 float_mode=FLOAT_MODE_DOUBLE, stats=None):
+        super(SessionGenerator, self).__init__(shared_keys, shared_values, encode_as_7bit,
+                                               float_mode, stats)
+        self.shared_keys = SharedStringTable(MAX_SHARED_NAMES)
+        self.shared_values = SharedStringTable(MAX_SHARED_STRING_VALUES)
+
+    def _find_seen_name(self, name):
+        return self.shared_keys.find(name)
+
+    def _add_seen_name(self, name):
+        self.shared_keys.append(name)
+
+    def _find_seen_string_value(self, text):
+        return self.shared_values.find(text)
+
+    def _add_seen_string_value(self, text):
+        self.shared_values.append(text)
+
+
+class SessionEncoder(object):
+    """
+    Encode a sequence of documents that share back reference tables.
+
+    Every document must reach the peer's :class:`SessionDecoder` in the order it was encoded.
+    """
+
+    def __init__(self, shared_keys=True, shared_vals=True, bin_7bit=True, repeat_header=False,
+                 float_mode=FLOAT_MODE_DOUBLE, check_circular=True, default=None, stats=None):
+        """
+        SessionEncoder Initializer
+
+        :param bool shared_keys: (optional - Default: `True`) Shared Key String References
+        :param bool shared_vals: (optional - Default: `True`) Shared Value String References
+        :param bool bin_7bit: (optional - Default: `True`) Encode raw data as 7-bit
+        :param bool repeat_header: (optional - Default: `False`) Write the header on every
+                                   document instead of only the first
+        :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) 64-bit floats, or
+                               `FLOAT_MODE_LOSSLESS` for 32-bit floats wherever that is exact
+        :param bool check_circular: (optional - Default: `True`) Detect self-containing
+                                    containers (:class:`ValueError`)
+        :param default: (optional) ``default(obj)`` returns an encodable replacement for
+                        objects that cannot otherwise be encoded
+        :param pysmile.stats.SmileStats stats: (optional) Collect statistics over all
+                                               documents of the session
+        """
+        self.generator = SessionGenerator(shared_keys, shared_vals, bin_7bit, float_mode,
+                                          stats)
+        self.repeat_header = bool(repeat_header)
+        self.check_circular = check_circular
+        self.default = default
+        self.documents = 0
+
+    def encode(self, py_obj, ender=False):
+        """
+        SMILE Encode the next document of the session
+
+        :param list|dict py_obj: The object to be encoded
+        :param bool ender: (optional - Default: `False`) Write the end marker
+        :returns: SMILE encoded data
+        :rtype: bytes
+        """
+        sg = self.generator
+        sg.output = bytearray()
+        if self.repeat_header or not self.documents:
+            sg.write_header()
+        # A document that fails to encode is never sent: the tables must stay as the
+        # decoder has them
+        tables = (sg.shared_keys, sg.shared_values)
+        for table in tables:
+            table.begin()
+        try:
+            with phase(sg.stats, 'encode'):
+                _encode(py_obj, sg, check_circular=self.check_circular, default=self.default)
+        except BaseException:
+            for table in tables:
+                table.rollback()
+            raise
+        for table in tables:
+            table.commit()
+        if ender:
+            sg.write_end_marker()
+        self.documents += 1
+        return bytes(sg.output)
+
+
+class SessionDecoder(object):
+    """Decode documents produced by a :class:`SessionEncoder`, in order"""
+
+    def __init__(self, object_hook=None, object_pairs_hook=None, stats=None, limits=None):
+        """
+        SessionDecoder Initializer
+
+        :param object_hook: (optional) Same as :func:`pysmile.decode`
+        :param object_pairs_hook: (optional) Same as :func:`pysmile.decode`
+        :param pysmile.stats.SmileStats stats: (optional) Collect statistics over all
+                                               documents of the session
+        :param pysmile.decode.DecodeLimits limits: (optional) Limits applied to every
+                                                   document; the back reference tables are
+                                                   bounded by their capacity instead of
+                                                   ``max_shared_strings``
+        """
+        self.object_hook = object_hook
+        self.object_pairs_hook = object_pairs_hook
+        self.stats = stats
+        self.limits = limits
+        self.header = None
+        self.shared_keys = SharedStringTable(MAX_SHARED_NAMES)
+        self.shared_values = SharedStringTable(MAX_SHARED_STRING_VALUES)
+        self.documents = 0
+
+    def decode(self, string):
+        """
+        Decode the next document of the session
+
+        :param bytes|bytearray|memoryview string: SMILE formatted data
+        :returns: Decoded python object
+        :rtype: list | dict
+        """
+        if self.limits is not None:
+            self.limits.check_document_size(len(string))
+        state = DecodeState(string, self.header, self.shared_keys, self.shared_values,
+                            limits=self.limits)
+        ret = _decode(state, self.object_hook, self.object_pairs_hook, self.stats)
+        self.header = state.header
+        self.documents += 1
+        return ret
@@ -0,0 +1,245 @@
+"""
+SMILE Array Splicing
+
+Growing documents whose root value is an array without decoding and encoding them again.
+
+:func:`append` adds elements to an encoded array in place, in a ``bytearray`` or a file
+opened for reading and writing::
+
+    from pysmile import splice
+
+    with open('events-2016-05-04.smile', 'r+b') as f:
+        splice.append(f, new_events)
+
+Only the end of the array is rewritten, so appending costs as much as encoding the new
+elements, whatever the size of the document.  The back reference tables of a decoder at the
+end of the document depend on everything before it, so the new elements are encoded
+without back references (like :class:`pysmile.fragment.RawSmile`): every string is written
+in full, which is valid whatever those tables hold.  A decoder still adds these strings to
+its tables, as it does with any other.
+
+:func:`concat` joins several encoded arrays into one document.  The elements of the first
+document are copied as-is; those of every later one are copied token by token, except that
+field names and short strings (including back references) are written again against the
+back reference tables of the joined document.
+"""
+from pysmile.constants import *
+from pysmile.compress import is_compressed, decompress
+from pysmile.decode import DecodeState, SMILEDecodeError
+from pysmile.encode import SmileGenerator, _encode
+from pysmile.lazy import _SKIPPERS
+
+__author__ = 'Jonathan Hosmer'
+
+_HEADER = HEADER_BYTE_1 + HEADER_BYTE_2 + HEADER_BYTE_3
+
+_TAIL_READ_SIZE = 64
+"""Bytes read at a time while looking for the end of the array in a file"""
+
+
+class SMILESpliceError(Exception):
+    pass
+
+
+def _check_array(head):
+    """
+    :param bytes head: First 5 bytes of a document
+    :returns: Whether binary values of the document are written raw
+    :rtype: bool
+    :raises SMILESpliceError: Unless *head* is a header followed by the start of an array
+    """
+    if is_compressed(head):
+        raise SMILESpliceError('Compressed documents can not be spliced in place')
+    if len(head) < 5 or head[:3] != _HEADER:
+        raise SMILESpliceError('Document does not start with a SMILE header')
+    if head[4] != TOKEN_LITERAL_START_ARRAY:
+        raise SMILESpliceError('Root value of the document is not an array')
+    return bool(head[3] & HEADER_BIT_HAS_RAW_BINARY)
+
+
+def _end_of_array(tail, offset):
+    """
+    :param tail: Last bytes of a document
+    :param int offset: Offset of *tail* in the document
+    :returns: Offset of the end of the root array, or ``None`` if *tail* holds only end
+              markers
+    :raises SMILESpliceError: If something else than end markers follows the array
+    """
+    end = len(tail)
+    while end and tail[end - 1] == BYTE_MARKER_END_OF_CONTENT:
+        end -= 1
+    if not end:
+        return None
+    if tail[end - 1] != TOKEN_LITERAL_END_ARRAY:
+        raise SMILESpliceError('Document does not end with the end of its root array')
+    return offset + end - 1
+
+
+def _encode_elements(values, raw_binary, float_mode, default):
+    """
+    :param values: Iterable of objects
+    :param bool raw_binary: Write binary values raw rather than 7-bit
+    :param str float_mode: See :func:`pysmile.encode`
+    :param default: See :func:`pysmile.encode`
+    :returns: Encoded elements, without back references
+    :rtype: bytearray
+    """
+    sg = SmileGenerator(shared_keys=False, shared_values=False, encode_as_7bit=not raw_binary,
+                        float_mode=float_mode)
+    for value in values:
+        _encode(value, sg, default=default)
+    return sg.output
+
+
+def append(target, values, float_mode=FLOAT_MODE_DOUBLE, default=None):
+    """
+    Append *values* to the root array of an encoded document, in place
+
+    The document is not validated: only its header and the bytes after the array are looked
+    at.  End markers after the array are kept.
+
+    :param target: Document: a ``bytearray``, or a seekable file-like object opened for
+                   reading and writing (``read``, ``write``, ``seek``, ``truncate``)
+    :param values: Iterable of the objects to append
+    :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) See
+                           :func:`pysmile.encode`
+    :param default: (optional) See :func:`pysmile.encode`
+    :raises SMILESpliceError: If *target* is not an uncompressed document whose root value is
+                              an array
+    """
+    if isinstance(target, bytearray):
+        raw_binary = _check_array(bytes(target[:5]))
+        end = _end_of_array(target, 0)
+        if end is None:
+            raise SMILESpliceError('Document does not end with the end of its root array')
+        target[end:end] = _encode_elements(values, raw_binary, float_mode, default)
+        return
+    if not hasattr(target, 'seek'):
+        raise TypeError('Can not append to {}: not a bytearray or file'.format(
+            type(target).__name__))
+    target.seek(0)
+    raw_binary = _check_array(target.read(5))
+    size = target.seek(0, 2)
+    end = None
+    pos = size
+    while end is None and pos > 5:
+        start = max(pos - _TAIL_READ_SIZE, 5)
+        target.seek(start)
+        end = _end_of_array(target.read(pos - start), start)
+        pos = start
+    if end is None:
+        raise SMILESpliceError('Document does not end with the end of its root array')
+    target.seek(end)
+    tail = target.read()
+    target.seek(end)
+    target.write(_encode_elements(values, raw_binary, float_mode, default))
+    target.write(tail)
+    target.truncate()
+
+
+def _copy_elements(state, sg, verbatim):
+    """
+    Walk the elements of the root array of a document
+
+    Field names and short strings are written with *sg* (so that back references are made
+    against its tables), everything else is copied as-is.  With *verbatim* nothing is
+    written, but the strings a decoder adds to its tables are still added to those of *sg*:
+    the elements are then copied in one piece by the caller.
+
+    :param DecodeState state: Decoder state, positioned after the start of the root array
+    :param SmileGenerator sg: Generator
+    :param bool verbatim: The back reference tables of *sg* and *state* are in the same state
+    """
+    s = state.s
+    next_byte, read_key, read_value = state.next_byte, state.read_key, state.read_value
+    share_keys, share_values = sg.share_keys, sg.share_values
+    # Whether each enclosing container is an object
+    stack = []
+    in_object = False
+    while True:
+        start = state.index
+        byt = next_byte()
+        if in_object:
+            if byt == TOKEN_LITERAL_END_OBJECT:
+                in_object = stack.pop()
+                if not verbatim:
+                    sg.output.append(byt)
+                continue
+            name = read_key(byt)
+            if not verbatim:
+                sg.write_field_name(name)
+            elif share_keys and (byt >= TOKEN_PREFIX_KEY_ASCII or byt == TOKEN_KEY_LONG_STRING):
+                sg._add_seen_name(name)
+            start = state.index
+            byt = next_byte()
+        if byt == TOKEN_LITERAL_END_ARRAY:
+            if in_object:
+                raise state.error('Unexpected end of array', start)
+            if not stack:
+                return
+            in_object = stack.pop()
+        elif byt == TOKEN_LITERAL_START_ARRAY or byt == TOKEN_LITERAL_START_OBJECT:
+            stack.append(in_object)
+            in_object = byt == TOKEN_LITERAL_START_OBJECT
+        elif (TOKEN_PREFIX_TINY_ASCII <= byt < TOKEN_PREFIX_SMALL_INT or
+              TOKEN_PREFIX_SHARED_STRING_SHORT < byt < TOKEN_LITERAL_EMPTY_STRING or
+              TOKEN_PREFIX_SHARED_STRING_LONG <= byt < TOKEN_PREFIX_SHARED_STRING_LONG + 4):
+            text = read_value(byt)
+            if not verbatim:
+                sg.write_string(text)
+            elif share_values and TOKEN_PREFIX_TINY_ASCII <= byt < TOKEN_PREFIX_SMALL_INT:
+                sg._add_seen_string_value(text)
+            continue
+        else:
+            _SKIPPERS[byt](state, byt)
+        if not verbatim:
+            sg.output += s[start:state.index]
+
+
+def concat(documents, ender=False):
+    """
+    Join the root arrays of *documents* into a single document
+
+    The joined document shares keys, shares values and has raw binary values wherever any
+    of *documents* does.
+
+    :param documents: Iterable of encoded documents (``bytes``, ``bytearray`` or
+                      ``memoryview``; compressed containers are inflated) whose root values
+                      are arrays
+    :param bool ender: (optional - Default: `False`) Write an end marker
+    :returns: Document whose root array holds the elements of every array, in order
+    :rtype: bytes
+    :raises SMILESpliceError: If a document is not an array
+    :raises SMILEDecodeError: If a document is invalid
+    """
+    states = []
+    for data in documents:
+        if is_compressed(data):
+            data = decompress(data)
+        _check_array(bytes(data[:5]))
+        state = DecodeState(data)
+        state.index = 5
+        states.append(state)
+    if not states:
+        raise SMILESpliceError('Nothing to join')
+    sg = SmileGenerator(shared_keys=any(st.header.shared_keys for st in states),
+                        shared_values=any(st.header.shared_values for st in states),
+                        encode_as_7bit=not any(st.header.raw_binary for st in states))
+    sg.write_header()
+    sg.write_start_array()
+    for i, state in enumerate(states):
+        # A decoder of the joined document is in the same state as one of the first
+        # document when it reaches its elements
+        verbatim = i == 0
+        _copy_elements(state, sg, verbatim)
+        if verbatim:
+            sg.output += state.s[5:state.index - 1]
+        byt = state.pull_byte()
+        while byt == BYTE_MARKER_END_OF_CONTENT:
+            byt = state.pull_byte()
+        if byt is not None:
+            raise state.error('Trailing data after document', state.index - 1)
+    sg.write_end_array()
+    if ender:
+        sg.write_end_marker()
+    return bytes(sg.output)
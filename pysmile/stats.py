@@ -0,0 +1,274 @@
+"""
+SMILE Statistics
+
+Opt-in instrumentation of the encoder and decoder: pass a :class:`SmileStats` as *stats* to
+:func:`pysmile.encode`, :func:`pysmile.decode` (or ``dump``/``load``, the session classes,
+:class:`~pysmile.encode.SmileGenerator`) and it collects
+
+- a histogram of token classes and the bytes spent on each (:data:`VALUE_TOKEN_CLASSES`,
+  :data:`KEY_TOKEN_CLASSES`)
+- shared key / shared value table hits (back references) and misses (strings written in
+  full while the table was enabled, i.e. new table entries)
+- the maximum container nesting depth
+- wall time per phase (``decompress``, ``decode``, ``encode``, ``write``)
+
+One object can be passed to any number of calls; the numbers add up.  :meth:`SmileStats.as_dict`
+returns plain ``dict``/``int``/``float`` values for export to a metrics system.
+
+Without *stats* the encoder and decoder run their uninstrumented code paths.
+"""
+import time
+
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+HEADER = 'header'
+CONTAINER = 'container'
+SHARED_REF = 'shared_ref'
+LITERAL = 'literal'
+SMALL_INT = 'small_int'
+VARINT = 'varint'
+BIG_INTEGER = 'big_integer'
+FLOAT = 'float'
+BIG_DECIMAL = 'big_decimal'
+TINY_STRING = 'tiny_string'
+SMALL_STRING = 'small_string'
+LONG_STRING = 'long_string'
+BINARY = 'binary'
+KEY_SHARED_REF = 'key_shared_ref'
+KEY_EMPTY = 'key_empty'
+KEY_SHORT = 'key_short'
+KEY_LONG = 'key_long'
+FRAGMENT = 'fragment'
+
+
+def _value_classes():
+    classes = [None] * 256
+    for byt in range(0x01, 0x20):
+        classes[byt] = SHARED_REF
+    for byt in range(TOKEN_PREFIX_SHARED_STRING_LONG, TOKEN_PREFIX_SHARED_STRING_LONG + 4):
+        classes[byt] = SHARED_REF
+    for byt in (TOKEN_LITERAL_EMPTY_STRING, TOKEN_LITERAL_NULL, TOKEN_LITERAL_FALSE,
+                TOKEN_LITERAL_TRUE):
+        classes[byt] = LITERAL
+    classes[TOKEN_BYTE_INT_32] = VARINT
+    classes[TOKEN_BYTE_INT_64] = VARINT
+    classes[TOKEN_BYTE_BIG_INTEGER] = BIG_INTEGER
+    classes[TOKEN_BYTE_FLOAT_32] = FLOAT
+    classes[TOKEN_BYTE_FLOAT_64] = FLOAT
+    classes[TOKEN_BYTE_BIG_DECIMAL] = BIG_DECIMAL
+    for prefix in (TOKEN_PREFIX_TINY_ASCII, TOKEN_PREFIX_TINY_UNICODE):
+        for byt in range(prefix, prefix + 0x20):
+            classes[byt] = TINY_STRING
+    for prefix in (TOKEN_PREFIX_SMALL_ASCII, TOKEN_PREFIX_SHORT_UNICODE):
+        for byt in range(prefix, prefix + 0x20):
+            classes[byt] = SMALL_STRING
+    for byt in range(TOKEN_PREFIX_SMALL_INT, TOKEN_PREFIX_MISC_OTHER):
+        classes[byt] = SMALL_INT
+    classes[TOKEN_MISC_LONG_TEXT_ASCII] = LONG_STRING
+    classes[TOKEN_MISC_LONG_TEXT_UNICODE] = LONG_STRING
+    classes[TOKEN_MISC_BINARY_7BIT] = BINARY
+    classes[TOKEN_MISC_BINARY_RAW] = BINARY
+    for byt in (TOKEN_LITERAL_START_ARRAY, TOKEN_LITERAL_END_ARRAY, TOKEN_LITERAL_START_OBJECT,
+                TOKEN_LITERAL_END_OBJECT):
+        classes[byt] = CONTAINER
+    return tuple(classes)
+
+
+def _key_classes():
+    classes = [None] * 256
+    classes[TOKEN_KEY_EMPTY_STRING] = KEY_EMPTY
+    for byt in range(TOKEN_PREFIX_KEY_SHARED_LONG, TOKEN_KEY_LONG_STRING):
+        classes[byt] = KEY_SHARED_REF
+    classes[TOKEN_KEY_LONG_STRING] = KEY_LONG
+    for byt in range(TOKEN_PREFIX_KEY_SHARED_SHORT, TOKEN_PREFIX_KEY_ASCII):
+        classes[byt] = KEY_SHARED_REF
+    for byt in range(TOKEN_PREFIX_KEY_ASCII, TOKEN_RESERVED + 1):
+        classes[byt] = KEY_SHORT
+    classes[TOKEN_LITERAL_END_OBJECT] = CONTAINER
+    return tuple(classes)
+
+VALUE_TOKEN_CLASSES = _value_classes()
+"""Token class of a value by its first byte"""
+
+KEY_TOKEN_CLASSES = _key_classes()
+"""Token class of a field name by its first byte"""
+
+_SHARED_VALUE_MISSES = frozenset((TINY_STRING, SMALL_STRING))
+"""Value classes that are added to the shared value table"""
+
+_SHARED_KEY_MISSES = frozenset((KEY_SHORT, KEY_LONG))
+"""Key classes that are added to the shared key table"""
+
+
+class SmileStats(object):
+    """Counters collected while encoding or decoding"""
+
+    def __init__(self):
+        self.tokens = {}
+        """Number of tokens by class"""
+
+        self.bytes = {}
+        """Encoded bytes by token class (token byte included)"""
+
+        self.shared_key_hits = 0
+        self.shared_key_misses = 0
+        self.shared_value_hits = 0
+        self.shared_value_misses = 0
+
+        self.max_depth = 0
+        """Deepest container nesting seen (a root array or object is depth 1)"""
+
+        self.phases = {}
+        """Wall time in seconds by phase, exclusive of nested phases"""
+
+        self._depth = 0
+        self._timers = []
+
+    def record(self, cls, nbytes):
+        """
+        Count one token
+
+        :param str cls: Token class
+        :param int nbytes: Encoded size of the token, payload included
+        """
+        self.tokens[cls] = self.tokens.get(cls, 0) + 1
+        self.bytes[cls] = self.bytes.get(cls, 0) + nbytes
+
+    def record_value(self, byt, nbytes, shared=False):
+        """
+        Count a value token
+
+        :param int byt: Token byte
+        :param int nbytes: Encoded size of the value
+        :param bool shared: (optional - Default: `False`) Shared values are enabled
+        """
+        cls = VALUE_TOKEN_CLASSES[byt]
+        self.record(cls, nbytes)
+        if cls == SHARED_REF:
+            self.shared_value_hits += 1
+        elif shared and cls in _SHARED_VALUE_MISSES:
+            self.shared_value_misses += 1
+
+    def record_key(self, byt, nbytes, shared=False):
+        """
+        Count a field name token
+
+        :param int byt: Token byte
+        :param int nbytes: Encoded size of the name
+        :param bool shared: (optional - Default: `False`) Shared keys are enabled
+        """
+        cls = KEY_TOKEN_CLASSES[byt]
+        self.record(cls, nbytes)
+        if cls == KEY_SHARED_REF:
+            self.shared_key_hits += 1
+        elif shared and cls in _SHARED_KEY_MISSES:
+            self.shared_key_misses += 1
+
+    def start_container(self):
+        """Count a start array/object token"""
+        self.record(CONTAINER, 1)
+        self._depth += 1
+        if self._depth > self.max_depth:
+            self.max_depth = self._depth
+
+    def end_container(self):
+        """Count an end array/object token"""
+        self.record(CONTAINER, 1)
+        self._depth -= 1
+
+    def phase(self, name):
+        """
+        Context manager that adds the wall time of its block to *name*
+
+        Phases nest; time spent in an inner phase is not counted in the outer one.
+
+        :param str name: Phase
+        """
+        return _Phase(self, name)
+
+    @staticmethod
+    def _rate(hits, misses):
+        total = hits + misses
+        return float(hits) / total if total else 0.0
+
+    @property
+    def shared_key_hit_rate(self):
+        """:rtype: float"""
+        return self._rate(self.shared_key_hits, self.shared_key_misses)
+
+    @property
+    def shared_value_hit_rate(self):
+        """:rtype: float"""
+        return self._rate(self.shared_value_hits, self.shared_value_misses)
+
+    @property
+    def total_bytes(self):
+        """:rtype: int"""
+        return sum(self.bytes.values())
+
+    def as_dict(self):
+        """
+        :returns: All counters as plain values
+        :rtype: dict
+        """
+        return {
+            'tokens': dict(self.tokens),
+            'bytes': dict(self.bytes),
+            'total_bytes': self.total_bytes,
+            'shared_keys': {'hits': self.shared_key_hits,
+                            'misses': self.shared_key_misses,
+                            'hit_rate': self.shared_key_hit_rate},
+            'shared_values': {'hits': self.shared_value_hits,
+                              'misses': self.shared_value_misses,
+                              'hit_rate': self.shared_value_hit_rate},
+            'max_depth': self.max_depth,
+            'phases': dict(self.phases),
+        }
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.as_dict())
+
+
+class _Phase(object):
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = None
+        self.nested = 0.0
+
+    def __enter__(self):
+        self.stats._timers.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        timers = self.stats._timers
+        timers.pop()
+        if timers:
+            timers[-1].nested += elapsed
+        phases = self.stats.phases
+        phases[self.name] = phases.get(self.name, 0.0) + elapsed - self.nested
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(stats, name):
+    """
+    :param SmileStats stats: Statistics or ``None``
+    :param str name: Phase
+    :returns: :meth:`SmileStats.phase` context manager, or one that does nothing without *stats*
+    """
+    if stats is None:
+        return _NO_PHASE
+    return stats.phase(name)
@@ -0,0 +1,651 @@
+"""
+SMILE / JSON Transcoding
+
+:func:`transcode_to_json` writes the JSON text of a SMILE document token by token, without
+building the document as Python objects.  The output is the UTF-8 encoding of what
+``json.dumps(decode(data), separators=(',', ':'), ensure_ascii=False)`` would produce
+(``ensure_ascii=True`` with *ensure_ascii*):
+
+* strings are escaped like the ``json`` module does (quotes, backslashes and control
+  characters; everything outside ASCII as well with *ensure_ascii*, otherwise it is left
+  as is)
+* floats are written with ``repr``, which reads back to the same value; NaN and infinities
+  as ``NaN``, ``Infinity`` and ``-Infinity`` unless *allow_nan* is false
+* BigIntegers and BigDecimals are written with all of their digits
+* binary values are written as base64 strings
+
+Back reference tables hold the escaped JSON text of their strings, so a repeated key or
+value is escaped once.
+
+:func:`transcode_from_json` goes the other way: it tokenizes JSON text and writes every
+token with a :class:`pysmile.encode.SmileGenerator` as it is read.  The output is what
+``encode(json.loads(text))`` would produce.
+
+In both directions input is read and output written in chunks; only the unread part of the
+current input chunk, the back reference tables and the nesting of the document are held in
+memory.
+"""
+import base64
+import codecs
+from json.decoder import scanstring, JSONDecodeError, WHITESPACE
+from json.encoder import encode_basestring, encode_basestring_ascii
+from json.scanner import NUMBER_RE
+
+from pysmile.constants import *
+from pysmile import varint
+from pysmile.compress import is_compressed, iter_decompress, _buffer_reader
+from pysmile.encode import SmileGenerator
+from pysmile.decode import DecodeState, SMILEDecodeError, SMILELimitError, _VALUE_DECODERS, \
+    _integer, _big_integer, _big_decimal, _float32, _float64, _container_error, \
+    _elements_error, _Prefixed, _iter_read
+
+__author__ = 'Jonathan Hosmer'
+
+INF = float('inf')
+
+
+class SMILETranscodeError(Exception):
+    """Invalid JSON text"""
+    pass
+
+
+class _Input(object):
+    """Uncompressed input, read a chunk at a time"""
+
+    def __init__(self, src, read_size, limits):
+        """
+        _Input Initializer
+
+        :param src: SMILE data (``bytes``, ``bytearray`` or ``memoryview``) or a file-like
+                    object (``read``); either may be a compressed container
+        :param int read_size: Bytes read from a file at a time
+        :param pysmile.decode.DecodeLimits limits: Limits (or ``None``)
+        """
+        self.limits = limits
+        self.size = 0
+        """Bytes read so far"""
+
+        self.eof = False
+        self.head = b''
+        if hasattr(src, 'read'):
+            head = src.read(4)
+            if is_compressed(head):
+                self.chunks = iter_decompress(_Prefixed(head, src))
+            else:
+                self.chunks = _iter_read(head, src, read_size)
+        elif is_compressed(src):
+            self.chunks = iter_decompress(src)
+        else:
+            # Decoded in place
+            self.chunks = iter(())
+            self.head = src
+            self.eof = True
+            self._count(len(src))
+
+    def _count(self, size):
+        self.size += size
+        if self.limits is not None:
+            self.limits.check_document_size(self.size)
+
+    def read(self, rest, want):
+        """
+        :param rest: Input not consumed yet
+        :param int want: Bytes to read (fewer at the end of the input)
+        :returns: *rest* followed by the bytes read
+        :rtype: bytes | bytearray
+        """
+        if self.head:
+            head, self.head = self.head, b''
+            return head
+        parts = [rest]
+        size = 0
+        while not self.eof and size < want:
+            chunk = next(self.chunks, b'')
+            self.eof = not chunk
+            parts.append(chunk)
+            size += len(chunk)
+        self._count(size)
+        return bytearray().join(parts)
+
+
+def _escape(ensure_ascii):
+    """
+    :param bool ensure_ascii: Escape everything outside ASCII
+    :returns: Function of a ``str`` to its quoted and escaped JSON text
+    """
+    encode = encode_basestring_ascii if ensure_ascii else encode_basestring
+
+    def _escaped(s):
+        return encode(s).encode('utf-8')
+    return _escaped
+
+
+def _int_text(value):
+    """
+    :param int value: Integer
+    :returns: Every digit of *value*; ``str()`` refuses more than
+              ``sys.get_int_max_str_digits()``
+    :rtype: bytes
+    """
+    try:
+        return b'%d' % value
+    except ValueError:
+        import decimal
+        return str(decimal.Decimal(value)).encode('ascii')
+
+
+def _float_text(allow_nan):
+    """
+    :param bool allow_nan: Write NaN and infinities (as the ``json`` module does) rather than
+                           raising ``ValueError``
+    :returns: Function of a ``float`` to its JSON text
+    """
+    def _text(value):
+        if value != value:
+            text = b'NaN'
+        elif value == INF:
+            text = b'Infinity'
+        elif value == -INF:
+            text = b'-Infinity'
+        else:
+            return float.__repr__(value).encode('ascii')
+        if not allow_nan:
+            raise ValueError('Out of range float values are not JSON compliant: {!r}'.format(
+                value))
+        return text
+    return _text
+
+
+def _tables(ensure_ascii, allow_nan):
+    """
+    Token readers that return JSON text instead of values
+
+    :param bool ensure_ascii: See :func:`transcode_to_json`
+    :param bool allow_nan: See :func:`transcode_to_json`
+    :returns: Key reader (the key's JSON text followed by ``:``) and value reader by token byte
+    :rtype: tuple
+    """
+    tables = _TABLES.get((ensure_ascii, allow_nan))
+    if tables is not None:
+        return tables
+    escaped = _escape(ensure_ascii)
+    float_text = _float_text(allow_nan)
+
+    def read_key(state, byt):
+        if byt >= TOKEN_PREFIX_KEY_SHARED_SHORT:
+            if byt < TOKEN_PREFIX_KEY_ASCII:
+                return state.shared_key(byt - TOKEN_PREFIX_KEY_SHARED_SHORT)
+            if byt < TOKEN_PREFIX_KEY_UNICODE:
+                key = state.read_text((byt & 0x3F) + 1)
+            elif byt <= TOKEN_RESERVED:
+                key = state.read_text((byt - TOKEN_PREFIX_KEY_UNICODE) + 2)
+            else:
+                raise state.error('Invalid key token 0x{:x}'.format(byt), state.index - 1)
+        elif byt == TOKEN_KEY_EMPTY_STRING:
+            return b'"":'
+        elif TOKEN_PREFIX_KEY_SHARED_LONG <= byt < TOKEN_KEY_LONG_STRING:
+            return state.shared_key(state.long_shared_reference_index(byt))
+        elif byt == TOKEN_KEY_LONG_STRING:
+            key = state.read_terminated_text()
+        else:
+            raise state.error('Invalid key token 0x{:x}'.format(byt), state.index - 1)
+        key = escaped(key) + b':'
+        if state.header.shared_keys:
+            state.shared_key_strings.append(key)
+        return key
+
+    def short_text(length):
+        def _read(state, byt):
+            value = escaped(state.read_text(length(byt)))
+            if state.header.shared_values:
+                state.shared_value_strings.append(value)
+            return value
+        return _read
+
+    def literal(text):
+        return lambda state, byt: text
+
+    writers = list(_VALUE_DECODERS)
+    writers[TOKEN_LITERAL_EMPTY_STRING] = literal(b'""')
+    writers[TOKEN_LITERAL_NULL] = literal(b'null')
+    writers[TOKEN_LITERAL_FALSE] = literal(b'false')
+    writers[TOKEN_LITERAL_TRUE] = literal(b'true')
+    writers[TOKEN_BYTE_INT_32] = writers[TOKEN_BYTE_INT_64] = \
+        lambda state, byt: b'%d' % _integer(state, byt)
+    writers[TOKEN_BYTE_BIG_INTEGER] = lambda state, byt: _int_text(_big_integer(state, byt))
+    writers[TOKEN_BYTE_FLOAT_32] = lambda state, byt: float_text(_float32(state, byt))
+    writers[TOKEN_BYTE_FLOAT_64] = lambda state, byt: float_text(_float64(state, byt))
+    writers[TOKEN_BYTE_BIG_DECIMAL] = \
+        lambda state, byt: str(_big_decimal(state, byt)).encode('ascii')
+    ascii_text = short_text(lambda byt: (byt & 0x3F) + 1)
+    unicode_text = short_text(lambda byt: (byt & 0x3F) + 2)
+    for byt in range(TOKEN_PREFIX_TINY_ASCII, TOKEN_PREFIX_TINY_UNICODE):
+        writers[byt] = ascii_text
+    for byt in range(TOKEN_PREFIX_TINY_UNICODE, TOKEN_PREFIX_SMALL_INT):
+        writers[byt] = unicode_text
+    for byt in range(TOKEN_PREFIX_SMALL_INT, TOKEN_PREFIX_MISC_OTHER):
+        writers[byt] = literal(b'%d' % varint.zigzag_decode(byt & 0x1F))
+    writers[TOKEN_MISC_LONG_TEXT_ASCII] = writers[TOKEN_MISC_LONG_TEXT_UNICODE] = \
+        lambda state, byt: escaped(state.read_terminated_text())
+    writers[TOKEN_MISC_BINARY_7BIT] = \
+        lambda state, byt: b'"' + base64.b64encode(state.read_7bit_binary()) + b'"'
+    writers[TOKEN_MISC_BINARY_RAW] = \
+        lambda state, byt: b'"' + base64.b64encode(state.read_raw_binary()) + b'"'
+    tables = _TABLES[ensure_ascii, allow_nan] = (read_key, writers)
+    return tables
+
+
+_TABLES = {}
+"""Token readers by ``(ensure_ascii, allow_nan)``"""
+
+
+def transcode_to_json(src, sink, ensure_ascii=False, allow_nan=True, limits=None,
+                      buffer_size=DEFAULT_READ_SIZE):
+    """
+    Write the JSON text of a SMILE document without decoding it to Python objects
+
+    Compressed containers are inflated block by block while reading.  An end marker may
+    follow the document; anything else is an error.
+
+    :param src: SMILE data (``bytes``, ``bytearray`` or ``memoryview``) or a file-like
+                object (``read``)
+    :param sink: File-like object (``write``) that takes ``bytes``; wrap a socket with
+                 ``socket.makefile('wb')``
+    :param bool ensure_ascii: (optional - Default: `False`) Escape everything outside ASCII
+                              (``\\uXXXX``); otherwise the output is UTF-8
+    :param bool allow_nan: (optional - Default: `True`) Write NaN and infinities as ``NaN``,
+                           ``Infinity`` and ``-Infinity``; otherwise they raise ``ValueError``
+    :param pysmile.decode.DecodeLimits limits: (optional) Reject input over these limits
+                                               (:class:`pysmile.decode.SMILELimitError`)
+    :param int buffer_size: (optional - Default: 64 KiB) Bytes read from a file and written to
+                            *sink* at a time
+    :returns: Bytes written to *sink*
+    :rtype: int
+    :raises SMILEDecodeError: On invalid or truncated data; part of the output may already
+                              have been written
+    """
+    read_key, writers = _tables(ensure_ascii, allow_nan)
+    inp = _Input(src, buffer_size, limits)
+    state = DecodeState(inp.read(b'', buffer_size), limits=limits)
+    s = state.s
+    write = sink.write
+    out = bytearray()
+    written = 0
+    # Whether each enclosing container is an object
+    stack = []
+    in_object = False
+    # Nothing written to the innermost container yet
+    first = True
+    # The key of the next value has been written
+    after_key = False
+    max_depth = state.max_depth
+    elements = state.max_elements
+    while True:
+        token = state.index
+        try:
+            byt = s[token]
+            state.index = token + 1
+            if in_object and not after_key:
+                if byt != TOKEN_LITERAL_END_OBJECT:
+                    key = read_key(state, byt)
+                    out += key if first else b',' + key
+                    after_key = True
+                    continue
+                out += b'}'
+                in_object = stack.pop()
+            elif byt == TOKEN_LITERAL_END_ARRAY:
+                if in_object or not stack:
+                    raise state.error('Unexpected end of array', state.index - 1)
+                out += b']'
+                in_object = stack.pop()
+            elif byt == TOKEN_LITERAL_START_ARRAY or byt == TOKEN_LITERAL_START_OBJECT:
+                if elements <= 0 or len(stack) >= max_depth:
+                    raise _container_error(state, elements - 1, len(stack))
+                elements -= 1
+                if not (first or in_object):
+                    out += b','
+                stack.append(in_object)
+                in_object = byt == TOKEN_LITERAL_START_OBJECT
+                out += b'{' if in_object else b'['
+                first = True
+                after_key = False
+                continue
+            else:
+                if elements <= 0:
+                    raise _elements_error(state)
+                value = writers[byt](state, byt)
+                elements -= 1
+                if not (first or in_object):
+                    out += b','
+                out += value
+        except SMILELimitError as e:
+            if e.offset is not None:
+                raise
+            # Raised by a back reference table, which does not know the offset
+            raise state.limit_error(str(e), e.limit)
+        except (SMILEDecodeError, IndexError):
+            if inp.eof:
+                if state.index == token:
+                    raise state.error('Unexpected end of input')
+                raise
+            # Most likely the token continues past the input read so far: read at least as
+            # much again and start over at the token, so a long token is read a logarithmic
+            # number of times
+            rest = memoryview(state.s)[token:]
+            state.s = s = inp.read(rest, max(len(rest), buffer_size))
+            state.start -= token
+            state.index = 0
+            continue
+        if not stack:
+            break
+        first = after_key = False
+        if len(out) >= buffer_size:
+            write(out)
+            written += len(out)
+            out = bytearray()
+    if out:
+        write(out)
+        written += len(out)
+
+    if state.index == len(state.s) and not inp.eof:
+        state.start -= state.index
+        state.index = 0
+        state.s = inp.read(b'', 1)
+    byt = state.pull_byte()
+    if byt is not None and byt != BYTE_MARKER_END_OF_CONTENT:
+        raise state.error('Trailing data after document', state.index - 1)
+    return written
+
+
+class _Text(object):
+    """JSON text, read a chunk at a time"""
+
+    def __init__(self, src, read_size):
+        """
+        _Text Initializer
+
+        :param src: JSON text (``str``), UTF-8 encoded JSON text (``bytes``, ``bytearray`` or
+                    ``memoryview``) or a file-like object (``read``) returning either
+        :param int read_size: Characters or bytes read at a time
+        """
+        self.read_size = read_size
+        self.eof = False
+        if isinstance(src, str):
+            self.head = src
+            self.eof = True
+            return
+        self.head = ''
+        self._read = src.read if hasattr(src, 'read') else _buffer_reader(src)
+        # Set by the first chunk of bytes
+        self.decoder = None
+
+    def _chunk(self):
+        """
+        :returns: Next chunk of text, or ``''`` at the end of the input
+        :rtype: str
+        """
+        while True:
+            data = self._read(self.read_size)
+            if isinstance(data, str):
+                return data
+            if self.decoder is None:
+                self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+            text = self.decoder.decode(data, not data)
+            if text or not data:
+                return text
+
+    def read(self, rest, want):
+        """
+        :param str rest: Input not consumed yet
+        :param int want: Characters to read (fewer at the end of the input)
+        :returns: *rest* followed by the text read
+        :rtype: str
+        """
+        if self.head:
+            head, self.head = self.head, ''
+            return head
+        parts = [rest]
+        size = 0
+        while not self.eof and size < want:
+            chunk = self._chunk()
+            self.eof = not chunk
+            parts.append(chunk)
+            size += len(chunk)
+        return ''.join(parts)
+
+
+# What the JSON tokenizer expects next
+_VALUE = 0
+_FIRST_VALUE = 1  # after [
+_KEY = 2
+_FIRST_KEY = 3  # after {
+_COLON = 4
+_NEXT = 5  # after a value in an array or object: , or its end
+_DONE = 6
+
+_WHITESPACE = ' \t\n\r'
+
+_CONSTANTS = {
+    't': ('true', SmileGenerator.write_true),
+    'f': ('false', SmileGenerator.write_false),
+    'n': ('null', SmileGenerator.write_null),
+    'N': ('NaN', lambda sg: sg.write_float(float('nan'))),
+    'I': ('Infinity', lambda sg: sg.write_float(INF)),
+    '-': ('-Infinity', lambda sg: sg.write_float(-INF)),
+}
+"""Literal and writer by first character; ``json.loads`` takes NaN and infinities too"""
+
+
+def transcode_from_json(src, sink, header=True, ender=False, shared_keys=True,
+                        shared_vals=True, float_mode=FLOAT_MODE_DOUBLE, use_decimal=False,
+                        buffer_size=DEFAULT_READ_SIZE):
+    """
+    Write JSON text as SMILE without building Python objects
+
+    Keys and strings go to :meth:`pysmile.encode.SmileGenerator.write_field_name` and
+    :meth:`~pysmile.encode.SmileGenerator.write_string`, integers to
+    :meth:`~pysmile.encode.SmileGenerator.write_integral_number` as their digits, so they
+    keep every digit.
+
+    :param src: JSON text (``str``), UTF-8 encoded JSON text (``bytes``, ``bytearray`` or
+                ``memoryview``) or a file-like object (``read``) returning either
+    :param sink: File-like object (``write``) that takes ``bytes``
+    :param bool header: (optional - Default: `True`) Write the SMILE header
+    :param bool ender: (optional - Default: `False`) Write an end marker
+    :param bool shared_keys: (optional - Default: `True`) Shared Key String References
+    :param bool shared_vals: (optional - Default: `True`) Shared Value String References
+    :param str float_mode: (optional - Default: `FLOAT_MODE_DOUBLE`) See
+                           :func:`pysmile.encode.encode`
+    :param bool use_decimal: (optional - Default: `False`) Write numbers with a fraction or
+                             exponent as BigDecimals
+                             (:meth:`~pysmile.encode.SmileGenerator.write_decimal_number`),
+                             which keeps their precision; otherwise as floats, like
+                             ``json.loads``
+    :param int buffer_size: (optional - Default: 64 KiB) Characters or bytes read from *src*
+                            and bytes written to *sink* at a time
+    :returns: Bytes written to *sink*
+    :rtype: int
+    :raises SMILETranscodeError: On invalid JSON text; part of the output may already have
+                                 been written
+    """
+    sg = SmileGenerator(shared_keys, shared_vals, float_mode=float_mode)
+    if header:
+        sg.write_header()
+    text = _Text(src, buffer_size)
+    buf = text.read('', buffer_size)
+    pos = 0
+    # Characters dropped from the start of buf
+    consumed = 0
+    write = sink.write
+    written = 0
+    # Whether each open container is an object
+    stack = []
+    expect = _VALUE
+    match_number = NUMBER_RE.match
+    skip_whitespace = WHITESPACE.match
+    end = len(buf)
+    while True:
+        # Whether the token at pos may continue past the end of buf
+        more = False
+        if pos < end:
+            c = buf[pos]
+        elif text.eof:
+            if expect != _DONE:
+                raise _json_error('Unexpected end of JSON text', consumed + pos)
+            break
+        else:
+            c = None
+            more = True
+
+        if more:
+            pass
+        elif c in _WHITESPACE:
+            pos += 1
+            if pos < end and buf[pos] in _WHITESPACE:
+                pos = skip_whitespace(buf, pos).end()
+            continue
+        elif expect == _NEXT:
+            if c == ',':
+                expect = _KEY if stack[-1] else _VALUE
+            elif c == ('}' if stack[-1] else ']'):
+                if stack.pop():
+                    sg.write_end_object()
+                else:
+                    sg.write_end_array()
+                expect = _NEXT if stack else _DONE
+            else:
+                raise _json_error("Expecting ',' delimiter", consumed + pos)
+            pos += 1
+            # json.dumps() separators are followed by a space by default
+            if pos < end and buf[pos] == ' ':
+                pos += 1
+            if len(sg.output) >= buffer_size:
+                write(sg.output)
+                written += len(sg.output)
+                sg.output = bytearray()
+            continue
+        elif expect <= _FIRST_VALUE:
+            if c == '"':
+                try:
+                    value, pos = scanstring(buf, pos + 1)
+                except JSONDecodeError as e:
+                    more = _truncated(e, buf, text)
+                    if not more:
+                        raise _json_error(e.msg, consumed + e.pos)
+                else:
+                    sg.write_string(value)
+                    expect = _NEXT if stack else _DONE
+            elif c == '{':
+                sg.write_start_object()
+                stack.append(True)
+                pos += 1
+                expect = _FIRST_KEY
+            elif c == '[':
+                sg.write_start_array()
+                stack.append(False)
+                pos += 1
+                expect = _FIRST_VALUE
+            elif c == ']' and expect == _FIRST_VALUE:
+                sg.write_end_array()
+                stack.pop()
+                pos += 1
+                expect = _NEXT if stack else _DONE
+            else:
+                m = match_number(buf, pos)
+                # With fewer than three characters after it a number may go on (1e-5)
+                if m is not None and (m.end() + 3 <= end or text.eof):
+                    integer, frac, exp = m.groups()
+                    if frac is None and exp is None:
+                        if integer[0] == '-':
+                            sg.write_integral_number(integer[1:], True)
+                        else:
+                            sg.write_integral_number(integer)
+                    elif use_decimal:
+                        sg.write_decimal_number(m.group())
+                    else:
+                        sg.write_float(float(m.group()))
+                    pos = m.end()
+                    expect = _NEXT if stack else _DONE
+                elif m is not None:
+                    more = True
+                elif c in _CONSTANTS:
+                    literal, write_constant = _CONSTANTS[c]
+                    if buf.startswith(literal, pos):
+                        write_constant(sg)
+                        pos += len(literal)
+                        expect = _NEXT if stack else _DONE
+                    elif end - pos < len(literal) and not text.eof:
+                        more = True
+                    else:
+                        raise _json_error('Expecting value', consumed + pos)
+                else:
+                    raise _json_error('Expecting value', consumed + pos)
+        elif expect == _COLON:
+            if c != ':':
+                raise _json_error("Expecting ':' delimiter", consumed + pos)
+            pos += 1
+            expect = _VALUE
+        elif expect == _DONE:
+            raise _json_error('Extra data', consumed + pos)
+        elif c == '"':
+            try:
+                value, pos = scanstring(buf, pos + 1)
+            except JSONDecodeError as e:
+                more = _truncated(e, buf, text)
+                if not more:
+                    raise _json_error(e.msg, consumed + e.pos)
+            else:
+                sg.write_field_name(value)
+                if pos < end and buf[pos] == ':':
+                    pos += 1
+                    if pos < end and buf[pos] == ' ':
+                        pos += 1
+                    expect = _VALUE
+                else:
+                    expect = _COLON
+        elif c == '}' and expect == _FIRST_KEY:
+            sg.write_end_object()
+            stack.pop()
+            pos += 1
+            expect = _NEXT if stack else _DONE
+        else:
+            raise _json_error('Expecting property name enclosed in double quotes',
+                              consumed + pos)
+
+        if more:
+            # Read at least as much again as is left, so a long token is scanned a
+            # logarithmic number of times
+            rest = buf[pos:]
+            buf = text.read(rest, max(len(rest), buffer_size))
+            end = len(buf)
+            consumed += pos
+            pos = 0
+    if ender:
+        sg.write_end_marker()
+    if sg.output:
+        write(sg.output)
+        written += len(sg.output)
+    return written
+
+
+def _truncated(e, buf, text):
+    """
+    :param JSONDecodeError e: String scanner error
+    :param str buf: Text it was scanning
+    :param _Text text: Input
+    :returns: Whether the string may just continue past the end of *buf*
+    :rtype: bool
+    """
+    if text.eof:
+        return False
+    # Not terminated, or cut off in the middle of an escape sequence
+    return e.msg.startswith('Unterminated') or e.pos >= len(buf) - 6
+
+
+def _json_error(msg, offset):
+    """
+    :param str msg: Message
+    :param int offset: Character offset of the problem in the JSON text
+    :rtype: SMILETranscodeError
+    """
+    return SMILETranscodeError('{} at offset {}'.format(msg, offset))
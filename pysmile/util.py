@@ -4,91 +4,229 @@ Miscellaneous helper methods.
 
 import struct
 
+from pysmile.varint import zigzag_encode, zigzag_decode
 
-def zigzag_encode(inp):
-    if inp < 0:
-        return (inp << 1) ^ -1
-    return inp << 1
 
+_FLOAT32 = struct.Struct('>f')
+_FLOAT64 = struct.Struct('>d')
 
-def zigzag_decode(encoded):
-    return (encoded >> 1) ^ (-(encoded & 1))
+FLOAT32_MAX = 3.4028234663852886e+38
+"""Largest finite IEEE 754 single precision value"""
 
 
 def float_to_raw_long_bits(value):
-    return struct.unpack('Q', struct.pack('d', value))[0]
+    return int.from_bytes(_FLOAT64.pack(value), 'big')
 
 
 def long_bits_to_float(bits):
-    return struct.unpack('d', struct.pack('Q', bits))[0]
+    return _FLOAT64.unpack(bits.to_bytes(8, 'big'))[0]
 
 
 def float_to_bits(value):
-    return struct.unpack('>l', struct.pack('>f', value))[0]
+    return int.from_bytes(_FLOAT32.pack(value), 'big')
 
 
 def bits_to_float(bits):
-    return round(struct.unpack('>f', struct.pack('>l', bits))[0], 6)
+    return _FLOAT32.unpack(bits.to_bytes(4, 'big'))[0]
 
 
-def bit_len(i):
+def is_float32_exact(value):
     """
-    Calculate the bit length of an int
+    Check whether a float survives a round trip through single precision unchanged
 
-    :param int i: Int
-    :return: Length of *i*
+    :param float value: Value
+    :rtype: bool
+    """
+    if value != value:
+        # NaN payloads are only kept bit-for-bit as doubles
+        return False
+    if -FLOAT32_MAX <= value <= FLOAT32_MAX:
+        return _FLOAT32.unpack(_FLOAT32.pack(value))[0] == value
+    # +/- Infinity
+    return value in (float('inf'), float('-inf'))
+
+
+def float32_to_7bit(value):
+    """
+    SMILE 32-bit float payload: 5 bytes, 4 + 4 * 7 bits, most significant first
+
+    :param float value: Value
+    :rtype: bytes
+    """
+    bits = int.from_bytes(_FLOAT32.pack(value), 'big')
+    return bytes((bits >> 28, (bits >> 21) & 0x7F, (bits >> 14) & 0x7F, (bits >> 7) & 0x7F,
+                  bits & 0x7F))
+
+
+def float64_to_7bit(value):
+    """
+    SMILE 64-bit float payload: 10 bytes, 1 + 9 * 7 bits, most significant first
+
+    :param float value: Value
+    :rtype: bytes
+    """
+    bits = int.from_bytes(_FLOAT64.pack(value), 'big')
+    # Split into two 35 bit halves so the shifts stay in small-int territory
+    hi = bits >> 35
+    lo = bits & 0x7FFFFFFFF
+    return bytes((hi >> 28, (hi >> 21) & 0x7F, (hi >> 14) & 0x7F, (hi >> 7) & 0x7F, hi & 0x7F,
+                  lo >> 28, (lo >> 21) & 0x7F, (lo >> 14) & 0x7F, (lo >> 7) & 0x7F, lo & 0x7F))
+
+
+def float32_from_7bit(data, offset=0):
+    """
+    Inverse of :func:`float32_to_7bit`
+
+    :param bytes|bytearray data: Buffer
+    :param int offset: (optional - Default: 0) Start of the 5 byte payload
+    :rtype: float
+    """
+    b = data[offset:offset + 5]
+    bits = (b[0] << 28) | (b[1] << 21) | (b[2] << 14) | (b[3] << 7) | b[4]
+    return _FLOAT32.unpack((bits & 0xFFFFFFFF).to_bytes(4, 'big'))[0]
+
+
+def float64_from_7bit(data, offset=0):
+    """
+    Inverse of :func:`float64_to_7bit`
+
+    :param bytes|bytearray data: Buffer
+    :param int offset: (optional - Default: 0) Start of the 10 byte payload
+    :rtype: float
+    """
+    b = data[offset:offset + 10]
+    hi = (b[0] << 28) | (b[1] << 21) | (b[2] << 14) | (b[3] << 7) | b[4]
+    lo = (b[5] << 28) | (b[6] << 21) | (b[7] << 14) | (b[8] << 7) | b[9]
+    return _FLOAT64.unpack((((hi << 35) | lo) & 0xFFFFFFFFFFFFFFFF).to_bytes(8, 'big'))[0]
+
+
+_7BIT_GROUPS_PER_BLOCK = 1024
+"""7 byte groups converted per big integer step by :func:`encode_7bit`/:func:`decode_7bit`"""
+
+_7BIT_MASKS = {}
+
+
+def _7bit_masks(groups):
+    """
+    Bit masks for *groups* 64-bit slots, cached per group count
+
+    :param int groups: Number of slots
+    :rtype: tuple
+    """
+    masks = _7BIT_MASKS.get(groups)
+    if masks is None:
+        masks = tuple(int(pattern * groups, 16) for pattern in (
+            '000000000fffffff', '00fffffff0000000', '0fffffff00000000',
+            '00003fff00003fff', '0fffc0000fffc000', '3fff00003fff0000',
+            '007f007f007f007f', '3f803f803f803f80', '7f007f007f007f00'))
+        if groups == _7BIT_GROUPS_PER_BLOCK or len(_7BIT_MASKS) < 64:
+            _7BIT_MASKS[groups] = masks
+    return masks
+
+
+def encoded_7bit_length(length):
+    """
+    Number of bytes :func:`encode_7bit` produces for *length* bytes of input
+
+    :param int length: Raw length
     :rtype: int
     """
-    length = 0
-    while i:
-        i >>= 1
-        length += 1
-    return length
+    tail = length % 7
+    return length // 7 * 8 + (tail + 1 if tail else 0)
+
+
+def encode_7bit(data):
+    """
+    Spread *data* over 7-bit bytes: every 7 input bytes become 8 output bytes, most
+    significant bits first; a partial last group of n bytes becomes n + 1 bytes, the final
+    one holding its n remaining bits right-aligned.
+
+    Whole groups are converted a block at a time: each 7 byte group is widened to a 64-bit
+    slot of one large integer, which is then split 56 -> 2 x 28 -> 4 x 14 -> 8 x 7 bits with
+    three mask-and-shift steps over all slots at once.
+
+    :param bytes|bytearray|memoryview data: Raw bytes
+    :rtype: bytearray
+    """
+    data = memoryview(data)
+    out = bytearray()
+    full = len(data) // 7 * 7
+    block = 7 * _7BIT_GROUPS_PER_BLOCK
+    for start in range(0, full, block):
+        chunk = data[start:min(start + block, full)]
+        groups = len(chunk) // 7
+        slots = bytearray(8 * groups)
+        for i in range(7):
+            slots[i + 1::8] = chunk[i::7]
+        m = _7bit_masks(groups)
+        x = int.from_bytes(slots, 'big')
+        x = (x & m[0]) | ((x & m[1]) << 4)
+        x = (x & m[3]) | ((x & m[4]) << 2)
+        x = (x & m[6]) | ((x & m[7]) << 1)
+        out += x.to_bytes(8 * groups, 'big')
+    tail = len(data) - full
+    if tail:
+        value = int.from_bytes(data[full:], 'big')
+        bits = 8 * tail
+        for i in range(1, tail + 1):
+            out.append((value >> (bits - 7 * i)) & 0x7F)
+        out.append(value & ((1 << tail) - 1))
+    return out
+
+
+def decode_7bit(data, offset, length):
+    """
+    Inverse of :func:`encode_7bit`
+
+    :param bytes|bytearray data: Buffer
+    :param int offset: Start of the encoded bytes
+    :param int length: Number of *decoded* bytes
+    :rtype: bytearray
+    """
+    out = bytearray()
+    full = length // 7 * 8
+    block = 8 * _7BIT_GROUPS_PER_BLOCK
+    for start in range(offset, offset + full, block):
+        chunk = data[start:min(start + block, offset + full)]
+        groups = len(chunk) // 8
+        m = _7bit_masks(groups)
+        x = int.from_bytes(chunk, 'big')
+        x = (x & m[6]) | ((x & m[8]) >> 1)
+        x = (x & m[3]) | ((x & m[5]) >> 2)
+        x = (x & m[0]) | ((x & m[2]) >> 4)
+        slots = bytearray(x.to_bytes(8 * groups, 'big'))
+        del slots[::8]
+        out += slots
+    tail = length % 7
+    if tail:
+        start = offset + full
+        value = 0
+        for byt in data[start:start + tail]:
+            value = (value << 7) | (byt & 0x7F)
+        value = (value << tail) | (data[start + tail] & ((1 << tail) - 1))
+        out += value.to_bytes(tail, 'big')
+    return out
+
+
+def int_to_bytes(i):
+    """
+    Minimal big-endian two's complement representation of *i*, as Java's
+    ``BigInteger.toByteArray()`` (always at least one byte, room for the sign bit)
+
+    :param int i: Integer
+    :rtype: bytes
+    """
+    return i.to_bytes((i if i >= 0 else ~i).bit_length() // 8 + 1, 'big', signed=True)
 
 
-def bit_count(i):
+def int_from_bytes(data):
     """
-    Calculate the number of set bits (1's) in an int
+    Inverse of :func:`int_to_bytes`
 
-    :param int i: An int
-    :returns: The number of set bits in *i*
+    :param bytes|bytearray data: Big-endian two's complement bytes
     :rtype: int
     """
-    count = 0
-    while i:
-        i &= i - 1
-        count += 1
-    return count
-
-
-def bsr(value, bits):
-    """ bsr(value, bits) -> value shifted right by bits
-
-    This function is here because an expression in the original java
-    source contained the token '>>>' and/or '>>>=' (bit shift right
-    and/or bit shift right assign).  In place of these, the python
-    source code below contains calls to this function.
-
-    Copyright 2003 Jeffrey Clement.  See pyrijnadel.py for license and
-    original source.
-
-    :param value: Value
-    :param bits: Bits
-    """
-    if bits < 0 or bits > 31:
-        raise ValueError('bad shift count')
-    if bits == 0:
-        return value
-    minint = -2147483648
-    if bits == 31:
-        if value & minint:
-            return 1
-        else:
-            return 0
-    tmp = (value & 0x7FFFFFFE) // 2**bits
-    if value & minint:
-        tmp |= (0x40000000 // 2 ** (bits - 1))
-    return tmp
+    return int.from_bytes(data, 'big', signed=True)
 
 
 def hash_string(s):
@@ -0,0 +1,160 @@
+"""
+SMILE Integer Codec
+
+SMILE writes lengths and integer values as variable length ints ("VInts"): big-endian groups
+of 7 bits in bytes with the high bit clear, terminated by a byte with the high bit set that
+carries the last 6 bits.  Signed values are zigzag encoded first, so small magnitudes of
+either sign stay short.  Values whose zigzag form fits 5 bits are written as a single
+"small int" token byte; the rest get an int (32-bit) or long (64-bit) token and a VInt.
+
+The layout of a VInt only depends on the bit length of the value, so the shifts for every
+bit length up to 64 are computed once, up front.
+"""
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+MAX_VINT_BYTES = 10
+"""Longest VInt: 6 + 9 * 7 bits covers a 64-bit value"""
+
+
+def _shifts(bits):
+    """
+    Shifts of the 7-bit groups that precede the final 6 bits of a *bits* long value
+
+    :param int bits: Bit length
+    :rtype: tuple
+    """
+    # ceil((bits - 6) / 7)
+    groups = bits // 7
+    return tuple(6 + 7 * k for k in reversed(range(groups)))
+
+_VINT_SHIFTS = tuple(_shifts(bits) for bits in range(65))
+"""Shifts by bit length of the value"""
+
+_INT_TOKENS = tuple(TOKEN_BYTE_INT_32 if bits <= 32 else TOKEN_BYTE_INT_64
+                    for bits in range(65))
+"""Token by bit length of the zigzag encoded value"""
+
+
+def zigzag_encode(i):
+    """
+    :param int i: Signed value
+    :rtype: int
+    """
+    return i << 1 if i >= 0 else (i << 1) ^ -1
+
+
+def zigzag_decode(z):
+    """
+    :param int z: Zigzag encoded value
+    :rtype: int
+    """
+    return (z >> 1) ^ -(z & 1)
+
+
+def write_vint(out, value):
+    """
+    Append the VInt of *value*
+
+    :param bytearray out: Output
+    :param int value: Unsigned value, at most 64 bits
+    """
+    try:
+        shifts = _VINT_SHIFTS[value.bit_length()]
+    except IndexError:
+        raise ValueError('VInt out of range: {}'.format(value))
+    if value < 0:
+        raise ValueError('VInt out of range: {}'.format(value))
+    for shift in shifts:
+        out.append((value >> shift) & 0x7F)
+    out.append(0x80 | (value & 0x3F))
+
+
+def write_int(out, i):
+    """
+    Append the shortest integer token for *i*: small int, int or long
+
+    :param bytearray out: Output
+    :param int i: Value in the Java long range
+    """
+    z = i << 1 if i >= 0 else (i << 1) ^ -1
+    if z < 0x20:
+        out.append(TOKEN_PREFIX_SMALL_INT + z)
+        return
+    bits = z.bit_length()
+    if bits > 64:
+        raise ValueError('Integer out of the long range: {}'.format(i))
+    out.append(_INT_TOKENS[bits])
+    for shift in _VINT_SHIFTS[bits]:
+        out.append((z >> shift) & 0x7F)
+    out.append(0x80 | (z & 0x3F))
+
+
+def write_ints(out, values, start=0):
+    """
+    Append integer tokens for the leading run of plain ints in *values*
+
+    Stops at the first value that is not an ``int`` in the Java long range (``bool`` and other
+    subclasses included), so the caller can continue with its general path from there.
+
+    :param bytearray out: Output
+    :param values: Sequence (``list``/``tuple``)
+    :param int start: (optional - Default: 0) Index of the first value
+    :returns: Index of the first value not written
+    :rtype: int
+    """
+    append = out.append
+    shifts_by_bits = _VINT_SHIFTS
+    tokens = _INT_TOKENS
+    small = TOKEN_PREFIX_SMALL_INT
+    for ix in range(start, len(values)):
+        i = values[ix]
+        if type(i) is not int:
+            return ix
+        z = i << 1 if i >= 0 else (i << 1) ^ -1
+        if z < 0x20:
+            append(small + z)
+            continue
+        bits = z.bit_length()
+        if bits > 64:
+            return ix
+        append(tokens[bits])
+        for shift in shifts_by_bits[bits]:
+            append((z >> shift) & 0x7F)
+        append(0x80 | (z & 0x3F))
+    return len(values)
+
+
+def read_vint(data, offset=0):
+    """
+    Decode the VInt at *offset*
+
+    :param bytes|bytearray data: Buffer
+    :param int offset: (optional - Default: 0) Start of the VInt
+    :returns: Value and the offset just past it
+    :rtype: tuple
+    :raises ValueError: If the VInt is truncated or longer than :data:`MAX_VINT_BYTES`
+    """
+    value = 0
+    for ix in range(offset, min(offset + MAX_VINT_BYTES, len(data))):
+        byt = data[ix]
+        if byt & 0x80:
+            return (value << 6) | (byt & 0x3F), ix + 1
+        value = (value << 7) | byt
+    if offset + MAX_VINT_BYTES <= len(data):
+        raise ValueError('VInt longer than {} bytes at offset {}'.format(MAX_VINT_BYTES, offset))
+    raise ValueError('Truncated VInt at offset {}'.format(offset))
+
+
+def read_int(data, offset=0):
+    """
+    Decode the zigzag encoded VInt at *offset* (payload of an int or long token)
+
+    :param bytes|bytearray data: Buffer
+    :param int offset: (optional - Default: 0) Start of the VInt
+    :returns: Value and the offset just past it
+    :rtype: tuple
+    """
+    z, offset = read_vint(data, offset)
+    return (z >> 1) ^ -(z & 1), offset
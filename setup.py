@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 import os
 from setuptools import setup
 
@@ -18,6 +18,7 @@ setup(
     url='https://github.com/jhosmer/PySmile',
     packages=['pysmile', 'tests'],
     platforms=['Linux'],
+    python_requires='>=3.11',
     long_description=read('README'),
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -25,11 +26,14 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: Apache Software License',
         'Operating System :: Unix',
-        'Programming Language :: Python :: 2.7',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'Topic :: Internet :: WWW/HTTP',
         'Topic :: Internet :: WWW/HTTP :: HTTP Servers',
         'Topic :: Utilities',
     ],
-    test_suite='tests.pysmile_tests',
+    test_suite='tests',
     version='0.2'
 )
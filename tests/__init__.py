@@ -8,7 +8,7 @@ def generate_tests():
     json_dir = os.path.join(curdir, 'data', 'json')
 
     file_header = '''\
-#!/usr/bin/env python
+#!/usr/bin/env python3
 import os
 import glob
 import unittest
@@ -38,39 +38,39 @@ class PySmileTestEncode(unittest.TestCase):''' + setup
 class PySmileTestMisc(unittest.TestCase):
     def test_1(self):
         a = [1]
-        b = pysmile.decode(':)\\n\\x03\\xf8\\xc2\\xf9')
+        b = pysmile.decode(b':)\\n\\x03\\xf8\\xc2\\xf9')
         self.assertListEqual(a, b, 'Expected:\\n{!r}\\nGot:\\n{!r}'.format(a, b))
 
     def test_2(self):
         a = [1, 2]
-        b = pysmile.decode(':)\\n\\x03\\xf8\\xc2\\xc4\\xf9')
+        b = pysmile.decode(b':)\\n\\x03\\xf8\\xc2\\xc4\\xf9')
         self.assertListEqual(a, b, 'Expected:\\n{!r}\\nGot:\\n{!r}'.format(a, b))
 
     def test_3(self):
         a = [1, 2, {'c': 3}]
-        b = pysmile.decode(':)\\n\\x03\\xf8\\xc2\\xc4\\xfa\\x80c\\xc6\\xfb\\xf9')
+        b = pysmile.decode(b':)\\n\\x03\\xf8\\xc2\\xc4\\xfa\\x80c\\xc6\\xfb\\xf9')
         self.assertListEqual(a, b, 'Expected:\\n{!r}\\nGot:\\n{!r}'.format(a, b))
 
     def test_4(self):
         a = {'a': 1}
-        b = pysmile.decode(':)\\n\\x03\\xfa\\x80a\\xc2\\xfb')
+        b = pysmile.decode(b':)\\n\\x03\\xfa\\x80a\\xc2\\xfb')
         self.assertDictEqual(a, b, 'Expected:\\n{!r}\\nGot:\\n{!r}'.format(a, b))
 
     def test_5(self):
         a = {'a': '1', 'b': 2, 'c': [3], 'd': -1, 'e': 4.20}
         b = pysmile.decode(
-            ':)\\n\\x03\\xfa\\x80a@1\\x80c\\xf8\\xc6\\xf9\\x80b\\xc4\\x80e(fL\\x19\\x04\\x04\\x80d\\xc1\\xfb')
+            b':)\\n\\x03\\xfa\\x80a@1\\x80c\\xf8\\xc6\\xf9\\x80b\\xc4\\x80e)\\x00@\\x083\\x19Lf3\\x19M\\x80d\\xc1\\xfb')
         self.assertDictEqual(a, b, 'Expected:\\n{!r}\\nGot:\\n{!r}'.format(a, b))
 
     def test_6(self):
         a = {'a': {'b': {'c': {'d': ['e']}}}}
         b = pysmile.decode(
-                ':)\\n\\x03\\xfa\\x80a\\xfa\\x80b\\xfa\\x80c\\xfa\\x80d\\xf8@e\\xf9\\xfb\\xfb\\xfb\\xfb')
+                b':)\\n\\x03\\xfa\\x80a\\xfa\\x80b\\xfa\\x80c\\xfa\\x80d\\xf8@e\\xf9\\xfb\\xfb\\xfb\\xfb')
         self.assertDictEqual(a, b, 'Expected:\\n{!r}\\nGot:\\n{!r}'.format(a, b))
 '''
 
-    for smile in os.listdir(smile_dir):
-        base_name = os.path.basename(os.path.join(json_dir, re.sub('\.smile$', '', smile, 1)))
+    for smile in sorted(os.listdir(smile_dir)):
+        base_name = os.path.basename(os.path.join(json_dir, re.sub(r'\.smile$', '', smile, 1)))
         json = base_name + '.jsn'
 
         tname = re.sub('[-.]', '_', base_name)
@@ -81,8 +81,8 @@ class PySmileTestMisc(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\\n{{!r}}\\n{{!r}}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\\n{{!r}}\\n{{!r}}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{{}}\\nExpected:\\n{{!r}}\\nGot:\\n{{!r}}'.format(s, b, a))
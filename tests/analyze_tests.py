@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import decimal
+import shutil
+import tempfile
+import unittest
+import io
+import pysmile
+from pysmile import analyze
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestAnalyze(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_flag_combinations(self):
+        combos = analyze.flag_combinations()
+        self.assertEqual(8, len(combos))
+        self.assertEqual({'shared_keys': True, 'shared_vals': True, 'bin_7bit': True}, combos[0])
+        self.assertEqual(8, len(set(tuple(sorted(c.items())) for c in combos)))
+
+    def test_missed_too_long(self):
+        text = 'x' * 65
+        missed = analyze.missed_back_references([text, text, text, 'short', 'short'])
+        self.assertEqual([{'string': text, 'count': 3, 'repeat_bytes': 130,
+                           'reason': 'too long'}], missed['values'])
+        self.assertEqual([], missed['keys'])
+
+    def test_missed_evicted(self):
+        # 1100 distinct keys: the table resets after 1024, so the first keys repeat in full
+        keys = ['k{}'.format(i) for i in range(1100)]
+        doc = [dict.fromkeys(keys[:600], 0), dict.fromkeys(keys[600:], 0),
+               dict.fromkeys(keys[:600], 0)]
+        missed = analyze.missed_back_references(doc, top=1000)
+        self.assertTrue(missed['keys'])
+        self.assertTrue(all(e['reason'] == 'evicted' and e['count'] == 2
+                            for e in missed['keys']))
+        self.assertEqual(5, len(analyze.missed_back_references(doc, top=5)['keys']))
+
+    def test_analyze_document(self):
+        doc = {'status': ['OK'] * 10, 'items': [{'id': i, 'region': 'us-east-1'}
+                                                for i in range(10)]}
+        report = analyze.analyze_document(doc, min_time=0.001)
+        self.assertEqual(len(json.dumps(doc, separators=(',', ':'))), report['json_bytes'])
+        self.assertEqual(len(pysmile.encode(doc)), report['sizes'][0]['smile_bytes'])
+        self.assertEqual(len(pysmile.encode(doc, shared_keys=False, shared_vals=False)),
+                         report['sizes'][-2]['smile_bytes'])
+        self.assertEqual(18, report['shared_keys']['hits'])
+        self.assertEqual(18, report['shared_values']['hits'])
+        self.assertGreater(report['encode_seconds'], 0)
+        self.assertGreater(report['decode_seconds'], 0)
+        self.assertNotIn('encode_seconds', analyze.analyze_document(doc, min_time=0))
+
+    def test_binary_and_decimal(self):
+        doc = {'blob': b'\x00' * 30, 'price': decimal.Decimal('1.25')}
+        report = analyze.analyze_document(doc, min_time=0)
+        self.assertEqual(len('{"blob":"' + 'A' * 40 + '","price":1.25}'), report['json_bytes'])
+
+    def test_main(self):
+        doc = {'a': [1, 2, 3], 'b': 'text'}
+        with open(os.path.join(self.tmp, 'doc.json'), 'w') as f:
+            json.dump(doc, f)
+        with open(os.path.join(self.tmp, 'doc.smile'), 'wb') as f:
+            f.write(pysmile.encode(doc, compress=True, compress_threshold=0))
+        with open(os.path.join(self.tmp, 'junk.txt'), 'wb') as f:
+            f.write(b'not json')
+
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+        try:
+            ret = analyze.main(['--min-time', '0', '--json', '-', self.tmp])
+            out, err = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self.assertEqual(0, ret)
+        self.assertIn('junk.txt: skipped', err)
+        reports = json.loads(out)
+        self.assertEqual(['doc.json', 'doc.smile'], sorted(map(os.path.basename, reports)))
+        a, b = [reports[k] for k in sorted(reports)]
+        self.assertEqual(('json', 'smile'), (a['source'], b['source']))
+        self.assertEqual(a['sizes'], b['sizes'])
+
+    def test_main_missing_file(self):
+        missing = os.path.join(self.tmp, 'missing.json')
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+        try:
+            ret = analyze.main(['--min-time', '0', missing])
+            err = sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self.assertEqual(1, ret)
+        self.assertIn('{}: skipped'.format(missing), err)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import decimal
+import random
+import unittest
+import pysmile
+from pysmile import util
+from pysmile.encode import SmileGenerator
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestBigNumbers(unittest.TestCase):
+    def test_int_bytes(self):
+        # Java BigInteger.toByteArray()
+        for i, raw in ((0, b'\x00'), (1, b'\x01'), (-1, b'\xff'), (127, b'\x7f'), (128, b'\x00\x80'),
+                       (-128, b'\x80'), (-129, b'\xff\x7f'), (255, b'\x00\xff'), (1 << 63, b'\x00\x80' + b'\x00' * 7)):
+            self.assertEqual(raw, util.int_to_bytes(i))
+            self.assertEqual(i, util.int_from_bytes(raw))
+
+    def test_big_integer(self):
+        rnd = random.Random(7)
+        values = [MAX_LONG + 1, MIN_LONG - 1, 1 << 64, -(1 << 64), 10 ** 40, -(10 ** 40)]
+        values += [rnd.getrandbits(rnd.randint(64, 2000)) * rnd.choice((1, -1)) for _ in range(100)]
+        b = pysmile.encode(values)
+        self.assertEqual(TOKEN_BYTE_BIG_INTEGER, b[5])
+        self.assertEqual(values, pysmile.decode(b))
+
+    def test_big_integer_layout(self):
+        # 2 ** 64: 9 bytes, 7-bit encoded in 11
+        b = pysmile.encode([1 << 64])
+        self.assertEqual(b':)\n\x03\xf8\x26\x89' + util.encode_7bit(util.int_to_bytes(1 << 64)) + b'\xf9', b)
+        self.assertEqual(4 + 1 + 2 + 11 + 1, len(b))
+
+    def test_big_decimal(self):
+        values = [decimal.Decimal(s) for s in (
+            '0', '1.5', '-1.50', '3.14159265358979323846264338327950288419716939937510',
+            '1E+100', '-2.5E-300', '123456789012345678901234567890.123456789', '0.000001')]
+        d = pysmile.decode(pysmile.encode(values))
+        self.assertEqual(values, d)
+        # Exact representation, not just numeric equality
+        self.assertEqual([v.as_tuple() for v in values], [v.as_tuple() for v in d])
+        self.assertTrue(all(isinstance(v, decimal.Decimal) for v in d))
+
+    def test_long_big_decimal(self):
+        # More digits than int() parses from a string by default
+        for text in ('1234567890' * 500 + 'E-17', '-0.' + '9' * 5000):
+            value = decimal.Decimal(text)
+            d = pysmile.decode(pysmile.encode([value]),
+                               limits=pysmile.DecodeLimits(max_number_length=None))
+            self.assertEqual(value.as_tuple(), d[0].as_tuple())
+
+    def test_big_decimal_layout(self):
+        # 1.5 == 15 * 10 ** -1: scale 1 (zigzag 2), unscaled 15 (1 byte, 2 encoded)
+        self.assertEqual(b':)\n\x03\xf8\x2a\x82\x81\x07\x01\xf9', pysmile.encode([decimal.Decimal('1.5')]))
+
+    def test_special_decimals(self):
+        d = pysmile.decode(pysmile.encode([decimal.Decimal('Infinity'), decimal.Decimal('NaN')]))
+        self.assertEqual(float('inf'), d[0])
+        self.assertNotEqual(d[1], d[1])
+
+    def test_numeric_strings(self):
+        sg = SmileGenerator()
+        sg.write_header()
+        sg.write_start_array()
+        for n in ('-5', str(10 ** 30), '-2.50'):
+            sg.write_number(n)
+        sg.write_end_array()
+        self.assertEqual([-5, 10 ** 30, decimal.Decimal('-2.50')], pysmile.decode(sg.output))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import os
+import random
+import unittest
+import pysmile
+from pysmile import util
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestBinary(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(42)
+        self.blobs = [bytearray(rnd.getrandbits(8) for _ in range(n))
+                      for n in list(range(16)) + [7 * 1024, 7 * 1024 + 6, 50000]]
+
+    def test_7bit_codec(self):
+        for blob in self.blobs:
+            enc = util.encode_7bit(blob)
+            self.assertEqual(util.encoded_7bit_length(len(blob)), len(enc))
+            self.assertTrue(all(b < 0x80 for b in enc))
+            self.assertEqual(blob, util.decode_7bit(bytearray(b'xyz') + enc, 3, len(blob)))
+
+    def test_7bit_spec_layout(self):
+        # 7 bytes -> 8 groups of 7 bits, most significant first; 1 leftover byte -> 7 + 1 bits
+        self.assertEqual(bytearray([0x7F] * 8), util.encode_7bit(b'\xff' * 7))
+        self.assertEqual(bytearray([0x55, 0x00]), util.encode_7bit(b'\xaa'))
+        b = pysmile.encode([b'\xff\x01'])
+        self.assertEqual(b':)\n\x03\xf8\xe8\x82\x7f\x40\x01\xf9', b)
+
+    def test_round_trip(self):
+        for bin_7bit in (True, False):
+            b = pysmile.encode({'blobs': self.blobs, 'view': memoryview(self.blobs[-1])},
+                               bin_7bit=bin_7bit)
+            self.assertEqual(not bin_7bit, bool(b[3] & HEADER_BIT_HAS_RAW_BINARY))
+            d = pysmile.decode(b)
+            self.assertEqual([bytes(blob) for blob in self.blobs], d['blobs'])
+            self.assertIsInstance(d['view'], bytes)
+            self.assertEqual(bytes(self.blobs[-1]), d['view'])
+
+    def test_raw_is_smaller(self):
+        blob = bytearray(os.urandom(7000))
+        self.assertEqual(7000 + 4 + 1 + 2, len(pysmile.encode(blob, bin_7bit=False)))
+        self.assertEqual(8000 + 4 + 1 + 2, len(pysmile.encode(blob)))
+
+    def test_binary_view(self):
+        blob = bytearray(os.urandom(1000))
+        raw = bytearray(pysmile.encode([blob], bin_7bit=False))
+        d = pysmile.decode(raw, binary_view=True)
+        self.assertIsInstance(d[0], memoryview)
+        self.assertEqual(bytes(blob), d[0].tobytes())
+        d = pysmile.decode(pysmile.encode([blob]), binary_view=True)
+        self.assertEqual(bytes(blob), d[0].tobytes())
+
+    def test_truncated(self):
+        b = pysmile.encode([bytearray(100)], bin_7bit=False)
+        self.assertRaises(pysmile.SMILEDecodeError, pysmile.decode, b[:-10])
+        b = pysmile.encode([bytearray(100)])
+        self.assertRaises(pysmile.SMILEDecodeError, pysmile.decode, b[:-10])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import io
+import hashlib
+import decimal
+import unittest
+import collections
+import pysmile
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestCanonical(unittest.TestCase):
+    def test_key_order(self):
+        a = {'b': 1, 'a': [{'y': 2, 'x': 3}], 'c': None}
+        b = collections.OrderedDict([('c', None), ('a', [{'x': 3, 'y': 2}]), ('b', 1)])
+        self.assertNotEqual(pysmile.encode(a), pysmile.encode(b))
+        self.assertEqual(pysmile.encode(a, canonical=True), pysmile.encode(b, canonical=True))
+        self.assertEqual(['a', 'b', 'c'], list(pysmile.decode(pysmile.encode(b, canonical=True))))
+
+    def test_coerced_keys(self):
+        # Keys are ordered as the field names they are written as
+        data = pysmile.encode({10: 'a', 9: 'b', None: 'c'}, canonical=True)
+        self.assertEqual(['10', '9', 'null'], list(pysmile.decode(data)))
+
+    def test_colliding_keys(self):
+        # Two "1" members, in an order that would depend on the dict's
+        for doc in ({1: 'a', '1': 'b'}, {'1': 'b', 1: 'a'}, {'x': [{True: 1, 'true': 2}]}):
+            self.assertRaises(ValueError, pysmile.encode, doc, canonical=True)
+            self.assertRaises(ValueError, pysmile.fingerprint, doc)
+        # Still written as they come without canonical
+        self.assertEqual({'1': 'b'}, pysmile.decode(pysmile.encode({1: 'a', '1': 'b'})))
+
+    def test_sets(self):
+        values = {'x{}'.format(i) for i in range(50)} | {1, 2.5, None}
+        data = pysmile.encode(values, canonical=True)
+        self.assertEqual(data, pysmile.encode(set(reversed(list(values))), canonical=True))
+        self.assertEqual(data, pysmile.encode(frozenset(values), canonical=True))
+
+    def test_shared_references(self):
+        # Enough names to wrap the shared key table: references still only depend on content
+        doc = {'k{}'.format(i): {'v': 'x{}'.format(i % 40)} for i in range(1500)}
+        shuffled = dict(sorted(doc.items(), key=lambda item: hash(item[0])))
+        data = pysmile.encode(doc, canonical=True)
+        self.assertEqual(data, pysmile.encode(shuffled, canonical=True))
+        self.assertEqual(doc, pysmile.decode(data))
+
+    def test_floats(self):
+        nan = float('nan')
+        other_nan = -nan
+        self.assertEqual(pysmile.encode([nan], canonical=True),
+                         pysmile.encode([other_nan], canonical=True))
+        self.assertEqual(pysmile.encode([1.5], canonical=True),
+                         pysmile.encode([1.5], float_mode=FLOAT_MODE_DOUBLE))
+        self.assertRaises(ValueError, pysmile.encode, [1.5], canonical=True,
+                          float_mode=FLOAT_MODE_LOSSLESS)
+
+    def test_dump(self):
+        doc = {'b': list(range(100)), 'a': 'x' * 500}
+        out = io.BytesIO()
+        pysmile.dump(doc, out, canonical=True, block_size=16)
+        self.assertEqual(pysmile.encode(doc, canonical=True), out.getvalue())
+        self.assertEqual(pysmile.encode(doc, canonical=True, compress=True, compress_threshold=0),
+                         pysmile.encode(dict(reversed(list(doc.items()))), canonical=True,
+                                        compress=True, compress_threshold=0))
+
+
+class PySmileTestFingerprint(unittest.TestCase):
+    def test_fingerprint(self):
+        doc = {'name': 'config', 'values': {str(i): i for i in range(2000)},
+               'd': decimal.Decimal('1.5')}
+        self.assertEqual(hashlib.sha256(pysmile.encode(doc, canonical=True)).hexdigest(),
+                         pysmile.fingerprint(doc))
+        self.assertEqual(pysmile.fingerprint(doc),
+                         pysmile.fingerprint(dict(reversed(list(doc.items())))))
+        self.assertNotEqual(pysmile.fingerprint(doc), pysmile.fingerprint(dict(doc, name='other')))
+
+    def test_small_blocks(self):
+        doc = [{'k': 'x' * i} for i in range(100)]
+        self.assertEqual(pysmile.fingerprint(doc), pysmile.fingerprint(doc, block_size=1))
+        self.assertEqual(hashlib.md5(pysmile.encode(doc, canonical=True)).hexdigest(),
+                         pysmile.fingerprint(doc, algorithm='md5'))
+
+    def test_default(self):
+        class Point(object):
+            def __init__(self, x, y):
+                self.x, self.y = x, y
+        hook = lambda p: {'y': p.y, 'x': p.x}
+        self.assertEqual(pysmile.fingerprint({'x': 1, 'y': 2}),
+                         pysmile.fingerprint(Point(1, 2), default=hook))
+        self.assertRaises(TypeError, pysmile.fingerprint, Point(1, 2))
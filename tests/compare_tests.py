@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import copy
+import unittest
+import pysmile
+from pysmile.compare import MISSING
+from pysmile.compress import compress
+
+__author__ = 'Jonathan Hosmer'
+
+
+def _records(count):
+    return [{'name': 'n{}'.format(i % 40), 'value': 'v{}'.format(i % 1500),
+             'more': [i, i / 3.0, 'long' * 20, {'k{}'.format(i % 1100): i}]}
+            for i in range(count)]
+
+
+class PySmileTestCompare(unittest.TestCase):
+    def test_equal(self):
+        doc = {'a': [1, 'x', {'b': None}], 'c': 'x', 'd': b'\x00\x01', 'e': 1.5}
+        data = pysmile.encode(doc)
+        self.assertTrue(pysmile.equal(data, data))
+        for kwargs in ({'shared_keys': False}, {'shared_vals': False}, {'bin_7bit': False},
+                       {'ender': True}):
+            self.assertTrue(pysmile.equal(data, pysmile.encode(doc, **kwargs)), kwargs)
+            self.assertEqual([], pysmile.diff(pysmile.encode(doc, **kwargs), data))
+        # Members in another order
+        self.assertTrue(pysmile.equal(data, pysmile.encode(dict(reversed(list(doc.items()))))))
+        self.assertTrue(pysmile.equal(pysmile.encode([1, float('nan')]),
+                                      pysmile.encode([1.0, float('nan')])))
+        for other in ([1], {'a': [1, 'x', {'b': None}]}, dict(doc, e=2.5), dict(doc, f=None),
+                      dict(doc, a=[1, 'x', {'b': 0}])):
+            self.assertFalse(pysmile.equal(data, pysmile.encode(other)), other)
+
+    def test_diff(self):
+        old = {'a': [1, 2, 3], 'b': {'c': 'x', 'd': [True]}, 'e': 'y', 'f': None}
+        new = {'a': [1, 5, 3, 4], 'b': {'c': 'z', 'd': {}}, 'e': 'y', 'g': 0}
+        self.assertEqual([(('a', 1), 2, 5), (('a', 3), MISSING, 4), (('b', 'c'), 'x', 'z'),
+                          (('b', 'd'), [True], {}), (('f',), None, MISSING),
+                          (('g',), MISSING, 0)],
+                         pysmile.diff(pysmile.encode(old), pysmile.encode(new)))
+        self.assertEqual([(('a', 1), 2, MISSING), (('a', 2), 3, MISSING)],
+                         pysmile.diff(pysmile.encode({'a': [1, 2, 3]}),
+                                      pysmile.encode({'a': [1]})))
+        self.assertEqual([((), [1], 'x')], pysmile.diff(pysmile.encode([1]),
+                                                        pysmile.encode('x')))
+        self.assertEqual('MISSING', repr(MISSING))
+
+    def test_back_references(self):
+        # Past the capacity of both back reference tables, with changes before and after
+        # they start over
+        old = _records(3000)
+        for changes in ([(5, 'value', 'other')], [(1500, 'name', 'n1')],
+                        [(10, 'more', 'gone'), (2999, 'value', 'v0')]):
+            new = copy.deepcopy(old)
+            expected = []
+            for ix, key, value in changes:
+                expected.append(((ix, key), old[ix][key], value))
+                new[ix][key] = value
+            for kwargs in ({}, {'shared_vals': False}):
+                with self.subTest(changes=changes, **kwargs):
+                    self.assertEqual(expected, pysmile.diff(pysmile.encode(old),
+                                                            pysmile.encode(new, **kwargs)))
+
+    def test_repeated_strings(self):
+        # Values that differ throughout, with few distinct keys and strings: the tables stay
+        # in step, except after a changed string until they start over
+        old = [{'key{}'.format(i % 500): 'val{}'.format(i % 500), 'n': i} for i in range(3000)]
+        new = copy.deepcopy(old)
+        for i, record in enumerate(new):
+            record['n'] = i + 1
+        new[700]['key200'] = 'other'
+        new[1500]['extra'] = 'val3'
+        expected = []
+        for i, (a, b) in enumerate(zip(old, new)):
+            for key in list(a) + [key for key in b if key not in a]:
+                if a.get(key, MISSING) != b.get(key, MISSING):
+                    expected.append(((i, key), a.get(key, MISSING), b.get(key, MISSING)))
+        self.assertEqual(3002, len(expected))
+        for kwargs in ({}, {'shared_keys': False}):
+            with self.subTest(**kwargs):
+                self.assertEqual(expected, pysmile.diff(pysmile.encode(old, **kwargs),
+                                                        pysmile.encode(new, **kwargs)))
+                self.assertFalse(pysmile.equal(pysmile.encode(old, **kwargs),
+                                               pysmile.encode(new, **kwargs)))
+
+    def test_first_difference(self):
+        # Nothing after the first difference is looked at
+        a = pysmile.encode([1, 'x', 'y'])
+        b = pysmile.encode([2, 'x', 'y'])
+        broken = b[:-3] + b'\xf8\xf8'
+        self.assertFalse(pysmile.equal(a, broken))
+        with self.assertRaises(pysmile.SMILEDecodeError):
+            pysmile.diff(a, broken)
+
+    def test_errors(self):
+        data = pysmile.encode([1, 2])
+        with self.assertRaises(pysmile.SMILEDecodeError):
+            pysmile.equal(data, data + b'\x00')
+        with self.assertRaises(pysmile.SMILEDecodeError):
+            pysmile.equal(data, b'[1, 2]')
+
+    def test_compressed(self):
+        doc = _records(100)
+        data = pysmile.encode(doc)
+        self.assertTrue(pysmile.equal(compress(data), data))
+        self.assertEqual([((3, 'name'), 'n3', None)],
+                         pysmile.diff(data, compress(pysmile.encode(
+                             doc[:3] + [dict(doc[3], name=None)] + doc[4:]))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import os
+import json
+import unittest
+from io import BytesIO
+import pysmile
+from pysmile import compress
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestCompress(unittest.TestCase):
+    def setUp(self):
+        curdir = os.path.dirname(os.path.abspath(__file__))
+        self.obj = json.load(open(os.path.join(curdir, 'data', 'json', 'numbers-int-64k.jsn'), 'rb'))
+
+    def test_round_trip(self):
+        plain = pysmile.encode(self.obj)
+        packed = pysmile.encode(self.obj, compress=True)
+        self.assertTrue(compress.is_compressed(packed))
+        self.assertLess(len(packed), len(plain))
+        self.assertEqual(plain, compress.decompress(packed))
+        self.assertListEqual(self.obj, pysmile.decode(packed))
+
+    def test_below_threshold(self):
+        a = pysmile.encode({'a': 1}, compress=True)
+        self.assertEqual(pysmile.encode({'a': 1}), a)
+        self.assertFalse(compress.is_compressed(a))
+
+    def test_streaming(self):
+        out = BytesIO()
+        pysmile.dump(self.obj, out, compress=True, block_size=1024)
+        self.assertTrue(compress.is_compressed(out.getvalue()))
+        out.seek(0)
+        self.assertListEqual(self.obj, pysmile.load(out))
+
+    def test_dump_plain(self):
+        out = BytesIO()
+        pysmile.dump(self.obj, out, block_size=1024)
+        self.assertEqual(pysmile.encode(self.obj), out.getvalue())
+
+    def test_truncated(self):
+        packed = pysmile.encode(self.obj, compress=True)
+        self.assertRaises(compress.SMILECompressionError, compress.decompress, packed[:-10])
+
+    def test_missing_block(self):
+        data = pysmile.encode([str(i) * 20 for i in range(20000)])
+        packed = compress.compress(data, block_size=4096)
+        # Drop the last data block, keep the end of container marker
+        blocks = []
+        pos = len(compress.COMPRESSED_HEADER)
+        while True:
+            length, = compress.BLOCK_HEADER.unpack_from(packed, pos)
+            if not length:
+                break
+            blocks.append(pos)
+            pos += compress.BLOCK_HEADER.size + length
+        self.assertGreater(len(blocks), 2)
+        dropped = packed[:blocks[-1]] + packed[pos:]
+        with self.assertRaises(compress.SMILECompressionError) as cm:
+            compress.decompress(dropped)
+        self.assertIn('Truncated', str(cm.exception))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import io
+import json
+import decimal
+import unittest
+import collections
+import pysmile
+from pysmile.decode import iter_load
+from pysmile.compress import compress
+from pysmile.convert import convert, guess_format, SMILEConvertError
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestIterLoad(unittest.TestCase):
+    def setUp(self):
+        self.docs = [{'id': i, 'text': 'x' * (i * 37)} for i in range(100)] + [[1, 2], 'root']
+        self.data = b''.join(pysmile.encode(d, ender=i % 2 == 0) for i, d in enumerate(self.docs))
+
+    def test_read_sizes(self):
+        for read_size in (1, 7, 4096):
+            self.assertEqual(self.docs, list(iter_load(io.BytesIO(self.data), read_size=read_size)))
+
+    def test_compressed(self):
+        data = compress(self.data, threshold=0, block_size=100)
+        self.assertEqual(self.docs, list(iter_load(io.BytesIO(data))))
+
+    def test_raw_binary_views(self):
+        data = b''.join(pysmile.encode({'b': b'\xff' * i}, bin_7bit=False, ender=True)
+                        for i in range(50))
+        docs = list(iter_load(io.BytesIO(data), read_size=5, binary_view=True))
+        self.assertEqual([b'\xff' * i for i in range(50)], [d['b'].tobytes() for d in docs])
+
+    def test_empty(self):
+        self.assertEqual([], list(iter_load(io.BytesIO(b''))))
+
+    def test_truncated(self):
+        docs = iter_load(io.BytesIO(self.data[:-3]), read_size=64)
+        with self.assertRaises(pysmile.SMILEDecodeError):
+            list(docs)
+
+    def test_max_document_size(self):
+        data = pysmile.encode(['x' * 100] * 100)
+        with self.assertRaises(pysmile.SMILEDecodeError):
+            list(iter_load(io.BytesIO(data[:-1]), read_size=16, max_document_size=1000))
+
+
+class PySmileTestConvert(unittest.TestCase):
+    def setUp(self):
+        self.docs = [collections.OrderedDict([('id', i), ('name', 'n\xe9{}'.format(i % 7)),
+                                              ('tags', ['a', 'b'])])
+                     for i in range(50)]
+        self.ndjson = b''.join(json.dumps(d).encode('utf-8') + b'\n' for d in self.docs)
+
+    def _convert(self, data, src, dst, **kwargs):
+        out = io.BytesIO()
+        result = convert(io.BytesIO(data), out, src, dst, **kwargs)
+        self.assertEqual(len(data), result['bytes_in'])
+        self.assertEqual(len(out.getvalue()), result['bytes_out'])
+        return out.getvalue(), result
+
+    def test_ndjson_smile_ndjson(self):
+        smile, result = self._convert(self.ndjson, 'ndjson', 'smile')
+        self.assertEqual(50, result['documents'])
+        self.assertEqual(self.docs, list(iter_load(io.BytesIO(smile))))
+        back, _ = self._convert(smile, 'smile', 'ndjson')
+        self.assertEqual(self.docs, [json.loads(line) for line in back.splitlines()])
+        # Key order survives both ways
+        self.assertTrue(back.startswith(b'{"id":0,"name":'))
+
+    def test_workers(self):
+        single, _ = self._convert(self.ndjson, 'ndjson', 'smile')
+        multi, result = self._convert(self.ndjson, 'ndjson', 'smile', workers=2, batch_lines=7)
+        self.assertEqual(single, multi)
+        self.assertEqual(50, result['documents'])
+
+    def test_json(self):
+        out, _ = self._convert(self.ndjson, 'ndjson', 'json')
+        self.assertEqual(self.docs, json.loads(out))
+        one, result = self._convert(json.dumps(self.docs[3]).encode('utf-8'), 'json', 'json')
+        self.assertEqual(1, result['documents'])
+        self.assertEqual(self.docs[3], json.loads(one))
+        smile, _ = self._convert(one, 'json', 'smile')
+        self.assertEqual(pysmile.encode(self.docs[3], ender=True), smile)
+        empty, result = self._convert(b'', 'ndjson', 'json')
+        self.assertEqual(0, result['documents'])
+        self.assertEqual(b'\n', empty)
+
+    def test_compress(self):
+        smile, _ = self._convert(self.ndjson * 20, 'ndjson', 'smile', compress=True)
+        self.assertTrue(smile.startswith(b':)z'))
+        self.assertEqual(self.docs * 20, list(iter_load(io.BytesIO(smile))))
+        with self.assertRaises(SMILEConvertError):
+            self._convert(self.ndjson, 'ndjson', 'json', compress=True)
+
+    def test_encode_options(self):
+        smile, _ = self._convert(self.ndjson, 'ndjson', 'smile', shared_keys=False)
+        self.assertEqual(pysmile.encode(self.docs[0], ender=True, shared_keys=False),
+                         smile[:len(pysmile.encode(self.docs[0], ender=True, shared_keys=False))])
+
+    def test_json_only_values(self):
+        smile = pysmile.encode({'d': decimal.Decimal('1.5'), 'b': b'\x00\xff'})
+        out, _ = self._convert(smile, 'smile', 'ndjson')
+        self.assertEqual({'d': 1.5, 'b': 'AP8='}, json.loads(out))
+
+    def test_decimal_digits(self):
+        # Decimals keep all their digits, wherever they are
+        doc = {'d': decimal.Decimal('0.1000000000000000000001'), 'b': b'\x00\xff',
+               'l': [1, 'x\u00e9', {'e': decimal.Decimal('-1E+400')}, None]}
+        out, _ = self._convert(pysmile.encode(doc), 'smile', 'ndjson')
+        self.assertEqual(b'{"d":0.1000000000000000000001,"b":"AP8=","l":[1,"x\xc3\xa9",'
+                         b'{"e":-1E+400},null]}\n', out)
+        self.assertEqual(dict(doc, b='AP8='), json.loads(out, parse_float=decimal.Decimal))
+
+    def test_guess_format(self):
+        self.assertEqual('smile', guess_format('-', b':)\n\x03'))
+        self.assertEqual('smile', guess_format('data.bin', b':)z\x00'))
+        self.assertEqual('ndjson', guess_format('events.JSONL'))
+        self.assertEqual('json', guess_format('doc.jsn', b'{"a'))
+        self.assertIsNone(guess_format('-'))
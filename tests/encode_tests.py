@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+import collections
+import unittest
+import pysmile
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestEncode(unittest.TestCase):
+    def test_deep_nesting(self):
+        depth = 20000
+        root = cur = []
+        for _ in range(depth):
+            child = []
+            cur.append(child)
+            cur = child
+        b = pysmile.encode(root)
+        self.assertEqual(b':)\n\x03' + b'\xf8' * (depth + 1) + b'\xf9' * (depth + 1), b)
+
+    def test_deep_nesting_objects(self):
+        depth = 5000
+        root = cur = {}
+        for _ in range(depth):
+            cur['a'] = {}
+            cur = cur['a']
+        b = pysmile.encode(root, shared_keys=False)
+        self.assertEqual(b':)\n\x02\xfa' + b'\x80a\xfa' * depth + b'\xfb' * (depth + 1), b)
+
+    def test_circular(self):
+        a = [1, 2]
+        a.append(a)
+        self.assertRaises(ValueError, pysmile.encode, a)
+        d = {'x': {}}
+        d['x']['y'] = d
+        self.assertRaises(ValueError, pysmile.encode, d)
+
+    def test_repeated_not_circular(self):
+        shared = [1, 2]
+        b = pysmile.encode([shared, shared, {'a': shared}])
+        self.assertEqual(b, pysmile.encode([shared, shared, {'a': shared}], check_circular=False))
+        self.assertEqual([[1, 2], [1, 2], {'a': [1, 2]}], pysmile.decode(b))
+
+    def test_subclasses_and_keys(self):
+        class Name(str):
+            pass
+        o = collections.OrderedDict([(1, True), (None, Name('x')), (2.5, (3, 4))])
+        self.assertEqual({'1': True, 'null': 'x', '2.5': [3, 4]}, pysmile.decode(pysmile.encode(o)))
+
+    def test_unserializable(self):
+        self.assertRaises(TypeError, pysmile.encode, [object()])
+        self.assertRaises(TypeError, pysmile.encode, {(1, 2): 3})
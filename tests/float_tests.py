@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import math
+import random
+import struct
+import unittest
+import pysmile
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestFloat(unittest.TestCase):
+    values = [0.0, -0.0, 1.5, 4.2, -2.5e-308, 5e-324, 1.7976931348623157e308, 0.1, 1e22,
+              float('inf'), float('-inf')]
+
+    def test_double_round_trip(self):
+        rnd = random.Random(1234)
+        a = self.values + [rnd.uniform(-1e300, 1e300) for _ in range(200)]
+        b = pysmile.decode(pysmile.encode(a))
+        self.assertListEqual(a, b)
+        self.assertListEqual([math.copysign(1, x) for x in a], [math.copysign(1, x) for x in b])
+
+    def test_lossless_round_trip(self):
+        rnd = random.Random(4321)
+        singles = [struct.unpack('>f', struct.pack('>f', rnd.uniform(-1e30, 1e30)))[0]
+                   for _ in range(200)]
+        a = self.values + singles
+        b = pysmile.decode(pysmile.encode(a, float_mode=FLOAT_MODE_LOSSLESS))
+        self.assertListEqual(a, b)
+
+    def test_lossless_picks_width(self):
+        single = pysmile.encode([1.5], float_mode=FLOAT_MODE_LOSSLESS)
+        double = pysmile.encode([4.2], float_mode=FLOAT_MODE_LOSSLESS)
+        self.assertEqual(TOKEN_BYTE_FLOAT_32, single[5])
+        self.assertEqual(4 + 1 + 1 + 5 + 1, len(single))
+        self.assertEqual(TOKEN_BYTE_FLOAT_64, double[5])
+        self.assertEqual(TOKEN_BYTE_FLOAT_64, pysmile.encode([1.5])[5])
+
+    def test_nan(self):
+        b = pysmile.decode(pysmile.encode([float('nan')], float_mode=FLOAT_MODE_LOSSLESS))
+        self.assertTrue(math.isnan(b[0]))
+
+    def test_float32_spec_byte_order(self):
+        # 1.5f == 0x3FC00000: 4 most significant bits first, then 7-bit groups
+        self.assertListEqual([1.5], pysmile.decode(b':)\n\x03\xf8\x28\x03\x7e\x00\x00\x00\xf9'))
+
+    def test_truncated(self):
+        self.assertRaises(pysmile.SMILEDecodeError, pysmile.decode, pysmile.encode([4.2])[:-4])
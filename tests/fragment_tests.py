@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import io
+import unittest
+import pysmile
+from pysmile import RawSmile, FragmentCache
+
+__author__ = 'Jonathan Hosmer'
+
+DESCRIPTOR = {
+    'service': 'inventory',
+    'endpoints': [{'name': 'get', 'method': 'GET'}, {'name': 'put', 'method': 'PUT'}],
+    'limits': {'rate': 100, 'burst': 2.5},
+}
+
+
+class PySmileTestRawSmile(unittest.TestCase):
+    def test_splice(self):
+        raw = RawSmile.from_object(DESCRIPTOR)
+        self.assertEqual(DESCRIPTOR, pysmile.decode(pysmile.encode(raw)))
+        doc = {'result': ['get', 'GET', 'inventory'], 'descriptor': raw, 'method': 'GET'}
+        expected = dict(doc, descriptor=DESCRIPTOR)
+        for kwargs in ({}, {'shared_keys': False}, {'shared_vals': False}, {'compress': True}):
+            self.assertEqual(expected, pysmile.decode(pysmile.encode(doc, **kwargs)), kwargs)
+
+    def test_back_references_after_fragment(self):
+        raw = RawSmile.from_object(DESCRIPTOR)
+        self.assertEqual(('service', 'endpoints', 'name', 'method', 'name', 'method', 'limits',
+                          'rate', 'burst'), raw.key_strings)
+        doc = [raw, DESCRIPTOR, raw, DESCRIPTOR]
+        data = pysmile.encode(doc)
+        self.assertEqual([DESCRIPTOR] * 4, pysmile.decode(data))
+        # The copies after a fragment are written with back references
+        self.assertLess(len(data), 2 * len(raw) + len(pysmile.encode([DESCRIPTOR] * 2)))
+
+    def test_table_wraps(self):
+        raw = RawSmile.from_object({'k{}'.format(i): 'v{}'.format(i) for i in range(700)})
+        doc = [raw, {'k{}'.format(i): 'v{}'.format(i) for i in range(500, 1200)}, raw]
+        self.assertEqual([pysmile.decode(pysmile.encode(raw))] + doc[1:2] +
+                         [pysmile.decode(pysmile.encode(raw))],
+                         pysmile.decode(pysmile.encode(doc)))
+
+    def test_session(self):
+        raw = RawSmile.from_object(DESCRIPTOR)
+        enc, dec = pysmile.SessionEncoder(), pysmile.SessionDecoder()
+        for doc in ([raw, 'inventory'], {'d': DESCRIPTOR, 'r': raw}, ['GET', raw]):
+            expected = pysmile.decode(pysmile.encode(doc))
+            self.assertEqual(expected, dec.decode(enc.encode(doc)))
+
+    def test_invalid(self):
+        # Back references only mean something inside the document that made them
+        data = pysmile.encode(DESCRIPTOR, header=False)
+        self.assertRaises(pysmile.SMILEDecodeError, RawSmile, data)
+        self.assertRaises(pysmile.SMILEDecodeError, RawSmile, b'')
+        self.assertRaises(pysmile.SMILEDecodeError, RawSmile, b'\xf8\xc2')
+        self.assertRaises(pysmile.SMILEDecodeError, RawSmile, b'\xc2\xc4')
+
+    def test_document(self):
+        data = pysmile.encode(DESCRIPTOR, shared_keys=False, shared_vals=False)
+        self.assertRaises(pysmile.SMILEDecodeError, RawSmile, data)
+        self.assertEqual(data[4:], RawSmile(data[4:]))
+
+    def test_stats(self):
+        stats = pysmile.SmileStats()
+        raw = RawSmile.from_object(DESCRIPTOR)
+        pysmile.encode([raw, 1], stats=stats)
+        self.assertEqual(1, stats.tokens['fragment'])
+        self.assertEqual(len(raw), stats.bytes['fragment'])
+
+
+class PySmileTestFragmentCache(unittest.TestCase):
+    def test_cache(self):
+        cache = FragmentCache()
+        self.assertIs(DESCRIPTOR, cache.register(DESCRIPTOR))
+        self.assertIn(DESCRIPTOR, cache)
+        self.assertNotIn(dict(DESCRIPTOR), cache)
+        for i in range(3):
+            doc = {'id': i, 'descriptor': DESCRIPTOR}
+            self.assertEqual(doc, pysmile.decode(pysmile.encode(doc, fragments=cache)))
+        self.assertEqual(1, cache.misses)
+        self.assertEqual(2, cache.hits)
+        cache.unregister(DESCRIPTOR)
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.get(DESCRIPTOR))
+
+    def test_root_and_dump(self):
+        cache = FragmentCache()
+        cache.register(DESCRIPTOR)
+        out = io.BytesIO()
+        pysmile.dump(DESCRIPTOR, out, fragments=cache)
+        self.assertEqual(DESCRIPTOR, pysmile.decode(out.getvalue()))
+        self.assertEqual(1, cache.misses)
+
+    def test_eviction(self):
+        cache = FragmentCache(maxsize=2)
+        tables = [cache.register({'table': i}) for i in range(3)]
+        for table in tables + tables[-1:]:
+            self.assertEqual([table], pysmile.decode(pysmile.encode([table], fragments=cache)))
+        self.assertEqual(3, cache.misses)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(2, len(cache.fragments))
+        self.assertEqual(3, len(cache))
+        self.assertEqual([tables[0]], pysmile.decode(pysmile.encode([tables[0]], fragments=cache)))
+        self.assertEqual(4, cache.misses)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import socket
+import unittest
+import pysmile
+from pysmile import framing
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestFraming(unittest.TestCase):
+    def test_round_trip(self):
+        objs = [{'a': 1}, [1, 2, 3], {'b': ['c', {'d': None}]}]
+        out = bytearray()
+        for o in objs:
+            out.extend(framing.encode_frame(pysmile.encode(o)))
+        reader = framing.FrameReader()
+        got = []
+        # feed one byte at a time to exercise partial headers and payloads
+        for i in range(len(out)):
+            reader.feed(out[i:i + 1])
+            got.extend(pysmile.decode(p) for p in reader.frames())
+        self.assertListEqual(objs, got)
+        self.assertEqual(0, len(reader))
+
+    def test_payload_with_end_marker(self):
+        payload = pysmile.encode({'a': [1, 2]}, ender=True)
+        data = framing.encode_frame(payload) * 2
+        p1, nxt = framing.decode_frame(data)
+        p2, end = framing.decode_frame(data, nxt)
+        self.assertEqual(payload, p1.tobytes())
+        self.assertEqual(payload, p2.tobytes())
+        self.assertEqual(len(data), end)
+        self.assertEqual((None, end), framing.decode_frame(data, end))
+
+    def test_max_frame_size(self):
+        reader = framing.FrameReader(max_frame_size=8)
+        reader.feed(framing.encode_frame(b'x' * 9))
+        self.assertRaises(framing.SMILEFrameError, list, reader.frames())
+
+    def test_batched_socket(self):
+        a, b = socket.socketpair()
+        objs = [{'id': i, 'status': 'OK'} for i in range(100)]
+        with framing.FrameWriter(a, batch_size=1 << 20) as writer:
+            for o in objs:
+                writer.write_object(o)
+        a.close()
+        self.assertEqual(1, writer.flush_count)
+        got = [pysmile.decode(p) for p in framing.iter_frames(b, recv_size=64)]
+        b.close()
+        self.assertListEqual(objs, got)
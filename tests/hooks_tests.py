@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import collections
+import datetime
+import unittest
+import uuid
+import pysmile
+from pysmile.encode import _TYPE_KINDS, _UNKNOWN
+
+__author__ = 'Jonathan Hosmer'
+
+
+class Point(object):
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+def _default(obj):
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    elif isinstance(obj, uuid.UUID):
+        return str(obj)
+    elif isinstance(obj, Point):
+        return {'x': obj.x, 'y': obj.y}
+    raise TypeError(repr(obj))
+
+
+class PySmileTestHooks(unittest.TestCase):
+    def test_default(self):
+        when = datetime.datetime(2015, 3, 1, 12, 30)
+        uid = uuid.UUID(int=7)
+        o = {'when': when, 'id': uid, 'points': [Point(1, 2), Point(3, 4)]}
+        b = pysmile.encode(o, default=_default)
+        self.assertEqual(pysmile.encode({'when': when.isoformat(), 'id': str(uid),
+                                         'points': [{'x': 1, 'y': 2}, {'x': 3, 'y': 4}]}), b)
+        self.assertIs(_UNKNOWN, _TYPE_KINDS[Point])
+
+    def test_default_root_and_chain(self):
+        # default may return another object that needs default
+        b = pysmile.encode(Point(Point(1, 2), 3), default=_default)
+        self.assertEqual({'x': {'x': 1, 'y': 2}, 'y': 3}, pysmile.decode(b))
+
+    def test_default_errors(self):
+        self.assertRaises(TypeError, pysmile.encode, [complex(1, 2)], default=_default)
+        self.assertRaises(ValueError, pysmile.encode, [Point(1, 2)], default=lambda o: o)
+
+    def test_scalar_root(self):
+        for v in (1, 'abc', None, True, 2.5):
+            self.assertEqual(v, pysmile.decode(pysmile.encode(v)))
+
+    def test_object_hook(self):
+        b = pysmile.encode({'p': {'x': 1, 'y': 2}, 'q': [{'x': 3, 'y': 4}]})
+        o = pysmile.decode(b, object_hook=lambda d: Point(d['x'], d['y']) if 'x' in d else d)
+        self.assertEqual((1, 2), (o['p'].x, o['p'].y))
+        self.assertEqual((3, 4), (o['q'][0].x, o['q'][0].y))
+
+    def test_object_pairs_hook(self):
+        o = collections.OrderedDict([('b', 1), ('a', 2), ('c', collections.OrderedDict([('z', 1), ('y', 2)]))])
+        d = pysmile.decode(pysmile.encode(o), object_pairs_hook=collections.OrderedDict,
+                           object_hook=lambda d: self.fail('object_hook called'))
+        self.assertEqual(['b', 'a', 'c'], list(d))
+        self.assertEqual(['z', 'y'], list(d['c']))
+
+    def test_session_hooks(self):
+        enc = pysmile.SessionEncoder(default=_default)
+        dec = pysmile.SessionDecoder(object_hook=lambda d: Point(d['x'], d['y']))
+        for i in range(3):
+            p = dec.decode(enc.encode([Point(i, -i)]))[0]
+            self.assertEqual((i, -i), (p.x, p.y))
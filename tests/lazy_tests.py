@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import io
+import decimal
+import unittest
+from collections.abc import Mapping, Sequence
+import pysmile
+from pysmile import DecodeLimits, SMILELimitError
+from pysmile.lazy import LazyObject, LazyArray
+
+__author__ = 'Jonathan Hosmer'
+
+
+def _document():
+    return {
+        'users': [{'id': i, 'name': 'user{}'.format(i % 7), 'bio': 'x' * (i * 10),
+                   'score': i / 3.0, 'avatar': bytes([i]) * i, 'big': 1 << (64 + i),
+                   'd': decimal.Decimal('1.{}'.format(i))}
+                  for i in range(60)],
+        'keys': {'k{}'.format(i): 'v{}'.format(i % 50) for i in range(1500)},
+        'meta': {'count': 60, 'empty': {}, 'none': [], 'nested': [[[]]]},
+    }
+
+
+class PySmileTestLazy(unittest.TestCase):
+    def test_equal(self):
+        doc = _document()
+        for kwargs in ({}, {'shared_keys': False}, {'shared_vals': False}, {'bin_7bit': False},
+                       {'compress': True}):
+            lazy = pysmile.decode(pysmile.encode(doc, **kwargs), lazy=True)
+            self.assertEqual(doc, lazy)
+            self.assertEqual(doc, lazy.materialize())
+
+    def test_proxies(self):
+        lazy = pysmile.decode(pysmile.encode(_document()), lazy=True)
+        self.assertIsInstance(lazy, LazyObject)
+        self.assertIsInstance(lazy, Mapping)
+        users = lazy['users']
+        self.assertIsInstance(users, LazyArray)
+        self.assertIsInstance(users, Sequence)
+        self.assertEqual(60, len(users))
+        self.assertIs(users, lazy['users'])
+        self.assertEqual('user3', users[3]['name'])
+        self.assertEqual(59, users[-1]['id'])
+        self.assertEqual([0, 1], [u['id'] for u in users[:2]])
+        self.assertEqual(['users', 'keys', 'meta'], list(lazy))
+        self.assertIn('meta', lazy)
+        self.assertEqual('v25', lazy['keys']['k1475'])
+        self.assertIsNone(lazy.get('missing'))
+        self.assertEqual(dict, type(lazy['meta'].materialize()))
+        self.assertEqual([[[]]], lazy['meta']['nested'])
+        self.assertRaises(TypeError, hash, users)
+        with self.assertRaises(TypeError):
+            users[0] = 1
+
+    def test_back_references_across_proxies(self):
+        # Strings referenced in later branches were written in full in skipped ones
+        doc = [{'name': 'n{}'.format(i % 40), 'tag': 'shared'} for i in range(3000)]
+        lazy = pysmile.decode(pysmile.encode(doc), lazy=True)
+        self.assertEqual(doc[2999], lazy[2999])
+        self.assertEqual(doc[1024], lazy[1024])
+        self.assertEqual(doc, lazy)
+
+    def test_untouched_values_not_decoded(self):
+        doc = [{'blob': '\xe9' * 500}, {'ok': True}]
+        data = bytearray(pysmile.encode(doc))
+        # Invalid UTF-8 inside a long string that is not accessed
+        data[data.index('\xe9'.encode('utf-8') * 500) + 10] = 0xFF
+        lazy = pysmile.decode(bytes(data), lazy=True)
+        self.assertEqual({'ok': True}, lazy[1])
+        self.assertRaises(pysmile.SMILEDecodeError, lazy[0].__getitem__, 'blob')
+
+    def test_scalars_and_load(self):
+        self.assertEqual('text', pysmile.decode(pysmile.encode('text'), lazy=True))
+        self.assertEqual(7, pysmile.decode(pysmile.encode(7), lazy=True))
+        lazy = pysmile.load(io.BytesIO(pysmile.encode({'a': [1]})), lazy=True)
+        self.assertEqual([1], lazy['a'])
+
+    def test_invalid(self):
+        self.assertRaises(pysmile.SMILEDecodeError, pysmile.decode, b':)\n\x03\xfa\x80a\xf9',
+                          lazy=True)
+        self.assertRaises(pysmile.SMILEDecodeError, pysmile.decode, b':)\n\x03\xf8\xc2',
+                          lazy=True)
+        self.assertRaises(pysmile.SMILEDecodeError, pysmile.decode, b':)\n\x03\xf8\xf9\xc2',
+                          lazy=True)
+        self.assertRaises(ValueError, pysmile.decode, pysmile.encode([1]), lazy=True,
+                          object_hook=dict)
+        with self.assertRaises(SMILELimitError):
+            pysmile.decode(pysmile.encode([[[1]]]), lazy=True, limits=DecodeLimits(max_depth=2))
+        with self.assertRaises(SMILELimitError):
+            pysmile.decode(pysmile.encode(['x' * 100]), lazy=True,
+                           limits=DecodeLimits(max_string_length=10))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import io
+import time
+import decimal
+import unittest
+import pysmile
+from pysmile import DecodeLimits, SMILELimitError
+from pysmile.decode import iter_load
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestLimits(unittest.TestCase):
+    def assertLimit(self, limit, offset, data, **kwargs):
+        with self.assertRaises(SMILELimitError) as cm:
+            pysmile.decode(data, limits=DecodeLimits(**kwargs))
+        self.assertEqual(limit, cm.exception.limit)
+        self.assertEqual(offset, cm.exception.offset)
+        self.assertIn('at offset {}'.format(offset), str(cm.exception))
+
+    def test_unlimited_by_default(self):
+        doc = [[[[['x' * 100000]]]]]
+        self.assertEqual(doc, pysmile.decode(pysmile.encode(doc)))
+        self.assertEqual(doc, pysmile.decode(pysmile.encode(doc), limits=DecodeLimits()))
+
+    def test_depth(self):
+        data = pysmile.encode([[[{'a': [1]}]]])
+        self.assertEqual([[[{'a': [1]}]]], pysmile.decode(data, limits=DecodeLimits(max_depth=5)))
+        # The array under 'a' opens at offset 10
+        self.assertLimit('max_depth', 10, data, max_depth=4)
+        self.assertLimit('max_depth', 4, data, max_depth=0)
+
+    def test_deep_input_fails_fast(self):
+        data = b':)\n\x03' + b'\xf8' * 1000000
+        start = time.time()
+        self.assertLimit('max_depth', 4 + 1000, data)
+        self.assertLess(time.time() - start, 1)
+
+    def test_string_length(self):
+        data = pysmile.encode(['short', 'x' * 100])
+        self.assertLimit('max_string_length', 11, data, max_string_length=99)
+        self.assertEqual(['short', 'x' * 100],
+                         pysmile.decode(data, limits=DecodeLimits(max_string_length=100)))
+        # Short tokens too, and keys
+        self.assertLimit('max_string_length', 5, data, max_string_length=4)
+        self.assertLimit('max_string_length', 5, pysmile.encode({'k' * 80: 1}),
+                         max_string_length=64)
+
+    def test_unterminated_string(self):
+        # A long string token without its end marker is rejected after max_string_length
+        # bytes, not at the end of the input
+        data = b':)\n\x03\xf8\xe0' + b'x' * 1000
+        self.assertLimit('max_string_length', 5, data, max_string_length=100)
+        with self.assertRaises(pysmile.SMILEDecodeError) as cm:
+            pysmile.decode(data, limits=DecodeLimits(max_string_length=2000))
+        self.assertNotIsInstance(cm.exception, SMILELimitError)
+
+    def test_binary_length(self):
+        for bin_7bit in (True, False):
+            data = pysmile.encode([b'\x00' * 100], bin_7bit=bin_7bit)
+            self.assertLimit('max_binary_length', 5, data, max_binary_length=99)
+            self.assertEqual([b'\x00' * 100],
+                             pysmile.decode(data, limits=DecodeLimits(max_binary_length=100)))
+
+    def test_claimed_length(self):
+        # The length is checked before the payload is looked for
+        data = b':)\n\x07\xf8\xfd' + b'\x3f' * 8 + b'\xbf'
+        self.assertLimit('max_binary_length', 5, data)
+
+    def test_number_length(self):
+        big = 1 << 8000
+        self.assertLimit('max_number_length', 5, pysmile.encode([big]))
+        self.assertLimit('max_number_length', 5, pysmile.encode([decimal.Decimal(big)]))
+        limits = DecodeLimits(max_number_length=None)
+        self.assertEqual([big], pysmile.decode(pysmile.encode([big]), limits=limits))
+        self.assertEqual([decimal.Decimal(big)],
+                         pysmile.decode(pysmile.encode([decimal.Decimal(big)]), limits=limits))
+
+    def test_elements(self):
+        data = pysmile.encode({'a': [1, 2], 'b': {}})
+        self.assertEqual({'a': [1, 2], 'b': {}},
+                         pysmile.decode(data, limits=DecodeLimits(max_elements=5)))
+        # Root, [1, 2], 1 and 2: the object under 'b' is the fifth value
+        self.assertLimit('max_elements', 13, data, max_elements=4)
+
+    def test_document_size(self):
+        data = pysmile.encode(list(range(1000)))
+        self.assertLimit('max_document_size', 100, data, max_document_size=100)
+        self.assertLimit('max_document_size', 100, io.BytesIO(data).read(), max_document_size=100)
+        with self.assertRaises(SMILELimitError):
+            pysmile.load(io.BytesIO(data), limits=DecodeLimits(max_document_size=100))
+        self.assertEqual(list(range(1000)),
+                         pysmile.load(io.BytesIO(data), limits=DecodeLimits(max_document_size=len(data))))
+
+    def test_decompression_bomb(self):
+        bomb = pysmile.encode(['x' * (8 << 20)], compress=True)
+        self.assertLess(len(bomb), 64 * 1024)
+        with self.assertRaises(SMILELimitError):
+            pysmile.decode(bomb, limits=DecodeLimits(max_document_size=1 << 20))
+        with self.assertRaises(SMILELimitError):
+            pysmile.load(io.BytesIO(bomb), limits=DecodeLimits(max_document_size=1 << 20))
+
+    def test_shared_strings(self):
+        data = pysmile.encode([{'k{}'.format(i): i} for i in range(20)])
+        # The eleventh key, 'k10', has its token at offset 66 and is refused once it is read
+        self.assertLimit('max_shared_strings', 66 + 4, data, max_shared_strings=10)
+        self.assertEqual(20, len(pysmile.decode(data, limits=DecodeLimits(max_shared_strings=20))))
+        # Lazy decoding: the strings are collected by the scan, up front
+        with self.assertRaises(SMILELimitError) as cm:
+            pysmile.decode(data, limits=DecodeLimits(max_shared_strings=10), lazy=True)
+        self.assertEqual('max_shared_strings', cm.exception.limit)
+        self.assertEqual(66 + 4, cm.exception.offset)
+        values = pysmile.encode(['v{}'.format(i) for i in range(50)])
+        with self.assertRaises(SMILELimitError):
+            pysmile.decode(values, limits=DecodeLimits(max_shared_strings=10), lazy=True)
+        self.assertEqual(20, len(pysmile.decode(data, limits=DecodeLimits(max_shared_strings=20),
+                                                lazy=True)))
+
+    def test_iter_load(self):
+        docs = b''.join(pysmile.encode([i, 'x' * 10 * i], ender=True) for i in range(10))
+        limits = DecodeLimits(max_string_length=55)
+        loaded = iter_load(io.BytesIO(docs), read_size=7, limits=limits)
+        self.assertEqual([[i, 'x' * 10 * i] for i in range(6)], [next(loaded) for _ in range(6)])
+        with self.assertRaises(SMILELimitError) as cm:
+            next(loaded)
+        # Offsets are relative to the start of the document
+        self.assertEqual(6, cm.exception.offset)
+
+    def test_session(self):
+        enc = pysmile.SessionEncoder()
+        dec = pysmile.SessionDecoder(limits=DecodeLimits(max_depth=2))
+        self.assertEqual([[1]], dec.decode(enc.encode([[1]])))
+        self.assertRaises(SMILELimitError, dec.decode, enc.encode([[[1]]]))
+
+    def test_many_small_documents(self):
+        # One buffer holding many documents is decoded in place, not copied per document
+        one = pysmile.encode({'a': 1}, ender=True)
+        for count in (2000, 20000):
+            data = one * count
+            start = time.time()
+            self.assertEqual(count, sum(1 for _ in iter_load(io.BytesIO(data),
+                                                              read_size=len(data))))
+            elapsed = time.time() - start
+            if count == 2000:
+                small = elapsed
+        self.assertLess(elapsed, max(small, 0.01) * 30)
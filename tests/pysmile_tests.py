@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 import os
 import glob
 import unittest
@@ -20,8 +20,8 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -36,8 +36,8 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -52,8 +52,8 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -68,8 +68,8 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -84,8 +84,40 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
+        else:
+            if isinstance(a, list):
+                self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
+            elif isinstance(a, dict):
+                self.assertDictEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
+            else:
+                self.fail('Unexpected Type: {!r}'.format(type(a)))
+    
+    def test_numbers_fp_4k(self):
+        s = os.path.join(self.smile_dir, 'numbers-fp-4k.smile')
+        j = os.path.join(self.json_dir, 'numbers-fp-4k.jsn')
+        b = json.load(open(j, 'rb'))
+        try:
+            a = pysmile.decode(open(s, 'rb').read())
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
+        else:
+            if isinstance(a, list):
+                self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
+            elif isinstance(a, dict):
+                self.assertDictEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
+            else:
+                self.fail('Unexpected Type: {!r}'.format(type(a)))
+    
+    def test_numbers_fp_64k(self):
+        s = os.path.join(self.smile_dir, 'numbers-fp-64k.smile')
+        j = os.path.join(self.json_dir, 'numbers-fp-64k.jsn')
+        b = json.load(open(j, 'rb'))
+        try:
+            a = pysmile.decode(open(s, 'rb').read())
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -100,8 +132,8 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -116,8 +148,8 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -132,8 +164,8 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -148,8 +180,8 @@ class PySmileTestDecode(unittest.TestCase):
         b = json.load(open(j, 'rb'))
         try:
             a = pysmile.decode(open(s, 'rb').read())
-        except pysmile.SMILEDecodeError, e:
-            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e.args[1]))
+        except pysmile.SMILEDecodeError as e:
+            self.fail('Failed to decode:\n{!r}\n{!r}'.format(b, e))
         else:
             if isinstance(a, list):
                 self.assertListEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
@@ -200,6 +232,20 @@ class PySmileTestEncode(unittest.TestCase):
         b = open(s, 'rb').read()
         self.assertEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
     
+    def test_numbers_fp_4k(self):
+        s = os.path.join(self.smile_dir, 'numbers-fp-4k.smile')
+        j = os.path.join(self.json_dir, 'numbers-fp-4k.jsn')
+        a = pysmile.encode(json.load(open(j, 'rb')))
+        b = open(s, 'rb').read()
+        self.assertEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
+    
+    def test_numbers_fp_64k(self):
+        s = os.path.join(self.smile_dir, 'numbers-fp-64k.smile')
+        j = os.path.join(self.json_dir, 'numbers-fp-64k.jsn')
+        a = pysmile.encode(json.load(open(j, 'rb')))
+        b = open(s, 'rb').read()
+        self.assertEqual(a, b, '{}\nExpected:\n{!r}\nGot:\n{!r}'.format(s, b, a))
+    
     def test_numbers_int_4k(self):
         s = os.path.join(self.smile_dir, 'numbers-int-4k.smile')
         j = os.path.join(self.json_dir, 'numbers-int-4k.jsn')
@@ -232,33 +278,33 @@ class PySmileTestEncode(unittest.TestCase):
 class PySmileTestMisc(unittest.TestCase):
     def test_1(self):
         a = [1]
-        b = pysmile.decode(':)\n\x03\xf8\xc2\xf9')
+        b = pysmile.decode(b':)\n\x03\xf8\xc2\xf9')
         self.assertListEqual(a, b, 'Expected:\n{!r}\nGot:\n{!r}'.format(a, b))
 
     def test_2(self):
         a = [1, 2]
-        b = pysmile.decode(':)\n\x03\xf8\xc2\xc4\xf9')
+        b = pysmile.decode(b':)\n\x03\xf8\xc2\xc4\xf9')
         self.assertListEqual(a, b, 'Expected:\n{!r}\nGot:\n{!r}'.format(a, b))
 
     def test_3(self):
         a = [1, 2, {'c': 3}]
-        b = pysmile.decode(':)\n\x03\xf8\xc2\xc4\xfa\x80c\xc6\xfb\xf9')
+        b = pysmile.decode(b':)\n\x03\xf8\xc2\xc4\xfa\x80c\xc6\xfb\xf9')
         self.assertListEqual(a, b, 'Expected:\n{!r}\nGot:\n{!r}'.format(a, b))
 
     def test_4(self):
         a = {'a': 1}
-        b = pysmile.decode(':)\n\x03\xfa\x80a\xc2\xfb')
+        b = pysmile.decode(b':)\n\x03\xfa\x80a\xc2\xfb')
         self.assertDictEqual(a, b, 'Expected:\n{!r}\nGot:\n{!r}'.format(a, b))
 
     def test_5(self):
         a = {'a': '1', 'b': 2, 'c': [3], 'd': -1, 'e': 4.20}
         b = pysmile.decode(
-            ':)\n\x03\xfa\x80a@1\x80c\xf8\xc6\xf9\x80b\xc4\x80e(fL\x19\x04\x04\x80d\xc1\xfb')
+            b':)\n\x03\xfa\x80a@1\x80c\xf8\xc6\xf9\x80b\xc4\x80e)\x00@\x083\x19Lf3\x19M\x80d\xc1\xfb')
         self.assertDictEqual(a, b, 'Expected:\n{!r}\nGot:\n{!r}'.format(a, b))
 
     def test_6(self):
         a = {'a': {'b': {'c': {'d': ['e']}}}}
         b = pysmile.decode(
-                ':)\n\x03\xfa\x80a\xfa\x80b\xfa\x80c\xfa\x80d\xf8@e\xf9\xfb\xfb\xfb\xfb')
+                b':)\n\x03\xfa\x80a\xfa\x80b\xfa\x80c\xfa\x80d\xf8@e\xf9\xfb\xfb\xfb\xfb')
         self.assertDictEqual(a, b, 'Expected:\n{!r}\nGot:\n{!r}'.format(a, b))
 
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import io
+import unittest
+import collections
+import pysmile
+from pysmile import schema
+from pysmile.decode import iter_load
+from pysmile.schema import RecordDecoder, SMILESchemaError, compile_encoder
+
+__author__ = 'Jonathan Hosmer'
+
+
+class Point(object):
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        raise AssertionError('Records are built without calling __init__')
+
+
+class Point3(Point):
+    __slots__ = 'z'
+
+
+Pair = collections.namedtuple('Pair', 'key value')
+Span = collections.namedtuple('Span', 'start end step', defaults=(1,))
+
+
+class PySmileTestRecords(unittest.TestCase):
+    def test_slots(self):
+        data = pysmile.encode([{'x': 1, 'y': 2}, {'y': 4, 'x': 3}, {'x': 5, 'y': 6, 'z': 7},
+                               {'x': 0}])
+        p1, p2, p3, other = pysmile.decode(data, records=[Point, Point3])
+        self.assertIs(Point, type(p1))
+        self.assertEqual((1, 2, 3, 4), (p1.x, p1.y, p2.x, p2.y))
+        self.assertIs(Point3, type(p3))
+        self.assertEqual((5, 6, 7), (p3.x, p3.y, p3.z))
+        self.assertEqual({'x': 0}, other)
+
+    def test_namedtuples(self):
+        data = pysmile.encode({'pairs': [{'key': 'a', 'value': 1}, {'value': 2, 'key': 'b'}],
+                               'span': {'start': 1, 'end': 5}})
+        doc = pysmile.decode(data, records=(Pair, Span))
+        self.assertEqual([Pair('a', 1), Pair('b', 2)], doc['pairs'])
+        self.assertIs(Pair, type(doc['pairs'][0]))
+        self.assertEqual(Span(1, 5, 1), doc['span'])
+        self.assertIs(dict, type(doc))
+
+    def test_fallback(self):
+        data = pysmile.encode([{'key': 'a', 'value': 1, 'extra': True}, {'key': 'a'},
+                               {'b': 1, 'a': 2}])
+        decoder = RecordDecoder(Pair, fallback=collections.OrderedDict)
+        doc = pysmile.decode(data, records=decoder)
+        self.assertEqual([collections.OrderedDict], list(set(type(o) for o in doc)))
+        self.assertEqual(['b', 'a'], list(doc[2]))
+        self.assertRaises(TypeError, RecordDecoder, Pair, fallbak=dict)
+
+    def test_schema(self):
+        schema = {'id': int, 'origin': {'host': str, 'port': int}, 'tags': [{'my-tag': str}]}
+        decoder = RecordDecoder(compile_encoder(schema, 'event'))
+        self.assertEqual(['Event', 'Origin', 'Tags'], [tp.__name__ for tp in decoder.types])
+        event, origin, tag = decoder.types
+        data = pysmile.encode({'id': 1, 'origin': {'host': 'h', 'port': 80},
+                               'tags': [{'my-tag': 'x'}]})
+        doc = pysmile.decode(data, records=decoder)
+        self.assertEqual(event(1, origin('h', 80), [tag('x')]), doc)
+        # Field names that are not identifiers keep their keys, not their attribute names
+        self.assertEqual('x', doc.tags[0]._0)
+        doc = pysmile.decode(data, records={'id': int, 'origin': object, 'tags': object})
+        self.assertEqual(('Record', {'host': 'h', 'port': 80}),
+                         (type(doc).__name__, doc.origin))
+
+    def test_streams(self):
+        docs = [{'key': i, 'value': str(i)} for i in range(100)]
+        data = b''.join(pysmile.encode(doc, ender=True) for doc in docs)
+        decoder = RecordDecoder(Pair)
+        self.assertEqual([Pair(i, str(i)) for i in range(100)],
+                         list(iter_load(io.BytesIO(data), records=decoder)))
+        self.assertEqual(1, len(decoder.builders))
+        self.assertEqual(Pair(0, '0'), pysmile.load(io.BytesIO(pysmile.encode(docs[0])),
+                                                   records=Pair))
+
+    def test_free_form_objects(self):
+        # Objects that can not be records are not remembered, and the others only up to a
+        # bound
+        dec = RecordDecoder(Pair, Span)
+        docs = [{'k{}'.format(i * 10 + j): j for j in range(5)} for i in range(1000)]
+        docs += [{'k{}'.format(i): 1, 'v{}'.format(i): 2} for i in range(3000)]
+        self.assertEqual(docs, pysmile.decode(pysmile.encode(docs), records=dec))
+        self.assertLessEqual(len(dec.builders), schema.MAX_BUILDERS)
+        self.assertEqual([Pair(1, 2), Span(0, 3)],
+                         pysmile.decode(pysmile.encode([{'key': 1, 'value': 2},
+                                                        {'start': 0, 'end': 3}]), records=dec))
+
+    def test_invalid_types(self):
+        self.assertRaises(SMILESchemaError, RecordDecoder, dict)
+        self.assertRaises(SMILESchemaError, RecordDecoder, Point, int)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+import decimal
+import unittest
+import collections
+import pysmile
+from pysmile.constants import *
+from pysmile.encode import SmileGenerator
+from pysmile.schema import compile_encoder, RecordEncoder, SMILESchemaError
+
+__author__ = 'Jonathan Hosmer'
+
+EVENT = collections.OrderedDict([
+    ('id', int),
+    ('name', str),
+    ('score', (float, None)),
+    ('ok', bool),
+    ('blob', bytes),
+    ('tags', [str]),
+    ('matrix', [[int]]),
+    ('origin', {'host': str, 'port': int}),
+    ('children', [{'n': int}]),
+    ('extra', object),
+    ('', (int, str)),
+])
+
+
+def _event(i):
+    return collections.OrderedDict([
+        ('id', i),
+        ('name', 'event-{}'.format(i % 3)),
+        ('score', None if i % 2 else i / 3.0),
+        ('ok', bool(i % 2)),
+        ('blob', bytes([i % 256]) * 3),
+        ('tags', ['a', 'b'][:i % 3]),
+        ('matrix', [[i, -i], [1 << 40]]),
+        ('origin', {'host': 'h{}'.format(i), 'port': 8000 + i}),
+        ('children', [{'n': j} for j in range(i % 4)]),
+        ('extra', {'any': [decimal.Decimal('1.5'), None]}),
+        ('', 'empty' if i % 2 else i),
+    ])
+
+
+class PySmileTestSchema(unittest.TestCase):
+    def setUp(self):
+        self.encoder = pysmile.compile_encoder(EVENT, 'event')
+
+    def test_same_as_encode(self):
+        for i in range(10):
+            record = _event(i)
+            self.assertEqual(pysmile.encode(record), self.encoder.encode(record))
+            for kwargs in ({'shared_keys': False}, {'shared_vals': False},
+                           {'float_mode': FLOAT_MODE_LOSSLESS}, {'bin_7bit': False}):
+                self.assertEqual(pysmile.encode(record, **kwargs),
+                                 self.encoder.encode(record, **kwargs), kwargs)
+
+    def test_many_records(self):
+        # After the first record the field names are written from back references
+        records = [_event(i) for i in range(50)]
+        sg = SmileGenerator()
+        sg.write_header()
+        sg.write_start_array()
+        sg.write_string('id')
+        for record in records:
+            self.encoder.write(sg, record)
+        sg.write_end_array()
+        self.assertEqual(pysmile.encode(['id'] + records), bytes(sg.output))
+
+    def test_key_table_wraps(self):
+        # More names than the shared key table holds: references have to follow the table
+        records = [_event(i) for i in range(200)]
+        for i, record in enumerate(records):
+            record['extra'] = {'k{}'.format(i * 10 + j): j for j in range(10)}
+        sg = SmileGenerator()
+        sg.write_header()
+        sg.write_start_array()
+        for record in records:
+            self.encoder.write(sg, record)
+        sg.write_end_array()
+        self.assertEqual(pysmile.encode(records), bytes(sg.output))
+        self.assertEqual(records, pysmile.decode(bytes(sg.output),
+                                                 object_pairs_hook=collections.OrderedDict))
+
+    def test_key_table_starts_over_within_a_record(self):
+        # An object field that fills the shared key table: the names of the fields after it
+        # can not be written from the references looked up at the start of the record
+        encoder = compile_encoder({'a': int, 'extra': object, 'b': str})
+        records = [{'a': i, 'extra': {'k{}_{}'.format(i, j): j for j in range(700)}, 'b': 'x'}
+                   for i in range(3)]
+        sg = SmileGenerator()
+        sg.write_header()
+        sg.write_start_array()
+        for record in records:
+            encoder.write(sg, record)
+        sg.write_end_array()
+        self.assertEqual(pysmile.encode(records), bytes(sg.output))
+        self.assertEqual(records, pysmile.decode(bytes(sg.output)))
+
+    def test_session(self):
+        enc, dec = pysmile.SessionEncoder(), pysmile.SessionDecoder()
+        for i in range(5):
+            sg = enc.generator
+            sg.output = bytearray()
+            if not i:
+                sg.write_header()
+            self.encoder.write(sg, _event(i))
+            self.assertEqual(_event(i), dec.decode(bytes(sg.output)))
+
+    def test_subclasses_and_extra_fields(self):
+        class Name(str):
+            pass
+        record = _event(1)
+        expected = pysmile.encode(record)
+        record['name'] = Name(record['name'])
+        record['tags'] = tuple(record['tags'])
+        record['origin'] = collections.OrderedDict(record['origin'])
+        record['not in schema'] = 1
+        self.assertEqual(expected, self.encoder.encode(record))
+
+    def test_type_errors(self):
+        for field, value in (('id', 'one'), ('ok', None), ('tags', 'ab'), ('tags', [1]),
+                             ('origin', [1]), ('score', 'x'), ('', 1.5)):
+            record = _event(0)
+            record[field] = value
+            with self.assertRaises(pysmile.SMILEEncodeError) as cm:
+                self.encoder.encode(record)
+            self.assertIn(repr(field), str(cm.exception))
+        class Tags(list):
+            pass
+        for value in (Tags(['a', 1]), Tags([['a']])):
+            record = _event(0)
+            record['tags'] = value
+            with self.assertRaises(pysmile.SMILEEncodeError) as cm:
+                self.encoder.encode(record)
+            self.assertIn("'tags'", str(cm.exception))
+        xs = compile_encoder({'xs': [int]})
+        with self.assertRaises(pysmile.SMILEEncodeError):
+            xs.encode({'xs': Tags(['a'])})
+        self.assertEqual(pysmile.encode({'xs': [1, True]}), xs.encode({'xs': Tags([1, True])}))
+        record = _event(0)
+        del record['name']
+        self.assertRaises(KeyError, self.encoder.encode, record)
+
+    def test_nested_encoder(self):
+        point = compile_encoder({'x': int, 'y': int}, 'point')
+        line = compile_encoder([('a', point), ('b', (point, None))])
+        self.assertIsInstance(line, RecordEncoder)
+        record = {'a': {'x': 1, 'y': 2}, 'b': None}
+        self.assertEqual(pysmile.encode(record), line.encode(record))
+
+    def test_invalid_schemas(self):
+        for schema in ({'a': list}, {'a': (int, [int])}, {'a': ([int], {'b': int})},
+                       {1: int}, [('a', int), ('a', str)], {'a': [int, str]}):
+            self.assertRaises(SMILESchemaError, compile_encoder, schema)
+        self.assertRaises(SMILESchemaError, compile_encoder, {'a': int}, 'not a name')
+
+    def test_source(self):
+        source = compile_encoder({'name': str}, 'named').source
+        self.assertTrue(source.startswith('def named(sg, rec):'))
+        self.assertIn("rec['name']", source)
+        self.assertNotIn('for ', source)
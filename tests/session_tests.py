@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import unittest
+import pysmile
+from pysmile import session
+
+__author__ = 'Jonathan Hosmer'
+
+
+class PySmileTestSession(unittest.TestCase):
+    def test_round_trip(self):
+        enc = session.SessionEncoder()
+        dec = session.SessionDecoder()
+        msgs = [{'status': 'OK', 'region': 'us-east-1', 'code': i} for i in range(50)]
+        sizes = []
+        for m in msgs:
+            data = enc.encode(m)
+            sizes.append(len(data))
+            self.assertDictEqual(m, dec.decode(data))
+        # After the first message keys and values are all back references
+        self.assertLess(sizes[-1], sizes[0] - 20)
+
+    def test_plain_decode_of_first_document(self):
+        enc = session.SessionEncoder()
+        self.assertDictEqual({'a': 'b'}, pysmile.decode(enc.encode({'a': 'b'})))
+
+    def test_repeat_header(self):
+        enc = session.SessionEncoder(repeat_header=True)
+        enc.encode([1])
+        self.assertTrue(enc.encode([2]).startswith(b':)\n'))
+
+    def test_lru_eviction(self):
+        enc = session.SessionEncoder()
+        dec = session.SessionDecoder()
+        # More distinct keys and values than fit in the tables, with a hot set that must
+        # survive eviction on both sides
+        for i in range(3000):
+            m = {'hot': 'value', 'key_{}'.format(i): 'val_{}'.format(i)}
+            self.assertDictEqual(m, dec.decode(enc.encode(m)))
+        self.assertGreater(enc.generator.shared_keys.evictions, 0)
+        self.assertListEqual(enc.generator.shared_keys.slots, dec.shared_keys.slots)
+        self.assertListEqual(enc.generator.shared_values.slots, dec.shared_values.slots)
+        # start object, key reference, value reference, end object
+        self.assertGreaterEqual(6, len(enc.encode({'hot': 'value'})))
+
+    def test_failed_encode(self):
+        # Strings of a document that fails to encode are not left in the tables
+        enc = session.SessionEncoder()
+        dec = session.SessionDecoder()
+        self.assertEqual({'a': 'x'}, dec.decode(enc.encode({'a': 'x'})))
+        with self.assertRaises(TypeError):
+            enc.encode({'b': 'y', 'c': object()})
+        circular = {'d': 'v'}
+        circular['e'] = [circular]
+        with self.assertRaises(ValueError):
+            enc.encode(circular)
+        self.assertEqual({'b': 'y', 'z': 'w'}, dec.decode(enc.encode({'b': 'y', 'z': 'w'})))
+        # Full tables: evictions and the least recently used order are undone as well
+        for i in range(1100):
+            m = {'key_{}'.format(i): 'val_{}'.format(i), 'a': 'x'}
+            self.assertEqual(m, dec.decode(enc.encode(m)))
+        with self.assertRaises(TypeError):
+            enc.encode([{'key_{}'.format(i): 'new_{}'.format(i) for i in range(500)}, 'x',
+                        {'key_900': 'val_5'}, object()])
+        for enc_table, dec_table in ((enc.generator.shared_keys, dec.shared_keys),
+                                     (enc.generator.shared_values, dec.shared_values)):
+            self.assertEqual(dec_table.slots, enc_table.slots)
+            self.assertEqual(list(dec_table.lru), list(enc_table.lru))
+        for i in range(1100, 1300):
+            m = {'key_{}'.format(i): 'val_{}'.format(i), 'a': 'x'}
+            self.assertEqual(m, dec.decode(enc.encode(m)))
+
+    def test_table_skips_invalid_back_refs(self):
+        table = session.SharedStringTable(512)
+        slots = [table.append(str(i)) for i in range(600)]
+        self.assertNotIn(0xFE, slots)
+        self.assertNotIn(0xFF, slots)
+        self.assertEqual(508, len(set(slots)))
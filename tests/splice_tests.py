@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import io
+import unittest
+import pysmile
+from pysmile import splice
+from pysmile.splice import SMILESpliceError
+from pysmile.compress import compress
+
+__author__ = 'Jonathan Hosmer'
+
+
+def _records(count, offset=0):
+    return [{'name': 'n{}'.format(i % 40), 'value': 'v{}'.format(i % 1500),
+             'data': b'\x00\xff' * (i % 3), 'more': [i, i / 3.0, 'long' * 20]}
+            for i in range(offset, offset + count)]
+
+
+class _Reads(io.BytesIO):
+    """BytesIO that counts the bytes read from it"""
+
+    def __init__(self, data):
+        super(_Reads, self).__init__(data)
+        self.bytes_read = 0
+
+    def read(self, n=-1):
+        data = super(_Reads, self).read(n)
+        self.bytes_read += len(data)
+        return data
+
+
+class PySmileTestAppend(unittest.TestCase):
+    def test_bytearray(self):
+        for kwargs in ({}, {'shared_keys': False, 'shared_vals': False}, {'bin_7bit': False}):
+            for ender in (False, True):
+                data = bytearray(pysmile.encode(_records(1500), ender=ender, **kwargs))
+                splice.append(data, _records(500, 1500))
+                splice.append(data, [])
+                splice.append(data, iter(['x', None]))
+                self.assertEqual(_records(2000) + ['x', None], pysmile.decode(data))
+                self.assertEqual(ender, data.endswith(b'\xff'))
+
+    def test_file(self):
+        fp = io.BytesIO(pysmile.encode(_records(1500), ender=True) + b'\xff' * 100)
+        splice.append(fp, _records(500, 1500))
+        self.assertEqual(_records(2000), pysmile.decode(fp.getvalue()))
+        self.assertTrue(fp.getvalue().endswith(b'\xf9' + b'\xff' * 101))
+
+    def test_empty(self):
+        data = bytearray(pysmile.encode([]))
+        splice.append(data, [{'a': 1}])
+        self.assertEqual([{'a': 1}], pysmile.decode(data))
+
+    def test_cost(self):
+        fp = _Reads(pysmile.encode(_records(5000)))
+        size = len(fp.getvalue())
+        splice.append(fp, [{'name': 'new'}])
+        self.assertLess(fp.bytes_read, 100)
+        self.assertLess(len(fp.getvalue()) - size, 20)
+
+    def test_no_back_references(self):
+        data = bytearray(pysmile.encode(['abc'] * 5))
+        splice.append(data, ['abc', {'k': 'abc'}, {'k': 'abc'}])
+        appended = pysmile.encode(['abc', {'k': 'abc'}, {'k': 'abc'}], shared_keys=False,
+                                  shared_vals=False)[5:-1]
+        self.assertEqual(appended, data[-1 - len(appended):-1])
+        self.assertEqual(['abc'] * 6 + [{'k': 'abc'}] * 2, pysmile.decode(data))
+
+    def test_invalid(self):
+        for data in (pysmile.encode({'a': [1]}), pysmile.encode([1]) + b'\x00', b'[]',
+                     compress(pysmile.encode(list(range(1000))), threshold=0)):
+            self.assertRaises(SMILESpliceError, splice.append, bytearray(data), [1])
+            self.assertRaises(SMILESpliceError, splice.append, io.BytesIO(data), [1])
+        self.assertRaises(TypeError, splice.append, pysmile.encode([1]), [2])
+
+
+class PySmileTestConcat(unittest.TestCase):
+    def test_concat(self):
+        parts = [_records(1500), _records(700, 1500), [], _records(1000, 2200)]
+        for kwargs in ({}, {'shared_vals': False}, {'shared_keys': False, 'bin_7bit': False}):
+            data = splice.concat([pysmile.encode(parts[0])] +
+                                 [pysmile.encode(p, ender=True, **kwargs) for p in parts[1:]])
+            self.assertEqual(_records(3200), pysmile.decode(data))
+
+    def test_same_as_encode(self):
+        # The joined tables are those of a single document
+        parts = [_records(300), _records(300, 300), _records(300, 600)]
+        self.assertEqual(pysmile.encode(sum(parts, [])),
+                         splice.concat(pysmile.encode(p) for p in parts))
+
+    def test_first_copied(self):
+        first = pysmile.encode(_records(100))
+        data = splice.concat([first, pysmile.encode([1])], ender=True)
+        self.assertEqual(first[:-1], data[:len(first) - 1])
+        self.assertEqual(b'\xc2\xf9\xff', data[len(first) - 1:])
+
+    def test_header(self):
+        data = splice.concat([pysmile.encode([b'x'], shared_vals=False, bin_7bit=False),
+                              pysmile.encode(['a', 'a'], shared_keys=False)])
+        self.assertEqual(pysmile.encode([b'x', 'a', 'a'], bin_7bit=False), data)
+
+    def test_compressed(self):
+        parts = [_records(500), _records(500, 500)]
+        self.assertEqual(_records(1000), pysmile.decode(splice.concat(
+            compress(pysmile.encode(p), threshold=0) for p in parts)))
+
+    def test_invalid(self):
+        self.assertRaises(SMILESpliceError, splice.concat, [])
+        self.assertRaises(SMILESpliceError, splice.concat, [pysmile.encode({'a': 1})])
+        for data in (pysmile.encode([1])[:-1], pysmile.encode([1]) + b'\xc2',
+                     b':)\n\x03\xf8\xfa\x80a\xc2\xf9'):
+            self.assertRaises(pysmile.SMILEDecodeError, splice.concat, [pysmile.encode([1]), data])
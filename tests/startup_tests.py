@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import os
+import sys
+import unittest
+import subprocess
+import pysmile
+
+__author__ = 'Jonathan Hosmer'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _imported(code, modules):
+    """Which of *modules* are loaded after running *code* in a fresh interpreter"""
+    code += '; import sys; print(" ".join(m for m in {!r} if m in sys.modules))'.format(modules)
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  env=dict(os.environ, PYTHONPATH=ROOT))
+    return out.decode('ascii').split()
+
+
+class PySmileTestStartup(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        heavy = ('decimal', 'logging', 'json', 're', 'multiprocessing', 'collections',
+                 'pysmile.session')
+        code = "import pysmile; pysmile.decode(pysmile.encode({'a': [1, 2.5, 'x', b'y']}))"
+        self.assertEqual([], _imported(code, heavy))
+
+    def test_decimal_on_demand(self):
+        code = "import pysmile; pysmile.decode(b':)\\n\\x03\\xf8*\\x82\\x81\\x07\\x01\\xf9')"
+        self.assertEqual(['decimal'], _imported(code, ('decimal', 'logging')))
+
+    def test_lazy_session(self):
+        self.assertIs(pysmile.SessionEncoder, pysmile.session.SessionEncoder)
+        self.assertIn('SessionDecoder', pysmile.__all__)
+        self.assertRaises(AttributeError, getattr, pysmile, 'NoSuchThing')
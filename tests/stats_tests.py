@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import decimal
+import io
+import unittest
+import pysmile
+from pysmile import SmileStats, SessionEncoder, SessionDecoder
+
+__author__ = 'Jonathan Hosmer'
+
+
+def _counters(stats):
+    d = stats.as_dict()
+    del d['phases']
+    return d
+
+
+class PySmileTestStats(unittest.TestCase):
+    def setUp(self):
+        self.doc = {
+            'name': 'pysmile',
+            'tags': ['a', 'b', 'a', 'b'],
+            'n': [0, 15, 1 << 20, 1 << 40, 1 << 70],
+            'f': 1.5,
+            'd': decimal.Decimal('1.25'),
+            'bin': b'\x00\x01',
+            'long': 'x' * 100,
+            'nested': {'deeper': [[{'name': ''}]]},
+            '': None,
+        }
+
+    def test_histogram(self):
+        stats = SmileStats()
+        b = pysmile.encode(self.doc, stats=stats)
+        self.assertEqual(len(b), stats.total_bytes)
+        t = stats.tokens
+        self.assertEqual(1, t['header'])
+        self.assertEqual(2, t['small_int'])
+        self.assertEqual(2, t['varint'])
+        self.assertEqual(1, t['big_integer'])
+        self.assertEqual(1, t['float'])
+        self.assertEqual(11, stats.bytes['float'])
+        self.assertEqual(1, t['big_decimal'])
+        self.assertEqual(1, t['binary'])
+        self.assertEqual(1, t['long_string'])
+        self.assertEqual(102, stats.bytes['long_string'])
+        self.assertEqual(3, t['tiny_string'])
+        self.assertEqual(2, t['shared_ref'])
+        self.assertEqual(2, t['literal'])
+        self.assertEqual(1, t['key_empty'])
+        self.assertEqual(1, t['key_shared_ref'])
+        self.assertEqual(14, t['container'])
+        self.assertEqual(5, stats.max_depth)
+        self.assertIn('encode', stats.phases)
+
+    def test_shared_rates(self):
+        stats = SmileStats()
+        pysmile.encode(self.doc, stats=stats)
+        self.assertEqual(2, stats.shared_value_hits)
+        self.assertEqual(3, stats.shared_value_misses)
+        self.assertAlmostEqual(0.4, stats.shared_value_hit_rate)
+        self.assertEqual(1, stats.shared_key_hits)
+        self.assertEqual(9, stats.shared_key_misses)
+
+        stats = SmileStats()
+        pysmile.encode(self.doc, shared_keys=False, shared_vals=False, stats=stats)
+        self.assertEqual((0, 0), (stats.shared_value_hits, stats.shared_value_misses))
+        self.assertEqual((0, 0), (stats.shared_key_hits, stats.shared_key_misses))
+        self.assertEqual(0.0, stats.shared_key_hit_rate)
+
+    def test_decode_matches_encode(self):
+        for flags in ({}, {'shared_keys': False}, {'shared_vals': False}, {'bin_7bit': False}):
+            encoded = SmileStats()
+            decoded = SmileStats()
+            b = pysmile.encode(self.doc, stats=encoded, **flags)
+            pysmile.decode(b, stats=decoded)
+            self.assertEqual(_counters(encoded), _counters(decoded))
+            self.assertIn('decode', decoded.phases)
+
+    def test_same_output(self):
+        self.assertEqual(pysmile.encode(self.doc), pysmile.encode(self.doc, stats=SmileStats()))
+        b = pysmile.encode(self.doc)
+        self.assertEqual(pysmile.decode(b), pysmile.decode(b, stats=SmileStats()))
+
+    def test_phases(self):
+        doc = [self.doc] * 50
+        stats = SmileStats()
+        out = io.BytesIO()
+        pysmile.dump(doc, out, compress=True, block_size=1024, stats=stats)
+        self.assertEqual(['encode', 'write'], sorted(stats.phases))
+        out.seek(0)
+        self.assertEqual(pysmile.load(out, stats=stats), pysmile.decode(pysmile.encode(doc)))
+        self.assertEqual(['decode', 'decompress', 'encode', 'write'], sorted(stats.phases))
+        self.assertTrue(all(t >= 0 for t in stats.phases.values()))
+
+    def test_session(self):
+        encoded = SmileStats()
+        decoded = SmileStats()
+        enc = SessionEncoder(stats=encoded)
+        dec = SessionDecoder(stats=decoded)
+        for i in range(3):
+            dec.decode(enc.encode({'status': 'OK', 'id': i}))
+        self.assertEqual(_counters(encoded), _counters(decoded))
+        self.assertEqual(1, encoded.tokens['header'])
+        self.assertEqual(4, encoded.shared_key_hits)
+        self.assertEqual(2, encoded.shared_value_hits)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import io
+import os
+import glob
+import json
+import decimal
+import unittest
+import pysmile
+from pysmile import DecodeLimits, SMILELimitError
+from pysmile.compress import compress
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'json')
+
+
+def _to_json(src, **kwargs):
+    out = io.BytesIO()
+    written = pysmile.transcode_to_json(src, out, **kwargs)
+    assert written == len(out.getvalue())
+    return out.getvalue()
+
+
+def _dumps(doc, ensure_ascii=False):
+    return json.dumps(doc, separators=(',', ':'), ensure_ascii=ensure_ascii).encode('utf-8')
+
+
+class PySmileTestToJson(unittest.TestCase):
+    def setUp(self):
+        self.docs = []
+        for path in sorted(glob.glob(os.path.join(DATA_DIR, '*.jsn'))):
+            with open(path) as f:
+                self.docs.append(json.load(f))
+        self.docs.append([{'name': 'n{}'.format(i % 40), 'value': 'v{}'.format(i % 1500)}
+                          for i in range(3000)])
+
+    def test_same_as_json_dumps(self):
+        for doc in self.docs:
+            for kwargs in ({}, {'shared_keys': False, 'shared_vals': False},
+                           {'float_mode': FLOAT_MODE_LOSSLESS}):
+                data = pysmile.encode(doc, **kwargs)
+                for ensure_ascii in (False, True):
+                    self.assertEqual(_dumps(doc, ensure_ascii),
+                                     _to_json(data, ensure_ascii=ensure_ascii))
+
+    def test_streaming(self):
+        doc = self.docs[-1]
+        data = pysmile.encode(doc)
+        for src in (data, data + b'\xff', compress(data, threshold=0, block_size=100)):
+            for buffer_size in (1, 7, 4096):
+                self.assertEqual(_dumps(doc), _to_json(io.BytesIO(src), buffer_size=buffer_size))
+        self.assertEqual(_dumps(doc), _to_json(compress(data, threshold=0)))
+
+    def test_output_chunks(self):
+        writes = []
+
+        class Sink(object):
+            def write(self, data):
+                writes.append(bytes(data))
+
+        pysmile.transcode_to_json(pysmile.encode(self.docs[-1]), Sink(), buffer_size=1000)
+        self.assertGreater(len(writes), 10)
+        self.assertLess(max(len(w) for w in writes), 1100)
+        self.assertEqual(_dumps(self.docs[-1]), b''.join(writes))
+
+    def test_escaping(self):
+        doc = {'quote"back\\slash': 'ctl\x00\x01\x1f\n\r\t\b\f\x7f', 'é': '  \U0001f600',
+               'long': '"\\\n' * 100}
+        data = pysmile.encode(doc)
+        self.assertEqual(_dumps(doc), _to_json(data))
+        self.assertEqual(_dumps(doc, True), _to_json(data, ensure_ascii=True))
+        self.assertEqual(doc, json.loads(_to_json(data).decode('utf-8')))
+
+    def test_non_ascii(self):
+        # Left as is by default, like json.dumps(..., ensure_ascii=False)
+        data = pysmile.encode({'k\xe9': '\xe9\u20ac\U0001f600'})
+        self.assertEqual('{"k\xe9":"\xe9\u20ac\U0001f600"}'.encode('utf-8'), _to_json(data))
+        self.assertEqual(b'{"k\\u00e9":"\\u00e9\\u20ac\\ud83d\\ude00"}',
+                         _to_json(data, ensure_ascii=True))
+
+    def test_numbers(self):
+        doc = [0, -16, 15, 2 ** 31, -2 ** 63, 2 ** 200, -2 ** 200, 0.1, -0.0, 1e300, 5e-324,
+               float('inf'), float('-inf')]
+        self.assertEqual(_dumps(doc), _to_json(pysmile.encode(doc)))
+        self.assertEqual(b'[0.10000000149011612]',
+                         _to_json(pysmile.encode([0.10000000149011612],
+                                                 float_mode=FLOAT_MODE_LOSSLESS)))
+        self.assertEqual(b'[NaN]', _to_json(pysmile.encode([float('nan')])))
+        self.assertRaises(ValueError, _to_json, pysmile.encode([float('nan')]), allow_nan=False)
+        self.assertEqual(b'[-1.2345E+1000,0.00]',
+                         _to_json(pysmile.encode([decimal.Decimal('-1.2345E+1000'),
+                                                  decimal.Decimal('0.00')])))
+        big = 1 << 20000
+        self.assertEqual(str(decimal.Decimal(big)).encode('ascii'), _to_json(pysmile.encode(big)))
+
+    def test_binary(self):
+        for bin_7bit in (True, False):
+            self.assertEqual(b'{"b":"AAH/"}',
+                             _to_json(pysmile.encode({'b': b'\x00\x01\xff'}, bin_7bit=bin_7bit)))
+
+    def test_scalars(self):
+        for doc in ('text', 1, None, True, [], {}):
+            self.assertEqual(_dumps(doc), _to_json(pysmile.encode(doc)))
+
+    def test_invalid(self):
+        data = pysmile.encode({'a': [1, 2, 3]})
+        for src in (data[:-1], io.BytesIO(data[:-1]), data + b'\x00', io.BytesIO(data + b'\x00'),
+                    b':)\n\x03\xf8\xfb', b':)\n\x03\xfa\xf9', b'{}'):
+            self.assertRaises(pysmile.SMILEDecodeError, _to_json, src)
+        with self.assertRaises(pysmile.SMILEDecodeError) as cm:
+            _to_json(io.BytesIO(b':)\n\x03\xf8\x21\xf9\xf9'), buffer_size=2)
+        self.assertIn('at offset 7', str(cm.exception))
+
+    def test_limits(self):
+        data = pysmile.encode([[['x' * 100]]])
+        with self.assertRaises(SMILELimitError) as cm:
+            _to_json(io.BytesIO(data), limits=DecodeLimits(max_depth=2), buffer_size=3)
+        self.assertEqual(6, cm.exception.offset)
+        with self.assertRaises(SMILELimitError):
+            _to_json(data, limits=DecodeLimits(max_string_length=10))
+        with self.assertRaises(SMILELimitError):
+            _to_json(io.BytesIO(data), limits=DecodeLimits(max_document_size=50))
+
+
+def _from_json(src, **kwargs):
+    out = io.BytesIO()
+    written = pysmile.transcode_from_json(src, out, **kwargs)
+    assert written == len(out.getvalue())
+    return out.getvalue()
+
+
+class PySmileTestFromJson(unittest.TestCase):
+    def setUp(self):
+        self.texts = []
+        for path in sorted(glob.glob(os.path.join(DATA_DIR, '*.jsn'))):
+            with open(path) as f:
+                self.texts.append(f.read())
+        doc = {'esc': 'a"b\\c\n\t\x00\x1f \xe9\U0001f600', 'k\n': [1.5, -0.0, 0.1, 2 ** 70, -5],
+               'rows': [{'name': 'n{}'.format(i % 40), 'value': 'v{}'.format(i % 1500)}
+                        for i in range(3000)]}
+        self.texts.append(json.dumps(doc))
+        self.texts.append(json.dumps(doc, indent=2))
+
+    def test_same_as_encode(self):
+        for text in self.texts:
+            for kwargs in ({}, {'shared_keys': False, 'shared_vals': False},
+                           {'float_mode': FLOAT_MODE_LOSSLESS}):
+                self.assertEqual(pysmile.encode(json.loads(text), **kwargs),
+                                 _from_json(text, **kwargs))
+
+    def test_streaming(self):
+        text = json.dumps([json.loads(self.texts[-1])['esc'], {'k': [-1.5e-5, 'v'] * 30}] * 5,
+                          indent=1)
+        expected = pysmile.encode(json.loads(text))
+        for src in (text, text.encode('utf-8'), text.encode('utf-8-sig')):
+            for buffer_size in (1, 7, 4096):
+                fp = io.StringIO(src) if isinstance(src, str) else io.BytesIO(src)
+                self.assertEqual(expected, _from_json(fp, buffer_size=buffer_size))
+                self.assertEqual(expected, _from_json(src, buffer_size=buffer_size))
+
+    def test_numbers(self):
+        text = '[0, -1, 12345678901234567890123, -1e-5, 2.5E+3, 0.1, NaN, Infinity, -Infinity]'
+        self.assertEqual(pysmile.encode(json.loads(text)), _from_json(text))
+        text = '[1.10, -1e-5, 12345678901234567890.123456789]'
+        self.assertEqual(pysmile.encode(json.loads(text, parse_float=decimal.Decimal)),
+                         _from_json(text, use_decimal=True))
+        self.assertEqual([decimal.Decimal('1.10'), decimal.Decimal('-0.00001'),
+                          decimal.Decimal('12345678901234567890.123456789')],
+                         pysmile.decode(_from_json(text, use_decimal=True)))
+
+    def test_scalars(self):
+        for text in ('"text"', '1', ' null ', 'true', '[]', '{}', '\n[ ]\n'):
+            self.assertEqual(pysmile.encode(json.loads(text)), _from_json(text))
+
+    def test_header_and_ender(self):
+        data = _from_json('{"a":1}', header=False, ender=True)
+        self.assertEqual(b'\xfa\x80a\xc2\xfb\xff', data)
+
+    def test_round_trip(self):
+        text = self.texts[-2]
+        out = io.BytesIO()
+        pysmile.transcode_to_json(_from_json(text), out)
+        self.assertEqual(json.loads(text), json.loads(out.getvalue().decode('utf-8')))
+
+    def test_invalid(self):
+        for text, offset in (('', 0), ('[1,]', 3), ('{"a" 1}', 5), ('{"a":1,}', 7), ('[1 2]', 3),
+                             ('[1] 2', 4), ('{1:2}', 1), ('["a\nb"]', 3), ('[tru]', 1),
+                             ('["abc', 1), ('[1', 2), ('[-]', 1), ('{"a":1]', 6)):
+            for buffer_size in (1, 4096):
+                with self.assertRaises(pysmile.SMILETranscodeError) as cm:
+                    _from_json(io.StringIO(text), buffer_size=buffer_size)
+                self.assertIn('at offset {}'.format(offset), str(cm.exception), text)
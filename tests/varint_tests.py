@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import random
+import unittest
+import pysmile
+from pysmile import varint
+from pysmile.constants import *
+
+__author__ = 'Jonathan Hosmer'
+
+
+def _boundaries():
+    """Powers of two around every bit length up to 64, both signs, plus the Java limits"""
+    values = set()
+    for bits in range(66):
+        for delta in (-1, 0, 1):
+            values.add((1 << bits) + delta)
+            values.add(-(1 << bits) + delta)
+    values.update((MIN_INT_32, MAX_INT_32, MIN_LONG, MAX_LONG))
+    return sorted(v for v in values if MIN_LONG <= v <= MAX_LONG)
+
+
+def _random_values(rnd, n):
+    return [rnd.getrandbits(rnd.randint(1, 63)) * rnd.choice((1, -1)) for _ in range(n)]
+
+
+class PySmileTestVarint(unittest.TestCase):
+    def setUp(self):
+        self.rnd = random.Random(2016)
+        self.values = _boundaries() + _random_values(self.rnd, 5000)
+
+    def test_zigzag(self):
+        for i in self.values:
+            z = varint.zigzag_encode(i)
+            self.assertGreaterEqual(z, 0)
+            self.assertLess(z, 1 << 64)
+            self.assertEqual(i, varint.zigzag_decode(z))
+        self.assertEqual([0, 1, 2, 3, 4], [varint.zigzag_encode(i) for i in (0, -1, 1, -2, 2)])
+
+    def test_vint_round_trip(self):
+        for i in self.values:
+            value = abs(i) & ((1 << 64) - 1)
+            out = bytearray(b'xy')
+            varint.write_vint(out, value)
+            self.assertEqual(2 + max(1, 1 + -(-(value.bit_length() - 6) // 7)), len(out))
+            self.assertTrue(all(b < 0x80 for b in out[2:-1]))
+            self.assertTrue(out[-1] & 0x80)
+            self.assertEqual((value, len(out)), varint.read_vint(out + b'z', 2))
+
+    def test_token_boundaries(self):
+        cases = [(-16, 1), (15, 1), (16, TOKEN_BYTE_INT_32), (-17, TOKEN_BYTE_INT_32),
+                 (MAX_INT_32, TOKEN_BYTE_INT_32), (MIN_INT_32, TOKEN_BYTE_INT_32),
+                 (MAX_INT_32 + 1, TOKEN_BYTE_INT_64), (MIN_INT_32 - 1, TOKEN_BYTE_INT_64),
+                 (MAX_LONG, TOKEN_BYTE_INT_64), (MIN_LONG, TOKEN_BYTE_INT_64),
+                 (MAX_LONG + 1, TOKEN_BYTE_BIG_INTEGER), (MIN_LONG - 1, TOKEN_BYTE_BIG_INTEGER)]
+        for i, token in cases:
+            b = pysmile.encode([i])
+            if token == 1:
+                self.assertEqual(TOKEN_PREFIX_SMALL_INT + varint.zigzag_encode(i), b[5])
+            else:
+                self.assertEqual(token, b[5], i)
+            self.assertEqual([i], pysmile.decode(b))
+        self.assertEqual(1 + 10, len(pysmile.encode([MAX_LONG], header=False)) - 2)
+        self.assertEqual(1 + 5, len(pysmile.encode([MAX_INT_32], header=False)) - 2)
+
+    def test_known_bytes(self):
+        # 1 << 40 (millisecond epochs live here): zigzag 1 << 41 is 42 bits = 6 * 7 + 6 bits
+        self.assertEqual(b':)\n\x03\xf8\x25\x01\x00\x00\x00\x00\x00\x80\xf9',
+                         pysmile.encode([1 << 40]))
+
+    def test_batch_matches_single(self):
+        values = self.values + [True, 3, 4]
+        batched = bytearray()
+        stop = varint.write_ints(batched, values)
+        self.assertEqual(len(self.values), stop)
+        single = bytearray()
+        for i in self.values:
+            varint.write_int(single, i)
+        self.assertEqual(single, batched)
+
+    def test_document_round_trip(self):
+        values = self.values + [self.values[0]] * 100
+        mixed = [1, 2, 'x', 3, None, 1 << 70, -5] + values
+        self.assertEqual(values, pysmile.decode(pysmile.encode(values)))
+        self.assertEqual(tuple(values), tuple(pysmile.decode(pysmile.encode(tuple(values)))))
+        self.assertEqual(mixed, pysmile.decode(pysmile.encode(mixed)))
+
+    def test_bad_vints(self):
+        self.assertRaises(ValueError, varint.read_vint, b'\x01\x02')
+        self.assertRaises(ValueError, varint.read_vint, b'\x01' * 11 + b'\x80')
+        self.assertRaises(ValueError, varint.write_vint, bytearray(), 1 << 64)
+        self.assertRaises(ValueError, varint.write_vint, bytearray(), -1)
+        self.assertRaises(pysmile.SMILEDecodeError, pysmile.decode, b':)\n\x03\xf8\x24\x01\x02')